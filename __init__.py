@@ -22,32 +22,43 @@ bl_info = {
     "category": "Render",
 }
 
-import bpy
-
-from . import ui
-from . import core
-
-
-classes = (
-    ui.TEXCOMPACTOR_PT_main_panel,
-    ui.TEXCOMPACTOR_OT_scan_textures,
-    ui.TEXCOMPACTOR_OT_optimize_textures,
-    ui.TEXCOMPACTOR_OT_show_report,
-)
+try:
+    import bpy
+except ImportError:
+    # the analysis modules are also imported outside of Blender, e.g. by the benchmarks
+    bpy = None
+
+if bpy is not None:
+    from . import ui
+    from . import core
+    from . import library
+    from . import packing
+    from . import table
+
+    classes = (
+        ui.TEXCOMPACTOR_PT_main_panel,
+        ui.TEXCOMPACTOR_OT_scan_textures,
+        ui.TEXCOMPACTOR_OT_optimize_textures,
+        ui.TEXCOMPACTOR_OT_merge_duplicates,
+        ui.TEXCOMPACTOR_OT_clean_store,
+        ui.TEXCOMPACTOR_OT_show_report,
+    )
 
 
-@bpy.app.handlers.persistent
 def clear_addon_data(dummy):
     # Clear or reset your addon data here
     try:
         bpy.context.scene.TC_texture_metadata.clear()
-        bpy.context.scene.TC_texture_metadata = []
+        bpy.context.scene.TC_texture_metadata = table.TextureTable()
+        packing.packs.clear()
     except:
         pass
 
 
 def register():
-    bpy.app.handlers.load_post.append(clear_addon_data)
+    bpy.app.handlers.load_post.append(bpy.app.handlers.persistent(clear_addon_data))
+    bpy.app.handlers.load_post.append(library.load_post)
+    bpy.app.handlers.load_post.append(packing.load_post)
 
     for cls in classes:
         bpy.utils.register_class(cls)
@@ -79,8 +90,8 @@ def register():
     bpy.types.Scene.TC_optimize_float = bpy.props.EnumProperty(
         items=[
             ("0", "Off", "Do nothing"),
-            ("1", "Safe", "Set all float texture to be read at half-precision (16-bit)"),
-            ("2", "Aggressive", "Not Implemented Yet"),
+            ("1", "Safe", "Read float textures at half precision (16-bit) when the measured error is negligible"),
+            ("2", "Aggressive", "Also store float textures as 8-bit when the measured error is small"),
         ],
         name="Float Textures",
         default="1",
@@ -88,6 +99,60 @@ def register():
         update=core.update_memory_usage,
     )
 
+    bpy.types.Scene.TC_fit_budget = bpy.props.BoolProperty(
+        name="Fit to Budget",
+        description=(
+            "Pick the resize and depth of every texture that fits the memory budget with the least quality lost"
+        ),
+        default=False,
+        options=set(),
+        update=core.update_memory_usage,
+    )
+
+    bpy.types.Scene.TC_budget_mb = bpy.props.FloatProperty(
+        name="Memory Budget (MB)",
+        description="Texture memory to fit the scene into",
+        default=4096,
+        min=0,
+        soft_max=65536,
+        step=10000,
+        precision=0,
+        options=set(),
+        update=core.update_memory_usage,
+    )
+
+    bpy.types.Scene.TC_output_format = bpy.props.EnumProperty(
+        items=[
+            ("IMAGE", "PNG/EXR", "Write optimized textures as PNG, or half float EXR for float textures"),
+            ("DDS", "DDS", "Block compress 8 bit textures to BC1/BC3/BC4 DDS, smaller on the GPU in Eevee"),
+        ],
+        name="Output Format",
+        default="IMAGE",
+        options=set(),
+    )
+
+    bpy.types.Scene.TC_channel_pack = bpy.props.BoolProperty(
+        name="Pack Greyscale Maps",
+        description="Merge greyscale data maps of a material, like roughness and metallic, into one RGB texture",
+        default=False,
+        options=set(),
+    )
+
+    bpy.types.Scene.TC_library_mode = bpy.props.BoolProperty(
+        name="Optimize Libraries",
+        description="Write the optimized textures of linked images beside their library, for every file linking it",
+        default=False,
+        options=set(),
+    )
+
+    bpy.types.Scene.TC_library_lookup = bpy.props.BoolProperty(
+        name="Use Optimized Libraries",
+        description="Use the textures optimized beside linked libraries, without scanning them again",
+        default=True,
+        options=set(),
+        update=library.update_lookup,
+    )
+
     bpy.types.Scene.TC_texture_swap = bpy.props.EnumProperty(
         items=[("0", "Original", "Use original textures"), ("1", "Optimized", "Use optimized textures")],
         name="Swap Textures",
@@ -96,17 +161,25 @@ def register():
         update=core.update_texture_swap,
     )
 
-    bpy.types.Scene.TC_texture_metadata = []
+    bpy.types.Scene.TC_texture_metadata = table.TextureTable()
 
 
 def unregister():
     bpy.app.handlers.load_post.remove(clear_addon_data)
+    bpy.app.handlers.load_post.remove(library.load_post)
+    bpy.app.handlers.load_post.remove(packing.load_post)
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
 
     del bpy.types.Scene.TC_convert_greyscale
     del bpy.types.Scene.TC_smart_resize
     del bpy.types.Scene.TC_optimize_float
+    del bpy.types.Scene.TC_fit_budget
+    del bpy.types.Scene.TC_budget_mb
+    del bpy.types.Scene.TC_output_format
+    del bpy.types.Scene.TC_channel_pack
+    del bpy.types.Scene.TC_library_mode
+    del bpy.types.Scene.TC_library_lookup
     del bpy.types.Scene.TC_texture_swap
     del bpy.types.Scene.TC_texture_metadata
 
@@ -0,0 +1,419 @@
+import numpy as np
+
+from . import memory
+from . import pixels
+from . import profiling
+
+# target size of one float32 working block, small enough to stay in cache
+BLOCK_BYTES = 1024 * 1024
+
+# resolution divisors a texture can be resized by
+PYRAMID_FACTORS = (2, 4, 8)
+PYRAMID_ROWS = 64
+# full resolution pixels per side of the tiles the resize error is measured on
+ERROR_TILE = 64
+
+# Rec. 709 luma weights, the same Blender uses when saving BW images
+LUMA = np.array([0.2126, 0.7152, 0.0722], np.float32)
+
+# longest side of the thumbnail the perceptual hash is taken from
+HASH_SAMPLE = 256
+
+# distinct colors are counted up to this many, one more means "lots"
+COLOR_LIMIT = 256
+COLOR_CHUNK = 16384
+
+
+def downsample(pixel_data, factor):
+    """Area-average an (h, w, c) float array by an integer factor.
+
+    Edge pixels are repeated when the size isn't a multiple of the factor.
+    """
+    if factor == 1:
+        return pixel_data
+
+    h, w, channels = pixel_data.shape
+    pad_h, pad_w = -h % factor, -w % factor
+    if pad_h or pad_w:
+        pixel_data = np.pad(pixel_data, ((0, pad_h), (0, pad_w), (0, 0)), mode="edge")
+
+    blocks = pixel_data.reshape((h + pad_h) // factor, factor, (w + pad_w) // factor, factor, channels)
+    # adding up strided slices is several times faster than mean() over two axes
+    rows = blocks[:, 0].astype(np.float32)
+    for i in range(1, factor):
+        rows += blocks[:, i]
+    output = rows[:, :, 0].copy()
+    for i in range(1, factor):
+        output += rows[:, :, i]
+    output *= 1 / (factor * factor)
+    return output
+
+
+def upsample(pixel_data, factor, shape):
+    """Repeat pixels back up to `shape`, undoing downsample for a box filter."""
+    up = np.repeat(np.repeat(pixel_data, factor, axis=0), factor, axis=1)
+    return up[: shape[0], : shape[1]]
+
+
+def detail_lost(band, half):
+    """Squared difference between a band and its half resolution level, summed over channels."""
+    residual = band - upsample(half, 2, band.shape)
+    return np.einsum("ijk,ijk->ij", residual, residual)
+
+
+def add_tiles(tiles, y0, values, tile):
+    """Add up a band of per-pixel values starting at row y0 into a grid of tile x tile sums."""
+    columns = np.add.reduceat(values, np.arange(0, values.shape[1], tile), axis=1, dtype=np.float64)
+    np.add.at(tiles, (y0 + np.arange(values.shape[0])) // tile, columns)
+
+
+def psnr(mse):
+    """Peak signal to noise ratio in dB for pixels in the 0-1 range, capped at 100 for a lossless match."""
+    return float(10 * np.log10(1 / max(mse, 1e-10)))
+
+
+class Pyramid:
+    """Box filtered 1/2, 1/4 and 1/8 levels of a texture, built while it is decoded.
+
+    The 1/2 level is filled from full resolution strips as they stream past, the
+    smaller levels are reduced from it afterwards. Because every level is a block
+    average, the squared error of a level against the source is the error of the
+    level above plus the detail lost in the last step, so the loss of every level
+    is measured without ever holding the full resolution. 8 bit sources keep their
+    levels as uint8, everything else as float16.
+
+    The error is gathered per tile and scored at a percentile of the tiles, so a
+    seam or a bit of text in one corner doesn't decide for the whole texture.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.levels = {}
+        self.dtype = None
+        self._full = 1.0
+        self._rows = 0
+        self._tiles = np.zeros((-(-height // ERROR_TILE), -(-width // ERROR_TILE)))
+
+    @property
+    def complete(self):
+        return self._rows == self.height
+
+    def store(self, data):
+        if self.dtype == np.uint8:
+            return np.clip(data * 255 + 0.5, 0, 255).astype(np.uint8)
+        return data.astype(np.float16)
+
+    def load(self, data):
+        data = data.astype(np.float32)
+        if self.dtype == np.uint8:
+            data /= 255
+        return data
+
+    def add_strip(self, ybegin, strip):
+        """Feed full resolution RGBA rows in order, every strip but the last must have an even height."""
+        if self.dtype is None:
+            self.dtype = np.uint8 if strip.dtype == np.uint8 else np.float16
+            self._full = pixels.max_value(strip.dtype)
+            self.levels[2] = np.empty((-(-self.height // 2), -(-self.width // 2), 4), self.dtype)
+
+        band = strip.astype(np.float32)
+        if self._full != 1.0:
+            band /= self._full
+        half = downsample(band, 2)
+        add_tiles(self._tiles, ybegin, detail_lost(band, half), ERROR_TILE)
+        self.levels[2][ybegin // 2 : ybegin // 2 + half.shape[0]] = self.store(half)
+        self._rows += strip.shape[0]
+
+    def tile_mse(self, sq_error):
+        # edge tiles may hold fewer pixels than a full tile
+        tile_h = np.minimum(ERROR_TILE, self.height - np.arange(sq_error.shape[0]) * ERROR_TILE)
+        tile_w = np.minimum(ERROR_TILE, self.width - np.arange(sq_error.shape[1]) * ERROR_TILE)
+        return sq_error / (np.outer(tile_h, tile_w) * 4)
+
+    def finish(self, percentile=95):
+        """Reduce the smaller levels and return the PSNR of each level, taken at a percentile of the tiles."""
+        sq_error = self._tiles
+        scores = {2: psnr(np.percentile(self.tile_mse(sq_error), percentile))}
+
+        for factor in PYRAMID_FACTORS[1:]:
+            parent = self.levels[factor // 2]
+            child = np.empty((-(-parent.shape[0] // 2), -(-parent.shape[1] // 2), 4), self.dtype)
+            # the same tiles, measured in pixels of the parent level
+            tile = ERROR_TILE // (factor // 2)
+            detail = np.zeros_like(sq_error)
+            for y0 in range(0, parent.shape[0], PYRAMID_ROWS):
+                band = self.load(parent[y0 : y0 + PYRAMID_ROWS])
+                half = downsample(band, 2)
+                add_tiles(detail, y0, detail_lost(band, half), tile)
+                child[y0 // 2 : y0 // 2 + half.shape[0]] = self.store(half)
+
+            # each parent pixel stands for (factor / 2)^2 source pixels
+            sq_error = sq_error + detail * (factor // 2) ** 2
+            scores[factor] = psnr(np.percentile(self.tile_mse(sq_error), percentile))
+            self.levels[factor] = child
+
+        return scores
+
+
+class BlockScratch:
+    """Reusable float32 buffers for walking an image in bands of rows.
+
+    Holds a band plus a one pixel halo above and below, and two buffers for the
+    squared gradient along each axis. One of these per worker keeps the extra
+    memory of the analysis at a few MB regardless of the texture size.
+    """
+
+    def __init__(self, width, channels=4):
+        self.rows = max(2, BLOCK_BYTES // (width * channels * 4))
+        self.width = width
+        self.band = np.empty((self.rows + 2, width, channels), np.float32)
+        self.grad = np.empty((self.rows, width, channels), np.float32)
+        self.tmp = np.empty((self.rows, width, channels), np.float32)
+
+    def fits(self, width, channels):
+        return self.width == width and self.band.shape[2] == channels
+
+
+def iter_bands(height, rows):
+    """Yield (y0, y1, s0, s1): band rows and the rows to load including the halo."""
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        yield y0, y1, max(y0 - 1, 0), min(y1 + 1, height)
+
+
+def max_gradient_sq(pixel_data, scratch=None):
+    """Return the largest squared gradient norm over all channels.
+
+    Matches np.gradient (central differences inside, one sided at the edges) but
+    works band by band into reused buffers, handles all channels at once and
+    never takes a square root.
+    """
+    h, w, channels = pixel_data.shape
+    if h < 2 or w < 2:
+        return 0.0
+
+    if scratch is None or not scratch.fits(w, channels):
+        scratch = BlockScratch(w, channels)
+    scale = 1 / pixels.max_value(pixel_data.dtype)
+    max_sq = 0.0
+
+    for y0, y1, s0, s1 in iter_bands(h, scratch.rows):
+        m = y1 - y0
+        f = scratch.band[: s1 - s0]
+        np.multiply(pixel_data[s0:s1], scale, out=f, casting="unsafe")
+        g = scratch.grad[:m]
+        t = scratch.tmp[:m]
+
+        # vertical differences, central for interior rows
+        a, b = max(y0, 1), min(y1, h - 1)
+        if a < b:
+            np.subtract(f[a + 1 - s0 : b + 1 - s0], f[a - 1 - s0 : b - 1 - s0], out=g[a - y0 : b - y0])
+            g[a - y0 : b - y0] *= 0.5
+        if y0 == 0:
+            np.subtract(f[1 - s0], f[0 - s0], out=g[0])
+        if y1 == h:
+            np.subtract(f[h - 1 - s0], f[h - 2 - s0], out=g[m - 1])
+        np.multiply(g, g, out=g)
+
+        # horizontal differences
+        rows = f[y0 - s0 : y1 - s0]
+        np.subtract(rows[:, 2:], rows[:, :-2], out=t[:, 1:-1])
+        t[:, 1:-1] *= 0.5
+        np.subtract(rows[:, 1], rows[:, 0], out=t[:, 0])
+        np.subtract(rows[:, -1], rows[:, -2], out=t[:, -1])
+        np.multiply(t, t, out=t)
+
+        g += t
+        max_sq = max(max_sq, float(g.max()))
+
+    return max_sq
+
+
+def analyze_sharpness(pixel_data, scratch=None):
+    # pixel_data is expected to be a numpy array with shape (h, w, 4) at analysis resolution
+    # the successive resizing itself is measured by Pyramid, this stays as a cheap fallback
+    return np.sqrt(max_gradient_sq(pixel_data, scratch)) * 10
+
+
+def analyze_rgba(pixel_data):
+    # pixel_data is expected to be a numpy array with shape (h, w, 4) at analysis resolution
+    full = pixels.max_value(pixel_data.dtype)
+
+    # Extract the RGB channels, widen integer data so the differences can't wrap around
+    rgb = pixel_data[:, :, :3].astype(np.float32) / full
+    alpha = pixel_data[:, :, 3]
+
+    # Calculate the absolute differences between R, G, and B channels
+    diff_rg = np.abs(rgb[..., 0] - rgb[..., 1])
+    diff_rb = np.abs(rgb[..., 0] - rgb[..., 2])
+    diff_gb = np.abs(rgb[..., 1] - rgb[..., 2])
+
+    color_factor = np.max(diff_rg) + np.max(diff_rb) + np.max(diff_gb)
+    alpha_factor = not np.all(alpha == full)
+
+    # tally up the unique colors
+    range_factor = count_colors(pixel_data)
+
+    return color_factor, alpha_factor, range_factor
+
+
+def count_colors(pixel_data, limit=COLOR_LIMIT):
+    """Count the distinct colors at 8 bit precision, stopping as soon as there are more than limit.
+
+    Every RGBA color is packed into one uint32 so counting is a 1D problem. Chunks
+    only add the colors that weren't seen before, so masks and ID maps cost a
+    membership test per pixel and photos bail out after the first chunk.
+    """
+    full = pixels.max_value(pixel_data.dtype)
+    flat = pixel_data.reshape(-1, 4)
+    seen = np.empty(0, np.uint32)
+
+    for start in range(0, len(flat), COLOR_CHUNK):
+        chunk = flat[start : start + COLOR_CHUNK]
+        if chunk.dtype != np.uint8:
+            chunk = np.clip(chunk * (255 / full) + 0.5, 0, 255).astype(np.uint8)
+        packed = np.ascontiguousarray(chunk).view(np.uint32).ravel()
+
+        packed = packed[~np.isin(packed, seen)]
+        if len(packed):
+            seen = np.union1d(seen, np.unique(packed))
+            if len(seen) > limit:
+                return limit + 1
+    return len(seen)
+
+
+def srgb_encode(linear):
+    """Linear values in 0-1 to the sRGB transfer curve."""
+    curve = 1.055 * np.power(np.maximum(linear, 0.0031308), 1 / 2.4) - 0.055
+    return np.where(linear <= 0.0031308, linear * 12.92, curve)
+
+
+def srgb_decode(encoded):
+    curve = np.power((np.maximum(encoded, 0.04045) + 0.055) / 1.055, 2.4)
+    return np.where(encoded <= 0.04045, encoded / 12.92, curve)
+
+
+def analyze_float(pixel_data):
+    """Measure what storing a float texture with less precision would cost, band by band.
+
+    Returns the largest absolute value and the RMS error, relative to it, of
+    storing the pixels as half float, as 8 bit linear and as 8 bit sRGB. Values
+    out of the 0-1 range count fully against the 8 bit options, and anything
+    half float can't hold makes its error infinite.
+    """
+    h, w, channels = pixel_data.shape
+    rows = max(1, BLOCK_BYTES // (w * channels * 4))
+    peak = 0.0
+    sq_error = np.zeros(3)
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        for y0 in range(0, h, rows):
+            band = pixel_data[y0 : y0 + rows].astype(np.float32)
+            peak = max(peak, float(np.abs(band).max()))
+
+            clipped = np.clip(band, 0, 1)
+            stored = (
+                band.astype(np.float16),
+                np.rint(clipped * 255) / 255,
+                srgb_decode(np.rint(srgb_encode(clipped) * 255) / 255),
+            )
+            for i, values in enumerate(stored):
+                sq_error[i] += float(np.square(band - values, dtype=np.float64).sum())
+
+    rms = np.sqrt(sq_error / pixel_data.size) / max(peak, 1e-6)
+    rms[~np.isfinite(rms)] = np.inf
+    return {
+        "float_peak": peak,
+        "half_error": float(rms[0]),
+        "linear8_error": float(rms[1]),
+        "srgb8_error": float(rms[2]),
+    }
+
+
+def perceptual_hash(pixel_data):
+    """Return a 144 bit difference hash of the luminance plus the mean RGBA color.
+
+    The hash compares neighbouring cells of a 9x9 grid of area averages, across
+    and down, so the same texture at another resolution or slightly recompressed
+    hashes the same or within a few bits. Flat textures all hash to zero, the
+    mean color tells them apart.
+    """
+    h, w = pixel_data.shape[:2]
+    full = pixels.max_value(pixel_data.dtype)
+    small = pixel_data[:: max(1, h // HASH_SAMPLE), :: max(1, w // HASH_SAMPLE)].astype(np.float32) / full
+    mean_color = small.reshape(-1, 4).mean(axis=0)
+    luma = small[..., :3] @ LUMA
+
+    sh, sw = luma.shape
+    ys = np.arange(9) * sh // 9
+    xs = np.arange(9) * sw // 9
+    if sh >= 9 and sw >= 9:
+        grid = np.add.reduceat(np.add.reduceat(luma, ys, axis=0), xs, axis=1)
+        grid /= np.outer(np.diff(np.append(ys, sh)), np.diff(np.append(xs, sw)))
+    else:
+        grid = luma[ys][:, xs]
+
+    bits = np.packbits(np.concatenate([(grid[:, 1:] > grid[:, :-1]).ravel(), (grid[1:] > grid[:-1]).ravel()]))
+    return bits.tobytes().hex(), [float(c) for c in mean_color]
+
+
+def analyze(pixel_data, scratch=None, is_float=None):
+    """Run every analysis on a pixel buffer and return the results as plain Python values."""
+    # calculate sharpness for smart resize
+    with profiling.phase("sharpness"):
+        sharpness_factor = analyze_sharpness(pixel_data, scratch)
+
+    # calculate rgb and alpha value for smart conversion
+    with profiling.phase("color"):
+        color_factor, alpha_factor, range_factor = analyze_rgba(pixel_data)
+
+    # find duplicates across the file
+    with profiling.phase("hash"):
+        phash, mean_color = perceptual_hash(pixel_data)
+
+    results = {
+        "sharpness_factor": float(sharpness_factor),
+        "color_factor": float(color_factor),
+        "alpha_factor": float(alpha_factor),
+        "range_factor": int(range_factor),
+        "phash": phash,
+        "mean_color": mean_color,
+    }
+
+    # Blender hands out float buffers for every image, only real float files need the float analysis
+    if is_float is None:
+        is_float = pixel_data.dtype.kind == "f"
+    if is_float:
+        with profiling.phase("color"):
+            results.update(analyze_float(pixel_data))
+    return results
+
+
+def merge_records(records):
+    """Merge the scan records of images that get one decision together, like UDIM tiles or frames.
+
+    Every measurement takes the value of the image that needs the most: the
+    sharpest one decides the resize, the most colorful one the depth.
+    """
+    record = dict(records[0])
+    for key in ("sharpness_factor", "color_factor", "alpha_factor", "depth", "width", "height"):
+        record[key] = max(r[key] for r in records)
+    record["is_float"] = any(r["is_float"] for r in records)
+    # every file gets its own slot in Cycles, sizing them all like the widest one stays on the safe side
+    record["channels"] = max(r.get("channels") or 0 for r in records) or None
+    precisions = [r["precision"] for r in records if r.get("precision")]
+    record["precision"] = max(precisions, key=memory.PRECISIONS.index) if precisions else None
+    # the colors of all images are at most the colors of each of them together
+    record["range_factor"] = min(sum(r["range_factor"] for r in records), COLOR_LIMIT + 1)
+
+    psnr = [r.get("level_psnr") for r in records]
+    record["level_psnr"] = [min(levels) for levels in zip(*psnr)] if all(psnr) else None
+    for key in ("float_peak", "half_error", "linear8_error", "srgb8_error"):
+        values = [r.get(key) for r in records if r.get(key) is not None]
+        record[key] = max(values) if values else None
+
+    # near duplicate matching is per image, a merged record only matches an identical one
+    record["phash"] = None
+    record["mean_color"] = None
+    return record
@@ -0,0 +1,188 @@
+"""Scan and optimize the textures of a .blend without the UI, for render farms and pipelines.
+
+    blender -b shot.blend -P texture_compactor/batch.py -- --optimize --save --json shot.json
+
+farm.py runs this over many .blend files at once.
+"""
+
+if __name__ == "__main__":
+    # run as a script by blender -P, load the addon this file belongs to and hand over to it
+    import importlib
+    import os
+    import sys
+
+    _folder = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(_folder))
+    sys.exit(importlib.import_module(os.path.basename(_folder) + ".batch").main())
+
+import argparse
+import json
+import sys
+import time
+import traceback
+
+import bpy
+
+from . import cache
+from . import core
+from . import jobs
+from . import planner
+from . import profiling
+from . import settings
+
+# exit codes, farm.py uses the same ones
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_PARTIAL = 3  # some textures couldn't be optimized
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="batch.py", description="Scan and optimize the textures of the open .blend.")
+    parser.add_argument("--scan", action="store_true", help="scan the textures and report the savings")
+    parser.add_argument("--optimize", action="store_true", help="scan, then write and use the optimized textures")
+    parser.add_argument("--save", action="store_true", help="save the .blend so it keeps the optimized textures")
+    parser.add_argument("--json", help="write the report to this file")
+    # 0, 1 and 2 are Off, Safe and Aggressive like in the panel
+    parser.add_argument("--greyscale", choices=("0", "1", "2"), default="1", help="Convert to Greyscale")
+    parser.add_argument("--resize", choices=("0", "1", "2"), default="1", help="Smart Resize")
+    parser.add_argument("--float", choices=("0", "1", "2"), default="1", help="Float Textures")
+    parser.add_argument("--budget", type=float, help="fit the textures into this many MB instead, see Fit to Budget")
+    parser.add_argument("--format", choices=("IMAGE", "DDS"), default="IMAGE", help="output format")
+    parser.add_argument("--channel-pack", action="store_true", help="pack the greyscale maps of each material")
+    parser.add_argument("--library", action="store_true", help="write linked textures beside their library")
+    parser.add_argument("--store", help="project wide folder for the optimized textures, shared by every file")
+    parser.add_argument("--cache-dir", help="scan cache folder, shared by every file")
+    parser.add_argument("--workers", type=int, help="worker processes for scanning and writing")
+    parser.add_argument("--trace", help="write a Chrome trace of the scan and optimize phases to this file")
+    return parser.parse_args(argv)
+
+
+def script_args():
+    # Blender hands everything after -- to the script
+    argv = sys.argv
+    return argv[argv.index("--") + 1 :] if "--" in argv else []
+
+
+def texture_report(info):
+    return {
+        "name": info.image.name,
+        "path": core.image_abspath(info.image),
+        "width": info.width,
+        "height": info.height,
+        "depth": info.depth,
+        "resize": info.resize_divisor,
+        "optimized_depth": info.optimized_depth,
+        "half_precision": info.read_as_half_precision,
+        "memory_before_mb": round(info.size_original_mb, 3),
+        "memory_after_mb": round(info.size_optimized_mb, 3),
+        "optimized_path": info.optimized_path,
+        "budget_reason": info.budget_reason,
+    }
+
+
+def run(args, report):
+    """Scan and optimize the open file, filling in the report. Returns the exit code."""
+    scene = bpy.context.scene
+    if scene.TC_texture_swap == "1":
+        # scanning the optimized files would optimize them a second time
+        report["skipped"] = "the file already uses optimized textures"
+        return EXIT_OK
+    if args.optimize and not bpy.data.filepath and not settings.STORE_DIR:
+        report["error"] = "the file was never saved, pass --store"
+        return EXIT_USAGE
+
+    scene.TC_convert_greyscale = args.greyscale
+    scene.TC_smart_resize = args.resize
+    scene.TC_optimize_float = args.float
+    scene.TC_fit_budget = args.budget is not None
+    scene.TC_budget_mb = args.budget or 0
+    image_list = scene.TC_texture_metadata
+
+    start = time.perf_counter()
+    plan = planner.plan_scan(bpy.data.images)
+    plan.log()
+    jobs.ScanJob(plan, image_list).run()
+    core.update_memory_usage(None, bpy.context)
+    before, after, _delta, changes = core.tally_sizes(image_list)
+    scan_cache = cache.get_cache()
+    report.update(
+        {
+            "scan_seconds": round(time.perf_counter() - start, 3),
+            "textures_scanned": len(image_list),
+            "not_optimizable": len(plan.report_only),
+            "skipped_images": len(plan.skipped),
+            "cache_hits": scan_cache.hits,
+            "cache_misses": scan_cache.misses,
+            "memory_before_mb": round(before, 3),
+            "memory_after_mb": round(after, 3),
+            "textures_changed": changes,
+        }
+    )
+    if args.budget is not None:
+        report["budget_met"] = image_list.active.fits
+
+    code = EXIT_OK
+    if args.optimize and changes:
+        start = time.perf_counter()
+        job = jobs.OptimizeJob(image_list, args.format, args.channel_pack, args.library)
+        job.run(bpy.context)
+        report.update(
+            {
+                "optimize_seconds": round(time.perf_counter() - start, 3),
+                "files_written": len(job.written) - job.reused,
+                "files_reused": job.reused,
+                "textures_failed": len(job.failed),
+            }
+        )
+        if job.failed:
+            code = EXIT_PARTIAL
+
+    report["textures"] = [texture_report(info) for info in image_list]
+    profile = profiling.get_profile()
+    report["profile"] = profile.to_json()
+    if args.trace:
+        profile.save_trace(args.trace)
+    if args.save:
+        bpy.ops.wm.save_mainfile()
+    return code
+
+
+def main(argv=None):
+    try:
+        args = parse_args(script_args() if argv is None else argv)
+    except SystemExit as exc:
+        # argparse exits on --help and on bad arguments
+        return EXIT_OK if exc.code == 0 else EXIT_USAGE
+    if not (args.scan or args.optimize):
+        print("Nothing to do, pass --scan or --optimize")
+        return EXIT_USAGE
+
+    if args.store:
+        settings.STORE_DIR = args.store
+    if args.cache_dir:
+        settings.CACHE_DIR = args.cache_dir
+    if args.workers:
+        settings.SCAN_WORKERS = args.workers
+
+    # the addon may not be enabled in the preferences of the farm machine
+    if not hasattr(bpy.types.Scene, "TC_texture_metadata"):
+        sys.modules[__package__].register()
+
+    start = time.perf_counter()
+    report = {"file": bpy.data.filepath}
+    try:
+        code = run(args, report)
+    except Exception:
+        traceback.print_exc()
+        report["error"] = traceback.format_exc()
+        code = EXIT_ERROR
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    report["exit_code"] = code
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+    before, after = report.get("memory_before_mb", 0), report.get("memory_after_mb", 0)
+    print(f"Texture Compactor batch: {before}MB -> {after}MB, exit code {code}")
+    return code
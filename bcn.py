@@ -0,0 +1,185 @@
+import os
+import struct
+
+import numpy as np
+
+from . import analysis
+
+# this runs in the worker processes too, never import bpy here
+
+# block compressed format used for each number of output channels
+FORMATS = {1: "BC4", 3: "BC1", 4: "BC3"}
+# bytes per 4x4 block
+BLOCK_SIZE = {"BC1": 8, "BC3": 16, "BC4": 8, "BC5": 16}
+FOURCC = {"BC1": b"DXT1", "BC3": b"DXT5", "BC4": b"ATI1", "BC5": b"ATI2"}
+# rows of blocks encoded at once, keeps the temporaries at a few MB
+BATCH_ROWS = 64
+# index of the palette entry at each step from the first to the second endpoint
+COLOR_INDEX = np.array([0, 2, 3, 1], np.uint64)
+ALPHA_INDEX = np.array([1, 7, 6, 5, 4, 3, 2, 0], np.uint64)
+
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400000
+
+
+def to_blocks(pixel_data):
+    """Split (h, w, c) pixels into (n, 16, c) blocks in DDS order, edge pixels fill partial blocks."""
+    h, w, channels = pixel_data.shape
+    pad_h, pad_w = -h % 4, -w % 4
+    if pad_h or pad_w:
+        pixel_data = np.pad(pixel_data, ((0, pad_h), (0, pad_w), (0, 0)), mode="edge")
+    rows, cols = (h + pad_h) // 4, (w + pad_w) // 4
+    blocks = pixel_data.reshape(rows, 4, cols, 4, channels).swapaxes(1, 2)
+    return blocks.reshape(rows * cols, 16, channels).astype(np.float32)
+
+
+def pack_565(colors):
+    rgb = np.rint(colors * (np.array([31, 63, 31], np.float32) / 255)).astype(np.uint32)
+    return (rgb[:, 0] << 11) | (rgb[:, 1] << 5) | rgb[:, 2]
+
+
+def unpack_565(packed):
+    r, g, b = (packed >> 11) & 31, (packed >> 5) & 63, packed & 31
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(np.float32)
+
+
+def fit_steps(values, start, end, steps):
+    """Project every texel on the line between the endpoints and round to the nearest of the evenly spaced steps.
+
+    values (n, 16, c), start and end (n, c). The palettes of all BC formats lie on
+    that line, so this finds the closest entry without measuring the distance to each.
+    """
+    span = end - start
+    length_sq = np.maximum(np.einsum("ni,ni->n", span, span), 1e-8)
+    t = ((values - start[:, None]) @ span[..., None])[..., 0] / length_sq[:, None]
+    return np.clip(np.rint(t * steps), 0, steps).astype(np.intp)
+
+
+def encode_color(blocks):
+    """BC1 color blocks from (n, 16, 3) RGB, as one uint64 per block.
+
+    The endpoints span the block along its principal axis, found with a few rounds
+    of power iteration on the color covariance of every block at once.
+    """
+    mean = blocks.mean(axis=1, keepdims=True)
+    centered = blocks - mean
+    covariance = centered.transpose(0, 2, 1) @ centered
+    axis = np.ones((len(blocks), 3, 1), np.float32)
+    for _ in range(4):
+        axis = covariance @ axis
+        axis /= np.maximum(np.abs(axis).max(axis=1, keepdims=True), 1e-8)
+    axis = axis[..., 0] / np.maximum(np.linalg.norm(axis[..., 0], axis=1, keepdims=True), 1e-8)
+
+    projection = (centered @ axis[..., None])[..., 0]
+    low = np.clip(mean[:, 0] + axis * projection.min(axis=1, keepdims=True), 0, 255)
+    high = np.clip(mean[:, 0] + axis * projection.max(axis=1, keepdims=True), 0, 255)
+
+    c0, c1 = pack_565(high), pack_565(low)
+    # the first endpoint has to be the larger one for the four color mode
+    swap = c0 < c1
+    c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+
+    indices = COLOR_INDEX[fit_steps(blocks, unpack_565(c0), unpack_565(c1), 3)]
+    # equal endpoints would switch the block to the three color mode, index 0 is right either way
+    indices[c0 == c1] = 0
+
+    bits = (indices << (2 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    return c0.astype(np.uint64) | (c1.astype(np.uint64) << np.uint64(16)) | (bits << np.uint64(32))
+
+
+def encode_alpha(values):
+    """BC4 blocks from (n, 16) single channel values, as one uint64 per block."""
+    a0 = np.rint(values.max(axis=1)).astype(np.uint64)
+    a1 = np.rint(values.min(axis=1)).astype(np.uint64)
+
+    # eight value mode, the endpoints plus six steps between them
+    low, high = a1.astype(np.float32)[:, None], a0.astype(np.float32)[:, None]
+    indices = ALPHA_INDEX[fit_steps(values[..., None], low, high, 7)]
+    indices[a0 == a1] = 0
+
+    bits = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    return a0 | (a1 << np.uint64(8)) | (bits << np.uint64(16))
+
+
+def encode_blocks(blocks, fmt):
+    """Encode (n, 16, c) blocks, returns a (n, words) uint64 array."""
+    if fmt == "BC1":
+        return encode_color(blocks[..., :3])[:, None]
+    if fmt == "BC3":
+        return np.stack([encode_alpha(blocks[..., 3]), encode_color(blocks[..., :3])], axis=1)
+    if fmt == "BC4":
+        return encode_alpha(blocks[..., 0])[:, None]
+    if fmt == "BC5":
+        return np.stack([encode_alpha(blocks[..., 0]), encode_alpha(blocks[..., 1])], axis=1)
+    raise ValueError(f"Unknown block format {fmt}")
+
+
+def encode(pixel_data, fmt):
+    """Block compress (h, w, c) uint8 pixels, a band of rows at a time. Returns the DDS payload of one level."""
+    chunks = []
+    for y0 in range(0, pixel_data.shape[0], BATCH_ROWS * 4):
+        blocks = to_blocks(pixel_data[y0 : y0 + BATCH_ROWS * 4])
+        chunks.append(encode_blocks(blocks, fmt).astype("<u8").tobytes())
+    return b"".join(chunks)
+
+
+def encode_parallel(pixel_data, fmt, pool):
+    """Same as encode, with the bands of large maps spread over a process pool."""
+    band = BATCH_ROWS * 4
+    bands = [pixel_data[y0 : y0 + band] for y0 in range(0, pixel_data.shape[0], band)]
+    return b"".join(pool.map(encode, bands, [fmt] * len(bands)))
+
+
+def mip_chain(pixel_data):
+    """Yield every mip level down to 1x1, box filtered, with the sizes DDS expects."""
+    level = pixel_data
+    yield level
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        h, w = max(1, level.shape[0] // 2), max(1, level.shape[1] // 2)
+        level = analysis.downsample(level.astype(np.float32), 2)[:h, :w]
+        level = np.clip(level + 0.5, 0, 255).astype(np.uint8)
+        yield level
+
+
+def dds_header(width, height, fmt, mip_count):
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE
+    caps = DDSCAPS_TEXTURE
+    if mip_count > 1:
+        flags |= DDSD_MIPMAPCOUNT
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+    linear_size = -(-width // 4) * -(-height // 4) * BLOCK_SIZE[fmt]
+
+    return (
+        b"DDS "
+        + struct.pack("<7I", 124, flags, height, width, linear_size, 0, mip_count)
+        + struct.pack("<11I", *[0] * 11)
+        + struct.pack("<2I4s5I", 32, DDPF_FOURCC, FOURCC[fmt], 0, 0, 0, 0, 0)
+        + struct.pack("<5I", caps, 0, 0, 0, 0)
+    )
+
+
+def write_dds(path, pixel_data, fmt, mipmaps=True, pool=None):
+    """Write (h, w, c) uint8 pixels as a block compressed DDS file, with a full mip chain by default."""
+    h, w = pixel_data.shape[:2]
+    levels = list(mip_chain(pixel_data)) if mipmaps else [pixel_data]
+
+    root, ext = os.path.splitext(path)
+    temp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(dds_header(w, h, fmt, len(levels)))
+            for level in levels:
+                f.write(encode_parallel(level, fmt, pool) if pool else encode(level, fmt))
+        os.replace(temp_path, path)
+    except OSError as exc:
+        print(f"Can't write {path}: {exc}")
+        return False
+    return True
@@ -0,0 +1,88 @@
+"""Measure the block compressor: blocks per second and error against the source.
+
+Needs NumPy, OpenImageIO is used to decode the DDS files back for the error:
+
+    python benchmarks/bench_bcn.py --sizes 2048 4096 --workers 8
+"""
+
+import argparse
+import concurrent.futures
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_sharpness import load_addon  # noqa: E402
+
+try:
+    import OpenImageIO as oiio
+except ImportError:
+    oiio = None
+
+
+def synthetic(size, channels, rng):
+    # smooth gradients, hard edges and some noise, roughly what a texture has in it
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    layers = [x, y, (np.sin(x * 40) * np.cos(y * 30) + 1) / 2, ((x * 8).astype(int) + (y * 8).astype(int)) % 2]
+    pixel_data = np.stack(layers[:channels], axis=-1) * 255
+    pixel_data += rng.normal(0, 6, pixel_data.shape)
+    return np.clip(pixel_data, 0, 255).astype(np.uint8)
+
+
+def decode_error(path, pixel_data):
+    """RMS error of the top level read back from the DDS, in 8 bit steps."""
+    if oiio is None:
+        return float("nan")
+    config = oiio.ImageSpec()
+    config.attribute("oiio:UnassociatedAlpha", 1)
+    inp = oiio.ImageInput.open(path, config)
+    if not inp:
+        return float("nan")
+    try:
+        decoded = inp.read_image(0, 0, 0, pixel_data.shape[2], "uint8")
+    finally:
+        inp.close()
+    return float(np.sqrt(np.mean(np.square(decoded.astype(np.float32) - pixel_data))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2048, 4096])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    bcn = importlib.import_module(load_addon().__name__ + ".bcn")
+    rng = np.random.default_rng(0)
+    folder = tempfile.mkdtemp(prefix="tc_bench_")
+    pool = concurrent.futures.ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+
+    print(f"{'format':>6} {'size':>6} {'Mblocks/s':>10} {f'x{args.workers} Mblocks/s':>14} {'rmse':>6}")
+    for fmt, channels in (("BC1", 3), ("BC3", 4), ("BC4", 1), ("BC5", 2)):
+        for size in args.sizes:
+            pixel_data = synthetic(size, channels, rng)
+            blocks = (size // 4) ** 2
+
+            start = time.perf_counter()
+            bcn.encode(pixel_data, fmt)
+            serial = blocks / (time.perf_counter() - start) / 1e6
+
+            parallel = float("nan")
+            if pool:
+                start = time.perf_counter()
+                bcn.encode_parallel(pixel_data, fmt, pool)
+                parallel = blocks / (time.perf_counter() - start) / 1e6
+
+            path = os.path.join(folder, f"{fmt}_{size}.dds")
+            bcn.write_dds(path, pixel_data, fmt, mipmaps=False)
+            print(f"{fmt:>6} {size:>6} {serial:>10.2f} {parallel:>14.2f} {decode_error(path, pixel_data):>6.2f}")
+
+    if pool:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare resize outputs written from the scan pyramid against decoding and filtering the source again.
+
+rmse is the difference between the two outputs, in 8 bit steps.
+
+Needs NumPy and OpenImageIO (bundled with Blender 4), but no Blender:
+
+    python benchmarks/bench_pyramid.py --sizes 4096 8192 --factor 2
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_sharpness import load_addon  # noqa: E402
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def rmse(pixels, path_a, path_b):
+    a, _ = pixels.read_pixels(path_a)
+    b, _ = pixels.read_pixels(path_b)
+    return float(np.sqrt(np.mean(np.square(a.astype(np.float32) - b.astype(np.float32)))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4096, 8192])
+    parser.add_argument("--factor", type=int, default=2, choices=(2, 4, 8))
+    args = parser.parse_args()
+
+    package = load_addon().__name__
+    analysis = importlib.import_module(package + ".analysis")
+    export = importlib.import_module(package + ".export")
+    pixels = importlib.import_module(package + ".pixels")
+    if not pixels.available():
+        sys.exit("OpenImageIO is not installed")
+
+    rng = np.random.default_rng(0)
+    folder = tempfile.mkdtemp(prefix="tc_bench_")
+
+    print(
+        f"{'size':>6} {'scan s':>8} {'+pyramid s':>10} {'export src s':>12} {'export lvl s':>12}"
+        f" {'saved':>7} {'rmse':>7}"
+    )
+    for size in args.sizes:
+        # smooth gradients with some noise, so the levels have something to lose
+        ramp = np.linspace(0, 255, size, dtype=np.float32)
+        pixel_data = (ramp[None, :, None] * 0.5 + ramp[:, None, None] * 0.3).repeat(4, axis=2)
+        pixel_data += rng.normal(0, 8, pixel_data.shape).astype(np.float32)
+        source = os.path.join(folder, f"source_{size}.png")
+        pixels.write_image(source, np.clip(pixel_data, 0, 255).astype(np.uint8), 1)
+        del pixel_data
+
+        _, scan_time = timed(pixels.read_pixels, source, 4)
+
+        pyramid = analysis.Pyramid(size, size)
+        _, pyramid_time = timed(pixels.read_pixels, source, 4, None, pyramid.add_strip)
+        _, finish_time = timed(pyramid.finish)
+        pyramid_time += finish_time
+        level = os.path.join(folder, f"level_{size}.npy")
+        np.save(level, pyramid.levels[args.factor])
+
+        job = {"source": source, "factor": args.factor, "channels": 3, "float_output": False, "compression": 1}
+        from_source = os.path.join(folder, f"from_source_{size}.png")
+        from_level = os.path.join(folder, f"from_level_{size}.png")
+        _, source_time = timed(export.export_file, dict(job, target=from_source))
+        _, level_time = timed(export.export_file, dict(job, target=from_level, pyramid=level))
+
+        saved = scan_time + source_time - pyramid_time - level_time
+        print(
+            f"{size:>6} {scan_time:>8.2f} {pyramid_time:>10.2f} {source_time:>12.2f} {level_time:>12.2f}"
+            f" {saved:>6.2f}s {rmse(pixels, from_source, from_level):>7.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
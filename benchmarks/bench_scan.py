@@ -0,0 +1,308 @@
+"""Time the scan and optimize paths on a synthetic texture corpus and compare against a saved baseline.
+
+Needs NumPy and OpenImageIO (bundled with Blender 4), but no Blender:
+
+    python benchmarks/bench_scan.py --save          # record the baseline on this machine
+    python benchmarks/bench_scan.py                 # compare, exits with 1 on a regression
+
+The corpus holds flat colors, noise, near grey, RGBA with constant alpha, smooth
+gradients and float HDR at every size, generated from fixed seeds so every run
+sees the same pixels. Each texture is benchmarked in its own process so the peak
+RSS belongs to it alone. Timings are the best of --repeat runs, throughput is
+source megapixels per second.
+
+Outside Blender core.scan_image and pro.export_job run against a small bpy
+stand-in that only resolves paths. pro.optimize needs Blender's own image
+operators, the optimize step is timed through the export workers instead, which
+is what the Optimize button uses.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_sharpness import load_addon  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_scan.json")
+KINDS = ("flat", "noise", "grey", "alpha", "smooth", "hdr")
+# timings shorter than this are noise, they never count as a regression
+MIN_SECONDS = 0.005
+
+
+def make_texture(kind, size):
+    """Pixels of one corpus texture, the same for every run."""
+    rng = np.random.default_rng([KINDS.index(kind), size])
+    if kind == "flat":
+        return np.broadcast_to(np.array([180, 90, 40, 255], np.uint8), (size, size, 4)).copy()
+    if kind == "noise":
+        return rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    if kind == "grey":
+        # greyscale with a little color noise, like a scanned roughness map
+        grey = rng.integers(0, 256, (size, size, 1), dtype=np.int16)
+        rgb = np.clip(grey + rng.integers(-1, 2, (size, size, 3), dtype=np.int16), 0, 255)
+        return rgb.astype(np.uint8)
+    if kind == "alpha":
+        rgba = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+        rgba[..., 3] = 255
+        return rgba
+    ramp = np.linspace(0, 1, size, dtype=np.float32)
+    smooth = ramp[None, :, None] * np.array([1.0, 0.6, 0.3], np.float32) + ramp[:, None, None] * 0.2
+    if kind == "smooth":
+        return np.clip(smooth * 200 + 20, 0, 255).astype(np.uint8)
+    # float HDR, a smooth sky with a few hot spots far above 1
+    hdr = smooth * 4 + rng.normal(0, 0.01, smooth.shape).astype(np.float32)
+    spots = rng.integers(0, size, (max(1, size // 64), 2))
+    hdr[spots[:, 0], spots[:, 1]] = 50
+    return np.maximum(hdr, 0)
+
+
+def build_corpus(folder, sizes, pixels):
+    """Write every corpus texture that isn't in folder yet, returns their paths."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for size in sizes:
+        for kind in KINDS:
+            path = os.path.join(folder, f"{kind}_{size}.{'exr' if kind == 'hdr' else 'png'}")
+            if not os.path.isfile(path):
+                pixels.write_image(path, make_texture(kind, size), 1)
+            paths.append(path)
+    return paths
+
+
+def install_bpy_stand_in():
+    """Just enough of bpy to import core and resolve paths, when not running inside Blender."""
+    try:
+        import bpy  # noqa: F401
+        return
+    except ImportError:
+        pass
+    stand_in = types.ModuleType("bpy")
+    stand_in.path = types.SimpleNamespace(abspath=lambda path, library=None: path, relpath=lambda path: path)
+    stand_in.app = types.SimpleNamespace(handlers=types.SimpleNamespace(persistent=lambda func: func, load_post=[]))
+    stand_in.data = types.SimpleNamespace(filepath="", images=[], materials=[], libraries=[])
+    sys.modules["bpy"] = stand_in
+
+
+class StandInImage:
+    """The attributes of a file image datablock the scan and the optimizer read."""
+
+    def __init__(self, path, size):
+        self.name = os.path.basename(path)
+        self.filepath = self.filepath_raw = path
+        self.source = "FILE"
+        self.packed_file = None
+        self.library = None
+        self.size = size
+        self.use_half_precision = False
+        self.colorspace_settings = types.SimpleNamespace(name="sRGB", is_data=False)
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # not on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def decisions(modules, image, record):
+    """What every combination of settings decides for a scanned texture, as [resize, depth, half]."""
+    core, table = modules["core"], modules["table"]
+    image_list = table.TextureTable([core.ImageInfo.from_record(image, image.filepath, record)])
+    image_list.precompute(core.evaluate)
+    result = {}
+    for key, decision in image_list._decisions.items():
+        result["".join(key)] = [
+            int(decision.resize[0]),
+            int(decision.optimized_depth[0]),
+            bool(decision.read_as_half_precision[0]),
+        ]
+    return result
+
+
+def bench_file(path, repeat, work_dir):
+    """Benchmark one texture in this process, returns its results."""
+    # after the package, it only registers its UI inside Blender
+    package = load_addon().__name__
+    install_bpy_stand_in()
+    modules = {
+        name: importlib.import_module(f"{package}.{name}")
+        for name in ("analysis", "core", "export", "pixels", "pro", "settings", "store", "table", "worker")
+    }
+    analysis, core, pixels, settings, worker = (
+        modules[n] for n in ("analysis", "core", "pixels", "settings", "worker")
+    )
+    # pyramids go to a scratch cache, the optimize step picks them up from there like it would in Blender
+    settings.CACHE_DIR = os.path.join(work_dir, "cache")
+
+    header = pixels.read_info(path)
+    megapixels = header["width"] * header["height"] / 1e6
+    step = core.analysis_step()
+    timings = {}
+
+    (pixel_data, info), timings["decode"] = best_of(repeat, pixels.read_pixels, path, step)
+    _, timings["analyze_sharpness"] = best_of(repeat, analysis.analyze_sharpness, pixel_data)
+    _, timings["analyze_rgba"] = best_of(repeat, analysis.analyze_rgba, pixel_data)
+    _, timings["perceptual_hash"] = best_of(repeat, analysis.perceptual_hash, pixel_data)
+    if info["is_float"]:
+        _, timings["analyze_float"] = best_of(repeat, analysis.analyze_float, pixel_data)
+    del pixel_data
+
+    image = StandInImage(path, [header["width"], header["height"]])
+    _, timings["scan_image"] = best_of(repeat, core.scan_image, image)
+    record, timings["scan_file"] = best_of(repeat, worker.scan_file, path, step)
+    # the same scan without HYPERSPEED, its decisions should match
+    full_record, timings["scan_file_full_res"] = best_of(1, worker.scan_file, path, 1)
+
+    result_decisions = decisions(modules, image, record)
+    full_decisions = decisions(modules, image, full_record)
+    stable = sum(result_decisions[key] == full_decisions[key] for key in result_decisions) / len(result_decisions)
+
+    # write the optimized file for the panel's default settings, if they change anything
+    image_list = modules["table"].TextureTable([core.ImageInfo.from_record(image, path, record)])
+    image_list.select({"convert_greyscale": "1", "smart_resize": "1", "optimize_float": "1"}, core.evaluate)
+    output_store = modules["store"].OutputStore(os.path.join(work_dir, "store"))
+    job = modules["pro"].export_job(image_list[0], output_store)
+    if job is not None:
+        _, timings["optimize"] = best_of(repeat, modules["export"].export_file, job)
+
+    return {
+        "megapixels": megapixels,
+        "seconds": timings,
+        "mpix_per_second": {phase: megapixels / seconds for phase, seconds in timings.items() if seconds > 0},
+        "peak_rss_mb": peak_rss_mb(),
+        "decisions": result_decisions,
+        "hyperspeed_stable": stable,
+    }
+
+
+def run_isolated(path, repeat, work_dir):
+    """Benchmark one texture in a fresh process so its peak memory isn't mixed up with the others."""
+    out_path = os.path.join(work_dir, os.path.basename(path) + ".json")
+    command = [sys.executable, os.path.abspath(__file__), "--child", path, "--repeat", str(repeat)]
+    command += ["--work-dir", work_dir, "--out", out_path]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if completed.returncode != 0:
+        print(completed.stdout)
+        raise RuntimeError(f"benchmark of {path} failed")
+    with open(out_path, "r") as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance):
+    """Return a line for every regression against the baseline."""
+    failures = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for phase, seconds in result["seconds"].items():
+            before = old["seconds"].get(phase)
+            if before and seconds > MIN_SECONDS and seconds > before * (1 + tolerance):
+                failures.append(f"{name} {phase}: {before:.3f}s -> {seconds:.3f}s")
+        if (
+            old.get("peak_rss_mb")
+            and result["peak_rss_mb"]
+            and result["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance)
+        ):
+            failures.append(f"{name} peak RSS: {old['peak_rss_mb']:.0f}MB -> {result['peak_rss_mb']:.0f}MB")
+        changed = sorted(key for key, value in result["decisions"].items() if old["decisions"].get(key) != value)
+        if changed:
+            failures.append(f"{name} decisions changed for settings {', '.join(changed)}")
+        if result["hyperspeed_stable"] < old["hyperspeed_stable"]:
+            failures.append(f"{name} HYPERSPEED agrees with full resolution less: {result['hyperspeed_stable']:.0%}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 4096, 8192])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--corpus", help="keep the generated textures here instead of a temporary folder")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="how much slower or bigger counts as a regression"
+    )
+    parser.add_argument("--json", help="write the results to this file too")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with open(args.out, "w") as f:
+            json.dump(bench_file(args.child, args.repeat, args.work_dir), f)
+        return 0
+
+    pixels = importlib.import_module(load_addon().__name__ + ".pixels")
+    if not pixels.available():
+        sys.exit("OpenImageIO is not installed")
+    work_dir = tempfile.mkdtemp(prefix="tc_bench_scan_")
+    paths = build_corpus(args.corpus or os.path.join(work_dir, "corpus"), args.sizes, pixels)
+
+    results = {}
+    print(
+        f"{'texture':<16} {'MPix':>6} {'decode':>8} {'sharp':>8} {'rgba':>8} {'scan':>8} {'optimize':>8}"
+        f" {'MPix/s':>7} {'RSS MB':>7} {'stable':>6}"
+    )
+    for path in paths:
+        name = os.path.basename(path)
+        result = results[name] = run_isolated(path, args.repeat, work_dir)
+        seconds = result["seconds"]
+        optimize = f"{seconds['optimize']:>8.3f}" if "optimize" in seconds else f"{'-':>8}"
+        rss = f"{result['peak_rss_mb']:>7.0f}" if result["peak_rss_mb"] else f"{'-':>7}"
+        print(
+            f"{name:<16} {result['megapixels']:>6.1f} {seconds['decode']:>8.3f} {seconds['analyze_sharpness']:>8.3f}"
+            f" {seconds['analyze_rgba']:>8.3f} {seconds['scan_file']:>8.3f} {optimize}"
+            f" {result['mpix_per_second']['scan_file']:>7.0f} {rss} {result['hyperspeed_stable']:>6.0%}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    except OSError:
+        print(f"No baseline at {args.baseline}, run with --save first")
+        return 0
+    failures = compare(results, baseline, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if failures:
+        print(f"{len(failures)} regressions against {args.baseline}")
+        return 1
+    print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
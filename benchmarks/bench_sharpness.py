@@ -0,0 +1,83 @@
+"""Compare the block-streamed sharpness kernel against the original np.gradient version.
+
+Runs with a plain Python interpreter, no Blender needed:
+
+    python benchmarks/bench_sharpness.py --sizes 4096 8192
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_addon():
+    """Import the addon as a package regardless of the folder it was unpacked into."""
+    spec = importlib.util.spec_from_file_location(
+        "texture_compactor", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["texture_compactor"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_sharpness(pixel_data):
+    # the per-channel np.gradient implementation this kernel replaced
+    max_gnorm = 0
+    scale = 1 / 255 if pixel_data.dtype == np.uint8 else 1
+    for channel in range(4):
+        gx, gy = np.gradient(pixel_data[:, :, channel])
+        gnorm = np.sqrt(gx**2 + gy**2)
+        max_gnorm = max(max_gnorm, np.max(gnorm) * scale)
+    return max_gnorm * 10
+
+
+def measure(func, pixel_data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(pixel_data)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(pixel_data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4096, 8192])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--float", action="store_true", help="use float32 pixels instead of uint8")
+    args = parser.parse_args()
+
+    analysis = importlib.import_module(load_addon().__name__ + ".analysis")
+    rng = np.random.default_rng(0)
+
+    print(f"{'size':>6} {'legacy s':>9} {'blocked s':>9} {'speedup':>8} {'legacy MB':>10} {'blocked MB':>10}")
+    for size in args.sizes:
+        pixel_data = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+        if args.float:
+            pixel_data = pixel_data.astype(np.float32) / 255
+
+        old, old_time, old_peak = measure(legacy_sharpness, pixel_data, args.repeat)
+        new, new_time, new_peak = measure(analysis.analyze_sharpness, pixel_data, args.repeat)
+        assert abs(old - new) < 1e-3 * max(old, 1), f"results differ: {old} vs {new}"
+
+        print(
+            f"{size:>6} {old_time:>9.3f} {new_time:>9.3f} {old_time / new_time:>7.1f}x"
+            f" {old_peak / 2**20:>10.1f} {new_peak / 2**20:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Render test scenes in background Blender and compare Cycles' image memory with memory.py.
+
+Needs NumPy and OpenImageIO to write the test images, and a Blender to render them:
+
+    python benchmarks/validate_memory.py --blender /path/to/blender
+
+Every case is one image in one file format, channel count, colorspace and
+precision, loaded from disk or packed, on a plane rendered with Cycles on the
+CPU. Blender is started with --cycles-print-stats so Cycles prints the memory
+of every image it loaded, that total is compared with the prediction. Exits
+with 1 if any case is off by more than --tolerance.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+SIZE = 256
+# (extension, sample type, channel counts)
+FORMATS = (
+    ("png", "8", (1, 2, 3, 4)),
+    ("png", "16", (1, 3, 4)),
+    ("exr", "half", (1, 3, 4)),
+    ("exr", "float", (1, 3, 4)),
+)
+# "Total memory: 256.00M (268,435,456)" in the image section of the statistics
+IMAGE_TOTAL = re.compile(r"Image statistics:\s*\n\s*Total memory:[^(]*\(([\d,]+)\)")
+
+
+def make_cases(folder):
+    """Every combination worth checking, with the image files they render."""
+    cases = []
+    for ext, precision, channel_counts in FORMATS:
+        is_float = precision in ("half", "float")
+        colorspaces = ["Linear Rec.709", "Non-Color"] if is_float else ["sRGB", "Non-Color", "ACEScg"]
+        for channels in channel_counts:
+            path = os.path.join(folder, f"{precision}_{channels}.{ext}")
+            variants = [dict(colorspace=name) for name in colorspaces]
+            variants.append(dict(colorspace=colorspaces[0], packed=True))
+            if is_float:
+                variants.append(dict(colorspace=colorspaces[0], half_precision=True))
+            for variant in variants:
+                case = dict(path=path, precision=precision, channels=channels, packed=False, half_precision=False)
+                case.update(variant)
+                cases.append(case)
+    return cases
+
+
+def write_images(cases):
+    import numpy as np
+    import OpenImageIO as oiio
+
+    types = {
+        "8": (oiio.UINT8, np.uint8),
+        "16": (oiio.UINT16, np.uint16),
+        "half": (oiio.HALF, np.float16),
+        "float": (oiio.FLOAT, np.float32),
+    }
+    ramp = np.linspace(0, 1, SIZE, dtype=np.float32)
+    for case in cases:
+        if os.path.isfile(case["path"]):
+            continue
+        fmt, dtype = types[case["precision"]]
+        pixels = np.stack([ramp[None, :] * (c + 1) / 4 + ramp[:, None] * 0.1 for c in range(case["channels"])], axis=2)
+        if np.issubdtype(dtype, np.integer):
+            pixels = pixels * np.iinfo(dtype).max
+        out = oiio.ImageOutput.create(case["path"])
+        out.open(case["path"], oiio.ImageSpec(SIZE, SIZE, case["channels"], fmt))
+        out.write_image(np.ascontiguousarray(pixels.astype(dtype)))
+        out.close()
+
+
+def predict(memory, case):
+    """Bytes the memory model expects Cycles to use for a case."""
+    return int(
+        memory.image_mb(
+            SIZE * SIZE,
+            case["channels"],
+            memory.PRECISIONS.index(case["precision"]),
+            case["packed"],
+            case["half_precision"] and case["precision"] == "float",
+            memory.colorspace_kind(case["colorspace"], case["colorspace"] == "Non-Color"),
+        )
+        * 1024
+        * 1024
+    )
+
+
+def render_case(case):
+    """Inside Blender: render one image on a plane with Cycles."""
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    scene = bpy.context.scene
+    scene.render.engine = "CYCLES"
+    scene.cycles.device = "CPU"
+    scene.cycles.samples = 1
+    scene.render.resolution_x = scene.render.resolution_y = 16
+
+    image = bpy.data.images.load(case["path"])
+    image.colorspace_settings.name = case["colorspace"]
+    image.use_half_precision = case["half_precision"]
+    if case["packed"]:
+        image.pack()
+
+    material = bpy.data.materials.new("tc_validate")
+    material.use_nodes = True
+    nodes = material.node_tree.nodes
+    texture = nodes.new("ShaderNodeTexImage")
+    texture.image = image
+    material.node_tree.links.new(texture.outputs["Color"], nodes["Principled BSDF"].inputs["Base Color"])
+
+    mesh = bpy.data.meshes.new("plane")
+    mesh.from_pydata([(-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, 1, 0)], [], [(0, 1, 2, 3)])
+    mesh.materials.append(material)
+    scene.collection.objects.link(bpy.data.objects.new("plane", mesh))
+    camera = bpy.data.objects.new("camera", bpy.data.cameras.new("camera"))
+    camera.location = (0, 0, 3)
+    scene.collection.objects.link(camera)
+    scene.camera = camera
+
+    bpy.ops.render.render()
+
+
+def measure(blender, case):
+    """Render a case in its own background Blender, returns the image memory Cycles reported or None."""
+    command = [blender, "-b", "--factory-startup", "--python-exit-code", "1", "-P", os.path.abspath(__file__)]
+    command += ["--", "--case", json.dumps(case), "--cycles-print-stats"]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    match = IMAGE_TOTAL.search(completed.stdout)
+    if completed.returncode != 0 or match is None:
+        print(completed.stdout[-2000:])
+        return None
+    return int(match.group(1).replace(",", ""))
+
+
+def describe(case):
+    name = f"{case['precision']:>5} x{case['channels']} {case['colorspace']}"
+    if case["packed"]:
+        name += " packed"
+    if case["half_precision"]:
+        name += " half"
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blender", default="blender", help="Blender executable")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="relative difference that counts as a mismatch")
+    parser.add_argument("--json", help="write the results to this file too")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from bench_sharpness import load_addon
+
+    memory = importlib.import_module(load_addon().__name__ + ".memory")
+    cases = make_cases(tempfile.mkdtemp(prefix="tc_validate_memory_"))
+    write_images(cases)
+
+    results = []
+    mismatches = 0
+    print(f"{'case':<36} {'predicted':>12} {'measured':>12} {'ratio':>6}")
+    for case in cases:
+        predicted, measured = predict(memory, case), measure(args.blender, case)
+        ratio = measured / predicted if measured and predicted else None
+        ok = ratio is not None and abs(ratio - 1) <= args.tolerance
+        mismatches += not ok
+        results.append(dict(case, predicted=predicted, measured=measured))
+        shown = f"{ratio:>6.2f}" if ratio is not None else f"{'-':>6}"
+        print(f"{describe(case):<36} {predicted:>12,} {measured or 0:>12,} {shown}{'' if ok else '  MISMATCH'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    print(f"{len(cases) - mismatches} of {len(cases)} cases match the memory model")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    if bpy is not None:
+        # started by measure(), render the case given after --
+        argv = sys.argv[sys.argv.index("--") + 1 :]
+        render_case(json.loads(argv[argv.index("--case") + 1]))
+    else:
+        sys.exit(main())
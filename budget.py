@@ -0,0 +1,179 @@
+import numpy as np
+
+from . import analysis
+from . import memory
+from . import settings
+
+# this is imported outside of Blender too, never import bpy here
+
+# changes to the depth a texture can get in budget mode, combined with every resize
+DEPTH_OPTIONS = ("keep", "greyscale", "drop alpha", "half float", "8 bit")
+RESIZE_OPTIONS = (1,) + analysis.PYRAMID_FACTORS
+# most color a texture may have and still be considered for greyscale, Aggressive allows up to this too
+GREY_MAX_COLOR = 0.2
+
+
+def mse_of_psnr(psnr):
+    return np.power(10.0, -np.asarray(psnr, np.float64) / 10)
+
+
+class Candidates:
+    """Every resize and depth change of every texture, with the quality it costs.
+
+    Arrays are (textures, candidates), candidate 0 keeps the texture as it is.
+    cost is the mean squared error the change adds, in the 0-1 pixel range, and
+    inf where a change doesn't apply to a texture.
+    """
+
+    def __init__(self, n):
+        self.options = [(resize, depth) for depth in DEPTH_OPTIONS for resize in RESIZE_OPTIONS]
+        shape = (n, len(self.options))
+        self.resize = np.ones(shape, np.int64)
+        self.optimized_depth = np.zeros(shape, np.int64)
+        self.half = np.zeros(shape, bool)
+        self.cost = np.full(shape, np.inf)
+        self.psnr = np.full(shape, np.nan)  # of the resize, for the report
+
+
+def depth_options(columns):
+    """Return {option: (optimized depth, half, mean squared error)}, the error is inf where it doesn't apply."""
+    n = len(columns["depth"])
+    depth, color, is_float = columns["depth"], columns["color_factor"], columns["is_float"]
+    constant_alpha = columns["alpha_factor"] < 0.5
+    error_8bit = np.where(columns["is_data"], columns["linear8_error"], columns["srgb8_error"])
+    colors = columns["range_factor"]
+    palette = is_float & (colors > 0) & (colors <= settings.PALETTE_MAX_COLORS) & (columns["float_peak"] <= 1)
+    mse_8bit = np.where(palette, 0, np.nan_to_num(error_8bit, nan=np.inf) ** 2)
+    # the largest channel difference bounds the error of dropping the color
+    mse_grey = (color / 3) ** 2
+    no_change = np.zeros(n, np.int64)
+
+    # a single channel float texture has a depth of 32 too
+    rgba = (depth == 32) & ~is_float
+    # float colors only go to 8 bit sRGB from Rec.709 linear, see core.optimize_depth
+    linear = columns["colorspace"] == memory.COLORSPACE_RAW
+    greyable = ((depth == 24) | (rgba & constant_alpha) | ((depth == 96) & linear)) & (color <= GREY_MAX_COLOR)
+    grey_error = mse_grey + np.where(depth == 96, mse_8bit, 0)
+    # 8 bit channels of a float texture, the same choice Safe makes in optimize_depth
+    new_depth = np.select([color < 0.03, constant_alpha], [8, 24], 32)
+    return {
+        "keep": (no_change, np.zeros(n, bool), np.zeros(n)),
+        "greyscale": (np.full(n, 8), np.zeros(n, bool), np.where(greyable, grey_error, np.inf)),
+        "drop alpha": (np.full(n, 24), np.zeros(n, bool), np.where(rgba & constant_alpha, 0.0, np.inf)),
+        "half float": (
+            no_change,
+            np.ones(n, bool),
+            np.where(is_float, np.nan_to_num(columns["half_error"], nan=np.inf) ** 2, np.inf),
+        ),
+        "8 bit": (new_depth, np.zeros(n, bool), np.where(is_float & linear, mse_8bit, np.inf)),
+    }
+
+
+def resize_options(columns, allowed_safe, allowed_aggressive):
+    """Return {divisor: (psnr, mean squared error)}, the error is inf where the resize isn't allowed.
+
+    Textures the scan pyramid measured get the error it measured. The others may
+    go as far as the sharpness cutoffs of Aggressive allow, and are charged the
+    quality the setting that allows the resize stands for.
+    """
+    n = len(columns["depth"])
+    smallest = np.minimum(columns["width"], columns["height"])
+    level_psnr = columns["level_psnr"]
+    options = {1: (np.full(n, np.nan), np.zeros(n))}
+    for index, factor in enumerate(analysis.PYRAMID_FACTORS):
+        measured = level_psnr[:, index]
+        guessed = np.select(
+            [allowed_safe >= factor, allowed_aggressive >= factor],
+            [settings.RESIZE_PSNR_SAFE, settings.RESIZE_PSNR_AGGRESSIVE],
+            np.nan,
+        )
+        psnr = np.where(np.isnan(measured), guessed, measured)
+        error = np.where(np.isnan(psnr) | (smallest // factor < 2), np.inf, mse_of_psnr(psnr))
+        options[factor] = (psnr, error)
+    return options
+
+
+def candidates(columns, allowed_safe, allowed_aggressive):
+    """Build the candidates of every texture, allowed_* are the resize divisors Safe and Aggressive pick."""
+    n = len(columns["depth"])
+    result = Candidates(n)
+    depths = depth_options(columns)
+    resizes = resize_options(columns, allowed_safe, allowed_aggressive)
+    exportable = columns["exportable"]
+    for k, (resize, option) in enumerate(result.options):
+        optimized_depth, half, depth_error = depths[option]
+        psnr, resize_error = resizes[resize]
+        result.resize[:, k] = resize
+        result.optimized_depth[:, k] = optimized_depth
+        result.half[:, k] = half
+        result.psnr[:, k] = psnr
+        # packed and generated images can't be written, they can only stay as they are
+        result.cost[:, k] = np.where(exportable | (k == 0), depth_error + resize_error, np.inf)
+    return result
+
+
+def solve(size, cost, budget_mb):
+    """Pick one candidate per texture so the total size fits the budget with the least total cost.
+
+    A multiple choice knapsack, solved greedily: every texture can only move
+    along the lower convex hull of its (size, cost) candidates, and the moves of
+    all textures are taken cheapest per MB saved first until the total fits.
+    That is optimal up to the last move taken. Returns (chosen candidate of every
+    texture, whether the budget is met).
+    """
+    n, k = size.shape
+    rows = np.arange(n)
+    choice = np.zeros(n, np.int64)
+    excess = size[:, 0].sum() - budget_mb
+    if excess <= 0:
+        return choice, True
+
+    # walk the hull of every texture at once, one move per round, starting from candidate 0
+    current = np.zeros(n, np.int64)
+    moves = []  # (round, texture, candidate, MB saved, cost per MB)
+    for round_index in range(k):
+        saved = size[rows, current][:, None] - size
+        added = cost - cost[rows, current][:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = np.where((saved > 1e-9) & np.isfinite(cost), added / saved, np.inf)
+        best = np.argmin(slope, axis=1)
+        moving = np.isfinite(slope[rows, best])
+        if not moving.any():
+            break
+        texture = rows[moving]
+        moves.append(
+            (
+                np.full(len(texture), round_index),
+                texture,
+                best[moving],
+                saved[texture, best[moving]],
+                slope[texture, best[moving]],
+            )
+        )
+        current[moving] = best[moving]
+
+    if not moves:
+        return choice, False
+    rounds, textures, targets, saved, slopes = (np.concatenate(column) for column in zip(*moves))
+    # within a texture the slopes only rise, so taking the cheapest first keeps its moves in order
+    order = np.lexsort((rounds, slopes))
+    taken = np.cumsum(saved[order]) - saved[order] < excess
+    order = order[taken]
+    for round_index in range(k):
+        step = order[rounds[order] == round_index]
+        choice[textures[step]] = targets[step]
+    return choice, bool(saved[order].sum() >= excess - 1e-9)
+
+
+def describe(result, texture, k, cost):
+    """Why a texture got the change it got, for the panel and the report."""
+    resize, option = result.options[k]
+    parts = []
+    if resize > 1:
+        parts.append(f"1/{resize} size at {result.psnr[texture, k]:.1f} dB")
+    if option != "keep":
+        parts.append(option)
+    if not parts:
+        return ""
+    quality = f"{analysis.psnr(float(cost)):.1f} dB overall" if cost > 0 else "lossless"
+    return f"{', '.join(parts)} ({quality})"
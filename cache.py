@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from . import settings
+from . import store
+
+# bump this whenever the analysis changes so stale results are never reused
+SCHEMA_VERSION = 9
+
+# number of bytes sampled from the start, middle and end of a file for the fast hash
+HASH_CHUNK = 64 * 1024
+# several Blender processes can share the cache in batch mode, writes are committed
+# every few seconds so none of them holds the write lock for a whole scan
+COMMIT_INTERVAL = 2.0
+LOCK_TIMEOUT = 60
+
+
+def analysis_version():
+    """Identify the analysis settings a cached record was produced with."""
+    sampling = f"{settings.SEQUENCE_STRIDE}:{int(settings.SEQUENCE_FULL_SCAN)}"
+    return f"{SCHEMA_VERSION}:{int(settings.HYPERSPEED)}:{settings.RESIZE_PERCENTILE}:{sampling}"
+
+
+def default_cache_dir():
+    """Return the per-user cache folder for this addon."""
+    if settings.CACHE_DIR:
+        return settings.CACHE_DIR
+
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.join(os.path.expanduser("~"), "Library", "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "texture_compactor")
+
+
+def pyramid_dir():
+    return os.path.join(default_cache_dir(), "pyramids")
+
+
+def pyramid_path(content_hash, factor):
+    """Where the 1/factor level of a scanned texture is kept, shared by every file with this content."""
+    return os.path.join(pyramid_dir(), content_hash[:2], f"{content_hash}_r{factor}.npy")
+
+
+def thumbnail_path(content_hash):
+    """The report preview of a scanned texture, it lives with the pyramid levels and shares their budget."""
+    return os.path.join(pyramid_dir(), content_hash[:2], f"{content_hash}_thumb.png")
+
+
+def evict_pyramids(max_mb=None):
+    """Delete the least recently used pyramid levels until they fit in their size budget."""
+    max_bytes = (max_mb if max_mb is not None else settings.PYRAMID_CACHE_MB) * 1024 * 1024
+    entries = []
+    for root, _dirs, names in os.walk(pyramid_dir()):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+    total = sum(size for _atime, size, _path in entries)
+    removed = 0
+    for _atime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def fast_hash(path, size):
+    """Hash the file size plus a few sampled chunks, cheap enough to run on every rescan."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= HASH_CHUNK * 3:
+            h.update(f.read())
+        else:
+            for offset in (0, size // 2, size - HASH_CHUNK):
+                f.seek(offset)
+                h.update(f.read(HASH_CHUNK))
+    return h.hexdigest()
+
+
+def file_key(path):
+    """Return (path, size, mtime, hash) for a file on disk, or None if it can't be read."""
+    try:
+        stat = os.stat(path)
+        return (path, stat.st_size, stat.st_mtime_ns, fast_hash(path, stat.st_size))
+    except OSError:
+        return None
+
+
+class ScanCache:
+    """Persistent SQLite index of scan results, keyed by file content."""
+
+    def __init__(self, folder=None, max_mb=None):
+        self.folder = folder or default_cache_dir()
+        self.max_bytes = (max_mb if max_mb is not None else settings.CACHE_MAX_MB) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._last_commit = 0
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(self.folder, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(self.folder, "scan_cache.sqlite"), timeout=LOCK_TIMEOUT, check_same_thread=False
+            )
+            # readers don't wait for a writer in another process
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS scans (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime INTEGER,
+                    hash TEXT,
+                    version TEXT,
+                    record TEXT,
+                    nbytes INTEGER,
+                    last_used REAL
+                )"""
+            )
+        return self._db
+
+    def _commit_every(self, interval):
+        # called with the lock held
+        if time.time() - self._last_commit > interval:
+            self._db.commit()
+            self._last_commit = time.time()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached record for a file key, or None if it's new or changed."""
+        if key is None:
+            return None
+        path, size, mtime, digest = key
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT size, mtime, hash, version, record FROM scans WHERE path = ?",
+                (path,),
+            ).fetchone()
+
+        record = None
+        if row is not None and row[3] == analysis_version() and row[0] == size and row[2] == digest:
+            record = json.loads(row[4])
+            if row[1] != mtime and not self.unchanged(path, record):
+                record = None
+
+        with self._lock:
+            if record is None:
+                self.misses += 1
+                return None
+            # a touched but otherwise identical file is still a hit, just refresh the mtime
+            self._db.execute("UPDATE scans SET mtime = ?, last_used = ? WHERE path = ?", (mtime, time.time(), path))
+            self._commit_every(COMMIT_INTERVAL)
+            self.hits += 1
+            return record
+
+    def unchanged(self, path, record):
+        """The sampled hash misses edits between its chunks, a file with a new mtime is hashed in full."""
+        if not record.get("content_hash"):
+            return False
+        try:
+            return store.content_hash(path) == record["content_hash"]
+        except OSError:
+            return False
+
+    def put(self, key, record):
+        if key is None:
+            return
+        path, size, mtime, digest = key
+        blob = json.dumps(record)
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO scans VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, size, mtime, digest, analysis_version(), blob, len(blob), time.time()),
+            )
+            self._commit_every(COMMIT_INTERVAL)
+
+    def evict(self):
+        """Drop the least recently used entries until the cache fits in its size budget."""
+        with self._lock:
+            db = self._connect()
+            total = db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM scans").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            removed = 0
+            for path, nbytes in db.execute("SELECT path, nbytes FROM scans ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM scans WHERE path = ?", (path,))
+                total -= nbytes
+                removed += 1
+            return removed
+
+    def flush(self):
+        """Commit pending writes and apply eviction."""
+        if self._db is None:
+            return
+        self.evict()
+        with self._lock:
+            self._db.commit()
+        evict_pyramids()
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM scans")
+            self._db.commit()
+        self.reset_stats()
+
+
+_cache = None
+
+
+def get_cache():
+    """Return the shared scan cache."""
+    global _cache
+    if _cache is None:
+        _cache = ScanCache()
+    return _cache
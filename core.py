@@ -2,41 +2,215 @@ import numpy as np
 import time
 import bpy
 import os
+import html
+import json
+import shutil
 
 from . import web
 from . import settings
+from . import pixels
+from . import analysis
+from . import budget
+from . import cache
+from . import dedup
+from . import library
+from . import memory
+from . import packing
 from . import pro
+from . import profiling
+from . import store
+from . import table
+
+# PSNR a resized texture has to keep for each Smart Resize setting
+RESIZE_QUALITY = {"1": settings.RESIZE_PSNR_SAFE, "2": settings.RESIZE_PSNR_AGGRESSIVE}
+# measured error a float texture may pick up from being stored with less precision
+FLOAT_HALF_MAX_ERROR = settings.FLOAT_HALF_MAX_ERROR
+FLOAT_8BIT_MAX_ERROR = settings.FLOAT_8BIT_MAX_ERROR
+PALETTE_MAX_COLORS = settings.PALETTE_MAX_COLORS
 
-# TODO: 16/32 bit float images
-# TODO: image sequence support
-# TODO: UDIM TILES
-# TODO: persistent data storage and file loading handler
 # TODO: better packed image handling
 
 
 class ImageInfo:
+    __slots__ = (
+        "image",
+        "original_path",
+        "_optimized_path",
+        "sharpness_factor",
+        "color_factor",
+        "alpha_factor",
+        "range_factor",
+        "width",
+        "height",
+        "depth",
+        "is_float",
+        "channels",
+        "precision",
+        "content_hash",
+        "level_psnr",
+        "float_peak",
+        "half_error",
+        "linear8_error",
+        "srgb8_error",
+        "phash",
+        "mean_color",
+        "tiles",
+        "frames",
+        "original_settings",
+        "table",
+        "index",
+    )
+
     def __init__(self, image, path):
         self.image = image
         self.original_path = path
-        self.optimized_path = None
+        self._optimized_path = None
         self.sharpness_factor = 100
         self.color_factor = 100
         self.alpha_factor = 100
         self.range_factor = 0
-        self.size_original_mb = 0
-        self.size_optimized_mb = 0
-        self.optimized_resolution = None
-        self.optimized_depth = None
-        self.read_as_half_precision = False
+        # filled in from the pixels, or from the scan cache without loading the image
+        self.width = 0
+        self.height = 0
+        self.depth = 0
+        self.is_float = False
+        # channels in the file and how its samples are stored, one of memory.PRECISIONS
+        self.channels = None
+        self.precision = None
+        self.content_hash = None
+        # PSNR of the 1/2, 1/4 and 1/8 resized texture against the original, None if not measured
+        self.level_psnr = None
+        # float textures only: largest value, and the relative error of half float, 8 bit linear and 8 bit sRGB
+        self.float_peak = None
+        self.half_error = None
+        self.linear8_error = None
+        self.srgb8_error = None
+        # perceptual hash and mean RGBA color, to find near duplicates
+        self.phash = None
+        self.mean_color = None
+        # UDIM images only: [number, width, height, content hash] of every tile, the rest describes the whole set
+        self.tiles = None
+        # image sequences and movies only: [number, content hash] of every frame, the rest describes the sampled frames
+        self.frames = None
+        # colorspace and half precision of the datablock while the optimized file is in use
+        self.original_settings = None
+        # row of this texture in its TextureTable, the optimization results live there
+        self.table = None
+        self.index = None
+
+    def _decision(self):
+        if self.table is None or self.table.active is None:
+            return None
+        return self.table.active
+
+    @property
+    def optimized_path(self):
+        return self._optimized_path
+
+    @optimized_path.setter
+    def optimized_path(self, value):
+        self._optimized_path = value
+        if self.table is not None:
+            self.table.optimized_changed()
+
+    @property
+    def size_original_mb(self):
+        decision = self._decision()
+        return float(decision.size_original_mb[self.index]) if decision else 0
+
+    @property
+    def size_optimized_mb(self):
+        decision = self._decision()
+        return float(decision.size_optimized_mb[self.index]) if decision else 0
+
+    @property
+    def resize_divisor(self):
+        decision = self._decision()
+        return int(decision.resize[self.index]) if decision else 1
+
+    @property
+    def optimized_resolution(self):
+        decision = self._decision()
+        if decision is None or decision.resize[self.index] == 1:
+            return None
+        resize = int(decision.resize[self.index])
+        return [self.width // resize, self.height // resize]
+
+    @property
+    def optimized_depth(self):
+        decision = self._decision()
+        if decision is None or decision.optimized_depth[self.index] == 0:
+            return None
+        return int(decision.optimized_depth[self.index])
+
+    @property
+    def read_as_half_precision(self):
+        decision = self._decision()
+        return bool(decision.read_as_half_precision[self.index]) if decision else False
+
+    @property
+    def budget_reason(self):
+        """What fitting the budget did to this texture, empty when it was left alone or no budget is set."""
+        decision = self._decision()
+        return decision.reasons[self.index] if decision and decision.reasons else ""
+
+    def to_record(self):
+        """Return the scan results as a plain dict for the scan cache."""
+        return {
+            "sharpness_factor": float(self.sharpness_factor),
+            "color_factor": float(self.color_factor),
+            "alpha_factor": float(self.alpha_factor),
+            "range_factor": int(self.range_factor),
+            "width": self.width,
+            "height": self.height,
+            "depth": self.depth,
+            "is_float": bool(self.is_float),
+            "channels": self.channels,
+            "precision": self.precision,
+            "content_hash": self.content_hash,
+            "level_psnr": self.level_psnr,
+            "float_peak": self.float_peak,
+            "half_error": self.half_error,
+            "linear8_error": self.linear8_error,
+            "srgb8_error": self.srgb8_error,
+            "phash": self.phash,
+            "mean_color": self.mean_color,
+            "tiles": self.tiles,
+            "frames": self.frames,
+        }
+
+    @classmethod
+    def from_record(cls, image, path, record):
+        img_info = cls(image, path)
+        for key, value in record.items():
+            setattr(img_info, key, value)
+        return img_info
+
+
+def image_abspath(img):
+    """Resolve the absolute path of an image on disk, including linked library images."""
+    return os.path.abspath(bpy.path.abspath(img.filepath_raw, library=img.library))
+
+
+def is_cacheable(img):
+    """Only plain, unpacked image files can be looked up in the scan cache."""
+    return img.source == "FILE" and not img.packed_file and bool(img.filepath_raw)
 
 
 def is_optimized(image_list):
     """Check if any images have been optimized."""
+    if packing.packs:
+        return True
+    if isinstance(image_list, table.TextureTable):
+        return image_list.is_optimized()
     return any([i.optimized_path is not None for i in image_list])
 
 
 def tally_packed(img_list):
     """Tally the number of packed images in the list."""
+    if isinstance(img_list, table.TextureTable):
+        return img_list.tally_packed()
+
     packed_count = 0
     for img_info in img_list:
         if img_info.image.packed_file:
@@ -46,6 +220,10 @@ def tally_packed(img_list):
 
 def tally_sizes(image_list):
     """calculate and return some stats"""
+    if isinstance(image_list, table.TextureTable):
+        # precomputed for the active settings
+        return image_list.tally()
+
     total_original = 0
     total_optimized = 0
 
@@ -62,189 +240,318 @@ def tally_sizes(image_list):
     )
 
 
-def analyze_sharpness(pixel_data):
-    # pixel_data is expected to be a numpy array with shape (h, w, 4)
-    max_gnorm = 0
-
-    if settings.HYPERSPEED:
-        # downsize pixel_data by half to speed things up
-        pixel_data = pixel_data[::2, ::2, :]
-
-    # instead of using gradient, potentially look into doing a successive resizing and comparing with original
-    for channel in range(4):  # Iterate over R, G, B, A channels
-        gx, gy = np.gradient(pixel_data[:, :, channel])
-        gnorm = np.sqrt(gx**2 + gy**2)
-        max_gnorm = max(max_gnorm, np.max(gnorm))
-
-    return max_gnorm * 10
+def optimize_size(columns, settings):
+    """Return the resolution divisor (1, 2, 4 or 8) of every texture.
 
+    Textures measured by the scan pyramid go down to the smallest level that still
+    meets the quality of the setting, the rest fall back to the sharpness cutoffs.
+    """
+    smart_resize = float(settings["smart_resize"])
+    sharpness = columns["sharpness_factor"]
 
-def analyze_rgba(pixel_data):
-    # pixel_data is expected to be a numpy array with shape (h, w, 4)
-    # Extract the RGB channels
+    divisor = np.select(
+        [sharpness < 0.1 * smart_resize, sharpness < 0.15 * smart_resize, sharpness < 0.3 * smart_resize],
+        [8, 4, 2],
+        1,
+    )
 
-    if settings.HYPERSPEED:
-        # downsize pixel_data by half to speed things up
-        pixel_data = pixel_data[::2, ::2, :]
+    target = RESIZE_QUALITY.get(settings["smart_resize"])
+    if target is not None:
+        level_psnr = columns["level_psnr"]
+        # the quality only drops with every level, so counting the levels that pass finds the smallest one
+        levels = np.count_nonzero(level_psnr >= target, axis=1)
+        divisor = np.where(np.isnan(level_psnr[:, 0]), divisor, np.left_shift(1, levels))
+    return divisor
 
-    rgb = pixel_data[:, :, :3]
-    alpha = pixel_data[:, :, 3]
 
-    # Calculate the absolute differences between R, G, and B channels
-    diff_rg = np.abs(rgb[..., 0] - rgb[..., 1])
-    diff_rb = np.abs(rgb[..., 0] - rgb[..., 2])
-    diff_gb = np.abs(rgb[..., 1] - rgb[..., 2])
+def optimize_depth(columns, settings):
+    """Return (optimized depth or 0, read as half precision) for every texture."""
+    convert_greyscale = float(settings["convert_greyscale"])
+    optimize_float = float(settings["optimize_float"])
+    depth = columns["depth"]
+    color = columns["color_factor"]
+    alpha = columns["alpha_factor"]
+    n = len(depth)
+
+    optimized_depth = np.zeros(n, np.int64)
+    half = np.zeros(n, bool)
+
+    def apply(mask, new_depth):
+        optimized_depth[mask] = new_depth
+
+    # depth 8 is already greyscale. no need to compress
+    if optimize_float > 1:
+        # make into 8bit greyscale
+        apply(depth == 16, 8)
+
+    grey = color < 0.03 * convert_greyscale
+    apply((depth == 24) & grey, 8)
+
+    # check alpha is constant
+    constant_alpha = (depth == 32) & (alpha < 0.5 * convert_greyscale)
+    apply(constant_alpha & (color < 0.1 * convert_greyscale), 8)
+    # remove constant alpha
+    apply(constant_alpha & (color >= 0.1 * convert_greyscale), 24)
+
+    # float colors only go to 8 bit sRGB from Rec.709 linear, other primaries would shift
+    linear = columns["colorspace"] == memory.COLORSPACE_RAW
+    apply((depth == 96) & grey & linear, 8)
+
+    # float textures, decided on the precision error measured by the scan
+    is_float = columns["is_float"]
+    if optimize_float >= 1:
+        # read at half precision where that stays within the error budget, unmeasured textures are left alone
+        use_half = is_float & (columns["half_error"] <= FLOAT_HALF_MAX_ERROR)
+        half[use_half] = True
+
+    if optimize_float > 1:
+        # store as 8 bit, data with a linear curve and colors with the sRGB curve
+        error_8bit = np.where(columns["is_data"], columns["linear8_error"], columns["srgb8_error"])
+        to_8bit = is_float & (error_8bit <= FLOAT_8BIT_MAX_ERROR)
+        # masks and ID maps in the 0-1 range, a handful of distinct colors stay apart in 8 bit
+        colors = columns["range_factor"]
+        to_8bit |= is_float & (colors > 0) & (colors <= PALETTE_MAX_COLORS) & (columns["float_peak"] <= 1)
+        to_8bit &= linear
+        new_depth = np.select([grey, alpha < 0.5 * convert_greyscale], [8, 24], 32)
+        optimized_depth[to_8bit] = new_depth[to_8bit]
+        half[to_8bit] = False
+
+    return optimized_depth, half
+
+
+def compute_image_size(columns):
+    """Return the original memory usage of every texture in MB, in the image slots Cycles uses.
+
+    All tiles of a UDIM set count together. Sequences and movies count one frame,
+    Cycles only loads the frame that is being rendered.
+    """
+    return memory.image_mb(
+        columns["pixels"],
+        columns["channels"],
+        columns["precision"],
+        columns["builtin"],
+        columns["is_float"] & columns["use_half_precision"],
+        columns["colorspace"],
+    )
 
-    color_factor = np.max(diff_rg) + np.max(diff_rb) + np.max(diff_gb)
-    alpha_factor = not np.all(alpha == 1.0)
 
-    # tally up the unique colors
-    # unique_colors = np.unique(pixel_data.reshape(-1, 4), axis=0)
-    # range_factor = len(unique_colors)
-    range_factor = 0
+def compute_optimized_size(columns, resize, optimized_depth, half):
+    """Return the memory usage in MB of every texture once its optimized file is in use.
+
+    8 bit results have the channels of their depth, float ones turned 8 bit
+    switch to sRGB unless they hold data. Resized files are written as half
+    float if they were float or 16 bit and as 8 bit otherwise. Packed images stay as
+    they are, a movie is read from its optimized frames.
+    """
+    to_8bit = optimized_depth > 0
+    rewritten = ((resize > 1) | to_8bit) & ~columns["packed"]
+    is_float = columns["is_float"]
+    wide = is_float | (columns["precision"] == memory.USHORT)
+    channels = np.where(to_8bit, optimized_depth // 8, columns["channels"])
+    precision = np.select(
+        [to_8bit, rewritten & wide, rewritten], [memory.BYTE, memory.HALF, memory.BYTE], columns["precision"]
+    )
+    colorspace = np.where(to_8bit & is_float & ~columns["is_data"], memory.COLORSPACE_SRGB, columns["colorspace"])
+    half_precision = half | (is_float & columns["use_half_precision"])
+    size_mb = memory.image_mb(
+        columns["pixels"], channels, precision, columns["builtin"] & ~rewritten, half_precision, colorspace
+    )
+    return np.where(columns["packed"], compute_image_size(columns), size_mb / resize**2)
 
-    return color_factor, alpha_factor, range_factor
 
+def fit_budget(columns, budget_mb):
+    """Pick the change to every texture that fits the memory budget with the least quality lost.
 
-def optimize_size(img_info, settings, execute=False):
-    smart_resize = float(settings["smart_resize"])
+    Every texture gets the candidates of budget.py, sized the same way as the
+    regular settings, and the knapsack solver picks one of each.
+    """
+    size_original_mb = compute_image_size(columns)
+    allowed_safe = optimize_size(columns, {"smart_resize": "1"})
+    allowed_aggressive = optimize_size(columns, {"smart_resize": "2"})
+    options = budget.candidates(columns, allowed_safe, allowed_aggressive)
 
-    if img_info.sharpness_factor < 0.1 * smart_resize:
-        img_info.size_optimized_mb /= 64
-        img_info.optimized_resolution = [img_info.image.size[0] // 8, img_info.image.size[1] // 8]
-    elif img_info.sharpness_factor < 0.15 * smart_resize:
-        img_info.size_optimized_mb /= 16
-        img_info.optimized_resolution = [img_info.image.size[0] // 4, img_info.image.size[1] // 4]
-    elif img_info.sharpness_factor < 0.3 * smart_resize:
-        img_info.size_optimized_mb /= 4
-        img_info.optimized_resolution = [img_info.image.size[0] // 2, img_info.image.size[1] // 2]
-    return img_info
+    size = np.empty_like(options.cost)
+    for k in range(size.shape[1]):
+        size[:, k] = compute_optimized_size(
+            columns, options.resize[:, k], options.optimized_depth[:, k], options.half[:, k]
+        )
+    size[:, 0] = size_original_mb
+    choice, fits = budget.solve(size, options.cost, budget_mb)
+
+    rows = np.arange(len(choice))
+    cost = options.cost[rows, choice]
+    reasons = [budget.describe(options, i, k, c) for i, (k, c) in enumerate(zip(choice, cost))]
+    return table.Decision(
+        size_original_mb,
+        size[rows, choice],
+        options.resize[rows, choice],
+        options.optimized_depth[rows, choice],
+        options.half[rows, choice],
+        reasons,
+        fits,
+    )
 
 
-def optimize_depth(img_info, settings, execute=False):
-    convert_greyscale = float(settings["convert_greyscale"])
-    optimize_float = float(settings["optimize_float"])
-    depth = img_info.image.depth
-
-    if depth == 8:
-        # already greyscale. no need to compress
-        pass
-    elif depth == 16:
-        if optimize_float > 1:
-            # make into 8bit greyscale
-            img_info.size_optimized_mb /= 2
-            img_info.optimized_depth = 8
-    elif depth == 24:
-        if img_info.color_factor < 0.03 * convert_greyscale:
-            # make into 8bit greyscale
-            img_info.size_optimized_mb /= 3  # 24bit/8bit = 3
-            img_info.optimized_depth = 8
-    elif depth == 32:
-        # check alpha is constant
-        if img_info.alpha_factor < 0.5 * convert_greyscale:
-            if img_info.color_factor < 0.1 * convert_greyscale:
-                # make into 8bit greyscale
-                img_info.size_optimized_mb /= 4
-                img_info.optimized_depth = 8
-            else:
-                # remove constant alpha
-                img_info.size_optimized_mb -= img_info.size_optimized_mb / 4
-                img_info.optimized_depth = 24
-    elif depth == 96:
-        if img_info.color_factor < 0.03 * convert_greyscale:
-            # make into 8bit greyscale
-            img_info.size_optimized_mb /= 12  # 24bit/8bit = 3
-            img_info.optimized_depth = 8
-    elif depth == 128:
-        if optimize_float == 1:
-            # use to half precision if not already
-            if not img_info.image.use_half_precision:
-                img_info.size_optimized_mb /= 2
-                img_info.read_as_half_precision = True
-            else:
-                img_info.read_as_half_precision = True
-        elif optimize_float > 1:
-            if img_info.color_factor < 0.03 * convert_greyscale:
-                # make into 8bit greyscale
-                img_info.size_optimized_mb /= 8  # 64bit/8bit = 16
-                img_info.optimized_depth = 8
+def evaluate(columns, settings):
+    """Work out what the given settings do to every texture in one vectorized pass."""
+    if settings.get("budget_mb") is not None:
+        return fit_budget(columns, settings["budget_mb"])
+    size_original_mb = compute_image_size(columns)
+    resize = optimize_size(columns, settings)
+    optimized_depth, half = optimize_depth(columns, settings)
+    size_optimized_mb = compute_optimized_size(columns, resize, optimized_depth, half)
+    return table.Decision(size_original_mb, size_optimized_mb, resize, optimized_depth, half)
 
-    else:
-        print(f"Cannot handle bit depth {depth} for {img_info.image.name}")
 
-    return img_info
+def analysis_step():
+    """Decimation factor between the source and the resolution the analysis runs at."""
+    # downsize pixel_data by half to speed things up
+    return 2 if settings.HYPERSPEED else 1
 
 
-def compute_image_size(img_info):
-    img = img_info.image
-    w, h = img.size[0], img.size[1]
+def read_image_pixels(img):
+    """Fetch the pixels of an image at analysis resolution.
 
-    # calc original size
-    if img.is_float:
-        if img.use_half_precision:
-            size_original_mb = w * h * img.depth / 8 / 1024 / 1024 / 2
-        else:
-            size_original_mb = w * h * img.depth / 8 / 1024 / 1024
-    else:
-        size_original_mb = w * h * img.depth / 8 / 1024 / 1024
-    img_info.size_original_mb = size_original_mb
-    img_info.size_optimized_mb = size_original_mb
-    return img_info
+    File images are decoded straight from disk so Blender never has to load them,
+    anything else goes through the image's float buffer. Returns (pixel_data, info)
+    or None if the image has no pixels.
+    """
+    step = analysis_step()
 
+    if is_cacheable(img) and pixels.available():
+        result = pixels.read_pixels(image_abspath(img), step)
+        if result is not None:
+            profiling.add_bytes_read(profiling.file_size(image_abspath(img)))
+            return result
 
-def scan_image(img):
+    # Ensure image is loaded by accessing its size first
     w, h = img.size
-    depth = img.depth
-    pixel_data = np.zeros((w, h, 4), "f")
+    if w == 0 or h == 0:
+        print(f"Image {img} is not loaded")
+        return None
+
+    if not img.has_data:
+        print(f"Image {img.name} has no pixel data")
+        return None
+
+    info = {
+        "width": w,
+        "height": h,
+        "depth": img.depth,
+        "is_float": img.is_float,
+        "channels": img.channels,
+        # Blender doesn't say if a float file is half or full float, full is the safe guess
+        "precision": "float" if img.is_float else "8",
+    }
+    pixel_data = np.zeros((h, w, 4), "f")
     img.pixels.foreach_get(pixel_data.ravel())
+    profiling.add_bytes_read(pixel_data.nbytes)
+    return pixel_data[::step, ::step, :], info
 
+
+def scan_image(img):
     img_info = ImageInfo(img, img.filepath)
 
-    if img.packed_file:
-        # because we can't optimize packed images
-        print(f"Can't optimize packed {img.name}")
+    if img.packed_file or img.source in {"SEQUENCE", "MOVIE", "TILED", "GENERATED"}:
+        # still report the image, but don't bother fetching any pixels
+        img_info.width, img_info.height = img.size
+        if img_info.width == 0 or img_info.height == 0:
+            print(f"Image {img} is not loaded")
+            return None
+        img_info.depth = img.depth
+        img_info.is_float = img.is_float
+        img_info.channels = img.channels
+        img_info.precision = "float" if img.is_float else "8"
+        if img.source == "TILED":
+            # only the first tile is loaded, assume the others match it
+            img_info.tiles = [[tile.number, img_info.width, img_info.height, None] for tile in img.tiles]
+
+        if img.packed_file:
+            # because we can't optimize packed images
+            print(f"Can't optimize packed {img.name}")
+        else:
+            # because we can't optimize image sequences
+            print(f"Can't optimize none-file images {img.name}")
         return img_info
 
-    if img.source == "SEQUENCE" or img.source == "MOVIE" or img.source == "TILED" or img.source == "GENERATED":
-        # because we can't optimize image sequences
-        print(f"Can't optimize none-file images {img.name}")
-        return img_info
+    with profiling.phase("decode"):
+        result = read_image_pixels(img)
+    if result is None:
+        return None
+    pixel_data, info = result
+    for key, value in info.items():
+        setattr(img_info, key, value)
 
-    # calculate sharpness for smart resize
-    peak_sharpness = analyze_sharpness(pixel_data)
-    img_info.sharpness_factor = peak_sharpness
+    for key, value in analysis.analyze(pixel_data, is_float=info["is_float"]).items():
+        setattr(img_info, key, value)
 
-    # calculate rgb and alpha value for smart conversion
-    color_factor, alpha_factor, range_factor = analyze_rgba(pixel_data)
-    img_info.color_factor = color_factor
-    img_info.alpha_factor = alpha_factor
-    img_info.range_factor = range_factor
+    if is_cacheable(img):
+        with profiling.phase("hash"):
+            img_info.content_hash = store.content_hash(image_abspath(img))
 
     return img_info
 
 
+def scene_settings(scene):
+    return {
+        "convert_greyscale": scene.TC_convert_greyscale,
+        "smart_resize": scene.TC_smart_resize,
+        "optimize_float": scene.TC_optimize_float,
+        # replaces the three settings above when set
+        "budget_mb": scene.TC_budget_mb if scene.TC_fit_budget else None,
+    }
+
+
 def update_memory_usage(self, context):
     """Update the memory usage for each image in the list."""
+    image_list = context.scene.TC_texture_metadata
+    image_list.select(scene_settings(context.scene), evaluate)
 
-    settings = {
-        "convert_greyscale": context.scene.TC_convert_greyscale,
-        "smart_resize": context.scene.TC_smart_resize,
-        "optimize_float": context.scene.TC_optimize_float,
-    }
 
-    for img_info in context.scene.TC_texture_metadata:
-        img_nfo = compute_image_size(img_info)
-        img_info = optimize_size(img_info, settings)
-        img_info = optimize_depth(img_info, settings)
+def find_duplicates(image_list):
+    """Return the duplicate clusters of the scanned textures, memoized on the table."""
+    if isinstance(image_list, table.TextureTable):
+        return image_list.duplicates(dedup.find_duplicates)
+    return dedup.find_duplicates(image_list)
 
 
-def optimize_images(self, context):
-    """Optimize all textures in the list."""
-    for img_info in context.scene.TC_texture_metadata:
-        pro.optimize(img_info)
+def plan_exports(image_list, output_store, output_format="IMAGE", library_mode=False):
+    """Group the textures that need a new file by their output, so each file is written once.
 
+    In library mode linked images go to the store beside their library instead.
+    """
+    exports = {}
+    for img_info in image_list:
+        target_store = output_store
+        if library_mode and img_info.image.library is not None:
+            target_store = library.output_store(img_info.image.library)
+        job = pro.export_job(img_info, target_store, output_format)
+        if job is None:
+            continue
+        if job["target"] not in exports:
+            exports[job["target"]] = (job, [])
+        exports[job["target"]][1].append(img_info)
+    return list(exports.values())
+
+
+def use_optimized_textures(context):
     # set the flag to use optimized textures
-    context.scene.TC_texture_swap = "1"
+    if context.scene.TC_texture_swap == "1":
+        pro.use_optimized(context.scene.TC_texture_metadata)
+    else:
+        context.scene.TC_texture_swap = "1"
+
+
+def optimize_images(self, context, image_list=None):
+    """Optimize textures one by one on the main thread, used when there is no export pool."""
+    if image_list is None:
+        image_list = context.scene.TC_texture_metadata
+    output_store = store.OutputStore(pro.output_folder())
+    for img_info in image_list:
+        with profiling.texture(img_info.image.name), profiling.phase("encode"):
+            pro.optimize(img_info, output_store)
+
+    use_optimized_textures(context)
 
 
 def update_texture_swap(self, context):
@@ -256,72 +563,236 @@ def update_texture_swap(self, context):
         pro.use_optimized(context.scene.TC_texture_metadata)
 
 
-def generate_html_report(image_info_list, show_optimized=True):
-    optimized_images = [info for info in image_info_list if info.size_optimized_mb < info.size_original_mb]
-
-    # Sort by original size in descending order
-    all_images_sorted = sorted(image_info_list, key=lambda x: x.size_original_mb, reverse=True)
-
-    total_before, total_after, delta, changes = tally_sizes(all_images_sorted)
-
-    rows = ""
-    for info in all_images_sorted:
-        original_resolution = f"{info.image.size[0]}x{info.image.size[1]}"
-        new_resolution = (
-            f"{info.optimized_resolution[0]}x{info.optimized_resolution[1]}"
-            if info.optimized_resolution
-            else original_resolution
-        )
-
-        if info.image.is_float and info.image.use_half_precision:
-            original_bit_depth = f"{info.image.depth}bit(½)"
-        else:
-            original_bit_depth = f"{info.image.depth}bit"
+# fields of every texture in the report data, the rows are lists in this order to keep the file small
+REPORT_COLUMNS = (
+    "name",
+    "path",
+    "thumbnail",
+    "packed",
+    "optimized",
+    "depth",
+    "half",
+    "new_depth",
+    "new_half",
+    "resolution",
+    "new_resolution",
+    "pixels",
+    "new_pixels",
+    "resize_psnr",
+    "level_psnr",
+    "size_original",
+    "size_optimized",
+)
+
+
+def thumbnail_hashes(info):
+    """Content hashes the scan may have kept a thumbnail under, the first tile or frame stands in for a set."""
+    hashes = [info.content_hash]
+    hashes += [tile[3] for tile in info.tiles or ()]
+    hashes += [frame[1] for frame in info.frames or ()]
+    return [content_hash for content_hash in hashes if content_hash]
+
+
+def export_thumbnails(image_list, folder):
+    """Copy the cached thumbnails of the textures into the folder beside the report.
+
+    Returns {id(info): file name} for the textures that have one, files already
+    in the folder from an earlier report are kept.
+    """
+    os.makedirs(folder, exist_ok=True)
+    names = {}
+    for info in image_list:
+        for content_hash in thumbnail_hashes(info):
+            source = cache.thumbnail_path(content_hash)
+            name = os.path.basename(source)
+            target = os.path.join(folder, name)
+            try:
+                if not os.path.isfile(target):
+                    shutil.copyfile(source, target)
+            except OSError:
+                continue
+            names[id(info)] = name
+            break
+    return names
+
+
+def report_row(info, thumbnail):
+    """One texture of the report data, in the order of REPORT_COLUMNS."""
+    resolution = f"{info.width}x{info.height}"
+    resized = info.optimized_resolution
+    new_resolution = f"{resized[0]}x{resized[1]}" if resized else resolution
+    count = 1
+    if info.tiles:
+        count = len(info.tiles)
+        resolution += f" ×{count}"
+        new_resolution += f" ×{count}"
+    elif info.frames:
+        resolution += f" ({len(info.frames)} frames)"
+        new_resolution += f" ({len(info.frames)} frames)"
+
+    # measured quality of the resize, with every level in the tooltip
+    resize_psnr = level_psnr = None
+    if info.level_psnr:
+        level_psnr = ", ".join(f"1/{f}: {p:.1f} dB" for f, p in zip(analysis.PYRAMID_FACTORS, info.level_psnr))
+        if resized:
+            resize_psnr = round(info.level_psnr[info.resize_divisor.bit_length() - 2], 1)
+
+    pixel_count = info.width * info.height * count
+    return [
+        info.image.name,
+        image_abspath(info.image),
+        thumbnail,
+        bool(info.image.packed_file),
+        info.size_optimized_mb < info.size_original_mb,
+        info.depth,
+        bool(info.is_float and info.image.use_half_precision),
+        info.optimized_depth or info.depth,
+        bool(info.is_float and info.read_as_half_precision),
+        resolution,
+        new_resolution,
+        pixel_count,
+        pixel_count // info.resize_divisor**2,
+        resize_psnr,
+        level_psnr,
+        round(info.size_original_mb, 3),
+        round(info.size_optimized_mb, 3),
+    ]
+
+
+def report_data(image_info_list, thumbnails=None, folder=""):
+    """The textures of the report as compact JSON, safe to put inside a script tag.
+
+    thumbnails is what export_thumbnails returned, folder is where they are
+    relative to the report.
+    """
+    thumbnails = thumbnails or {}
+    rows = []
+    for info in image_info_list:
+        name = thumbnails.get(id(info))
+        rows.append(report_row(info, f"{folder}/{name}" if name else None))
+    data = json.dumps({"columns": REPORT_COLUMNS, "rows": rows}, ensure_ascii=False, separators=(",", ":"))
+    # a texture named </script> must not end the data early
+    return data.replace("<", "\\u003c")
+
+
+def generate_html_report(image_info_list, show_optimized=True, thumbnails=None, folder=""):
+    """Build the HTML report, the browser fills in the texture table from the JSON data."""
+    total_before, total_after, delta, changes = tally_sizes(image_info_list)
 
-        if info.image.is_float and info.read_as_half_precision:
-            new_bit_depth = f"{info.optimized_depth}bit(½)" if info.optimized_depth else f"{info.image.depth}bit(½)"
-        else:
-            new_bit_depth = f"{info.optimized_depth}bit" if info.optimized_depth else f"{info.image.depth}bit"
+    total_savings = f"Before: {int(total_before)}MB | After: {int(total_after)}MB | Potential Savings: {int(delta)}MB"
 
-        if info.image.packed_file:
-            name = f'<span title="Cannot optimize packed images">🔒{info.image.name}</span>'
-        else:
-            name = f"<span>{info.image.name}</span>"
-        size_percentage = int((info.size_original_mb / total_before) * 100)
-        rows += web.row_template.format(
-            name=name,
-            filepath=os.path.abspath(bpy.path.abspath(info.image.filepath_raw, library=info.image.library)).replace(
-                "\\", "\\\\"
-            ),  # Escape backslashes for JavaScript
-            size_original=info.size_original_mb,
-            size_optimized=info.size_optimized_mb,
-            original_bit_depth=original_bit_depth,
-            new_bit_depth=new_bit_depth,
-            original_resolution=original_resolution,
-            new_resolution=new_resolution,
-            highlight="optimized" if info in optimized_images else "",
-            size_percentage=size_percentage,
+    # copies of the same texture, reclaimable by merging them
+    clusters = find_duplicates(image_info_list)
+    duplicates = ""
+    if clusters:
+        reclaimable = sum(cluster.reclaimable_mb for cluster in clusters)
+        total_savings += f" | Duplicates: {int(reclaimable)}MB"
+        duplicate_rows = "".join(
+            web.duplicate_row_template.format(
+                keeper=html.escape(cluster.keeper.image.name),
+                duplicates=html.escape(", ".join(info.image.name for info in cluster.duplicates)),
+                kind="Identical" if cluster.exact else "Near identical",
+                reclaimable=cluster.reclaimable_mb,
+            )
+            for cluster in sorted(clusters, key=lambda c: c.reclaimable_mb, reverse=True)
         )
-
-    total_savings = f"Before: {int(total_before)}MB | After: {int(total_after)}MB | Potential Savings: {int(delta)}MB"
+        duplicates = web.duplicate_table_template.format(rows=duplicate_rows)
     BLURB = """ <a href="https://mikepan.com/">Texture Compactor</a>"""
     notes = f"Report Generated on: {time.strftime('%Y-%m-%d %H:%M:%S')} by {BLURB}"
 
+    # savings of the channel packing, per material
+    packs = ""
+    if packing.packs:
+        pack_rows = "".join(
+            web.pack_row_template.format(
+                material=html.escape(group.material.name),
+                maps=html.escape(" / ".join(group.names())),
+                textures=len(group.channels),
+                size_before=group.size_before_mb,
+                size_after=group.size_after_mb,
+            )
+            for group in packing.packs
+        )
+        packs = web.pack_table_template.format(rows=pack_rows)
+
     return web.html_template.format(
-        rows=rows,
+        data=report_data(image_info_list, thumbnails, folder),
+        packs=packs,
+        budget=budget_report(image_info_list),
+        duplicates=duplicates,
+        profile=profile_report(profiling.last_profile()),
         total_savings=total_savings,
         notes=notes,
         checked="checked" if show_optimized else "",
     )
 
 
+def budget_report(image_list):
+    """The textures fitting the budget changed, largest saving first, or nothing without a budget."""
+    decision = image_list.active
+    if decision is None or decision.reasons is None:
+        return ""
+    changed = [info for info in image_list if info.budget_reason]
+    changed.sort(key=lambda info: info.size_original_mb - info.size_optimized_mb, reverse=True)
+    rows = "".join(
+        web.budget_row_template.format(
+            name=html.escape(info.image.name),
+            reason=html.escape(info.budget_reason),
+            saved=info.size_original_mb - info.size_optimized_mb,
+        )
+        for info in changed
+    )
+    total = decision.totals[1]
+    summary = f"{int(total)}MB, {len(changed)} textures changed"
+    if not decision.fits:
+        summary += ", the budget can't be met"
+    return web.budget_table_template.format(summary=summary, rows=rows)
+
+
+def profile_report(profile, count=10):
+    """Phase totals and the slowest textures of the last scan and optimize run, as HTML."""
+    if profile is None or not profile.textures:
+        return ""
+    totals = profile.totals()
+    total = sum(totals.values()) or 1
+    phase_rows = "".join(
+        web.phase_row_template.format(phase=phase, seconds=seconds, share=seconds / total * 100)
+        for phase, seconds in totals.items()
+        if seconds > 0
+    )
+    texture_rows = ""
+    for name in profile.slowest(count):
+        entry = profile.textures[name]
+        phases = sorted(entry["seconds"].items(), key=lambda item: item[1], reverse=True)
+        texture_rows += web.profile_row_template.format(
+            name=html.escape(name),
+            seconds=profile.texture_seconds(name),
+            phases=", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in phases),
+            read_mb=entry["bytes_read"] / 1024 / 1024,
+            peak_mb=f"{entry['peak_mb']:.0f}" if entry["peak_mb"] is not None else "-",
+        )
+    return web.profile_table_template.format(
+        summary=profile.summary(), phase_rows=phase_rows, texture_rows=texture_rows
+    )
+
+
 def show_report(image_list):
     filename = bpy.path.abspath(f"//{bpy.data.filepath}_texture_compactor_report.html")
 
-    report = generate_html_report(image_list)
-    with open(filename, "w") as file:
+    # small previews beside the report, the browser never has to decode the full resolution sources
+    folder = filename.replace("_report.html", "_report_files")
+    thumbnails = export_thumbnails(image_list, folder)
+    report = generate_html_report(image_list, thumbnails=thumbnails, folder=os.path.basename(folder))
+    with open(filename, "w", encoding="utf-8") as file:
         file.write(report)
 
+    # the timings behind the report, for digging into a slow scan
+    profile = profiling.last_profile()
+    if profile is not None:
+        profile.save(filename.replace("_report.html", "_profile.json"))
+        if settings.PROFILE_TRACE:
+            profile.save_trace(filename.replace("_report.html", "_trace.json"))
+
     # Open the report in the default web browser
     import webbrowser
 
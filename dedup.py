@@ -0,0 +1,110 @@
+import numpy as np
+
+from . import settings
+
+# number of set bits in every byte value
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+class DuplicateCluster:
+    """Textures with the same content, the keeper stays and the others could point to it.
+
+    Near identical clusters only hold textures that each match the keeper itself,
+    they are never merged unless the user confirms them.
+    """
+
+    def __init__(self, keeper, duplicates, exact):
+        self.keeper = keeper
+        self.duplicates = duplicates
+        self.exact = exact
+
+    @property
+    def reclaimable_mb(self):
+        return sum(info.size_optimized_mb for info in self.duplicates)
+
+
+def usage_key(info):
+    # the same file read with another colorspace or alpha mode is used differently, never merge those
+    image = info.image
+    return (image.colorspace_settings.name, image.alpha_mode, image.source)
+
+
+def keeper_order(info):
+    # keep the largest copy, the name breaks ties so the choice is stable
+    return (-info.width * info.height, info.image.name)
+
+
+def make_cluster(members, exact):
+    members = sorted(members, key=keeper_order)
+    return DuplicateCluster(members[0], members[1:], exact)
+
+
+def hamming(phash, others):
+    """Number of differing bits between one hash and an (n, bytes) uint8 array of hashes."""
+    return POPCOUNT[np.bitwise_xor(others, phash)].sum(axis=1)
+
+
+def find_duplicates(image_list):
+    """Cluster identical textures by content hash, then near identical ones by perceptual hash.
+
+    Near duplicates need a matching aspect ratio and mean color as well, and are
+    matched against a keeper only, never chained through each other. Returns a
+    list of DuplicateCluster.
+    """
+    clusters = []
+    representatives = []
+
+    exact = {}
+    for info in image_list:
+        if info.content_hash is not None:
+            exact.setdefault((info.content_hash,) + usage_key(info), []).append(info)
+        elif info.phash is not None:
+            representatives.append(info)
+    for members in exact.values():
+        keeper = members[0]
+        if len(members) > 1:
+            clusters.append(make_cluster(members, True))
+            keeper = clusters[-1].keeper
+        if keeper.phash is not None:
+            representatives.append(keeper)
+
+    # every texture left over becomes a keeper in turn, largest first, and takes the later ones close to it
+    n = len(representatives)
+    if n < 2:
+        return clusters
+    representatives.sort(key=keeper_order)
+    hashes = np.array([bytearray.fromhex(i.phash) for i in representatives], np.uint8)
+    colors = np.array([i.mean_color for i in representatives], np.float32)
+    aspect = np.array([i.width / max(i.height, 1) for i in representatives], np.float32)
+    usage = [usage_key(i) for i in representatives]
+    taken = np.zeros(n, bool)
+
+    for i in range(n - 1):
+        if taken[i]:
+            continue
+        close = (
+            (hamming(hashes[i], hashes[i + 1 :]) <= settings.DUPLICATE_MAX_BITS)
+            & (np.abs(colors[i + 1 :] - colors[i]).max(axis=1) <= settings.DUPLICATE_MAX_COLOR)
+            & np.isclose(aspect[i + 1 :], aspect[i], rtol=0.01)
+            & ~taken[i + 1 :]
+        )
+        members = [j for j in np.flatnonzero(close) + i + 1 if usage[i] == usage[j]]
+        if members:
+            taken[members] = True
+            clusters.append(DuplicateCluster(representatives[i], [representatives[j] for j in members], False))
+    return clusters
+
+
+def merge(clusters, near=False):
+    """Point every user of a duplicate at its keeper. Returns the image infos that are no longer used.
+
+    Only identical clusters are merged, near identical ones too when near is set.
+    """
+    merged = []
+    for cluster in clusters:
+        if not (cluster.exact or near):
+            continue
+        for info in cluster.duplicates:
+            info.image.user_remap(cluster.keeper.image)
+            merged.append(info)
+    return merged
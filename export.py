@@ -0,0 +1,176 @@
+import functools
+import os
+
+import numpy as np
+
+from . import analysis
+from . import bcn
+from . import pixels
+from . import profiling
+from . import sequence
+from . import udim
+
+# this runs in the worker processes too, never import bpy here
+
+
+def convert_channels(rgba, channels):
+    """Reduce RGBA to greyscale, RGB or keep it as RGBA."""
+    if channels == 1:
+        return (rgba[..., :3] @ analysis.LUMA)[..., None]
+    return rgba[..., :channels]
+
+
+def quantize(pixel_data):
+    return np.clip(pixel_data * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def to_8bit(band, job):
+    # float sources going to 8 bit carry the sRGB curve unless they hold data
+    if job.get("transfer") == "srgb":
+        band = analysis.srgb_encode(np.clip(band, 0, 1))
+    return quantize(band)
+
+
+def write_output(job, output):
+    os.makedirs(os.path.dirname(job["target"]), exist_ok=True)
+    with profiling.phase("encode"):
+        if job.get("block_format"):
+            written = bcn.write_dds(job["target"], output, job["block_format"])
+        else:
+            written = pixels.write_image(job["target"], output, job.get("compression", 6))
+    return job["target"] if written else None
+
+
+def export_level(job):
+    """Write the optimized file from a pyramid level kept by the scan, or return None if it's gone."""
+    try:
+        level = np.load(job["pyramid"], mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+    out_dtype = np.float32 if job["float_output"] else np.uint8
+    output = np.empty(level.shape[:2] + (job["channels"],), out_dtype)
+    with profiling.phase("decode"):
+        profiling.add_bytes_read(level.nbytes)
+        for y0 in range(0, level.shape[0], pixels.STRIP_ROWS):
+            band = level[y0 : y0 + pixels.STRIP_ROWS]
+            if band.dtype == np.uint8 and out_dtype == np.uint8 and job["channels"] != 1:
+                output[y0 : y0 + band.shape[0]] = band[..., : job["channels"]]
+                continue
+            band = band.astype(np.float32)
+            if level.dtype == np.uint8:
+                band /= 255
+            band = convert_channels(band, job["channels"])
+            output[y0 : y0 + band.shape[0]] = to_8bit(band, job) if out_dtype == np.uint8 else band
+    return write_output(job, output)
+
+
+def read_resized(path, factor, channels, convert=None, subimage=0):
+    """Stream a source in bands of rows, resize and reduce its channels, and return the result.
+
+    convert(band) is applied to every band, e.g. to quantize it, so only the
+    output is ever held in memory at full size. Returns None if the source
+    can't be read.
+    """
+    profiling.add_bytes_read(profiling.file_size(path))
+    inp = pixels.open_input(path)
+    if not inp:
+        return None
+
+    try:
+        if subimage and not inp.seek_subimage(subimage, 0):
+            return None
+        spec = inp.spec()
+        fmt, dtype = pixels.native_format(spec)
+        full = pixels.max_value(dtype)
+        out_h, out_w = -(-spec.height // factor), -(-spec.width // factor)
+        output = None
+
+        # whole blocks of rows per band so the area average never straddles two bands
+        rows = max(factor, pixels.STRIP_ROWS - pixels.STRIP_ROWS % factor)
+        for ybegin, strip in pixels.iter_strips(inp, 0, fmt, rows, subimage):
+            band = pixels.to_rgba(strip, full).astype(np.float32)
+            if full != 1.0:
+                band /= full
+            band = convert_channels(analysis.downsample(band, factor), channels)
+            if convert is not None:
+                band = convert(band)
+            if output is None:
+                output = np.empty((out_h, out_w, channels), band.dtype)
+            output[ybegin // factor : ybegin // factor + band.shape[0]] = band
+    except IOError as exc:
+        print(f"Failed to decode {path}: {exc}")
+        return None
+    finally:
+        inp.close()
+
+    return output
+
+
+def export_pack(job):
+    """Write greyscale maps into the channels of one RGB file, parts are (source, hash) pairs."""
+    output = None
+    for channel, (source, _source_hash) in enumerate(job["parts"]):
+        with profiling.phase("decode"):
+            grey = read_resized(source, job["factor"], 1, quantize)
+        if grey is None:
+            return None
+        if output is None:
+            output = np.zeros(grey.shape[:2] + (3,), np.uint8)
+        elif grey.shape[:2] != output.shape[:2]:
+            print(f"Can't pack {source}, its size doesn't match the other maps")
+            return None
+        output[..., channel] = grey[..., 0]
+    return write_output(job, output)
+
+
+def export_file(job):
+    """Read a source image, resize and convert it, and write the optimized file.
+
+    job is a dict with source, target, factor (resolution divisor), channels
+    (1, 3 or 4) and float_output, plus the pyramid level from the scan if there
+    is one. Jobs with parts pack several greyscale maps into one file instead.
+    Returns the target path, or None if a source can't be read or the target
+    can't be written.
+    """
+    if not pixels.available():
+        return None
+
+    if job.get("parts"):
+        return export_pack(job)
+
+    if job.get("pyramid"):
+        target = export_level(job)
+        if target is not None:
+            return target
+
+    convert = None if job["float_output"] else functools.partial(to_8bit, job=job)
+    with profiling.phase("decode"):
+        output = read_resized(job["source"], job["factor"], job["channels"], convert, job.get("subimage", 0))
+    if output is None:
+        return None
+    return write_output(job, output)
+
+
+def split_job(job):
+    """Split the job of a UDIM set or a sequence into one job per file, so they are written in parallel."""
+    if job.get("tiles"):
+        members, target_path = job["tiles"], udim.tile_path
+    elif job.get("frames"):
+        members, target_path = job["frames"], sequence.frame_path
+    else:
+        return [job]
+    return [
+        dict(
+            job,
+            tiles=None,
+            frames=None,
+            source=source,
+            source_hash=member_hash,
+            pyramid=pyramid,
+            target=target_path(job["target"], number),
+            # the frames of a movie are its subimages, counted from 0
+            subimage=number - 1 if job.get("movie") else 0,
+        )
+        for number, source, member_hash, pyramid in members
+    ]
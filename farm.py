@@ -0,0 +1,136 @@
+"""Run batch mode over many .blend files in parallel, e.g. for a whole show before it goes to the farm.
+
+    python texture_compactor/farm.py --blender /opt/blender/blender --jobs 4 --json show.json shots/*.blend -- --optimize --save
+
+Every file gets its own background Blender, everything after -- is passed on to
+batch.py. The instances share the scan cache and, with --store, the optimized
+textures, so a texture used by several shots is only scanned and written once.
+This runs in plain Python, it never imports bpy.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+BATCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch.py")
+
+# same as batch.py
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_PARTIAL = 3
+
+
+def parse_args(argv):
+    if "--" in argv:
+        argv, batch_args = argv[: argv.index("--")], argv[argv.index("--") + 1 :]
+    else:
+        batch_args = ["--scan"]
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help=".blend files to process")
+    parser.add_argument("--blender", default="blender", help="Blender executable")
+    parser.add_argument("--jobs", type=int, default=2, help="Blender instances running at once")
+    parser.add_argument("--json", help="write the combined report to this file")
+    parser.add_argument("--log-dir", help="keep the per-file reports and Blender output here")
+    parser.add_argument("--timeout", type=float, help="seconds before a file is given up on")
+    args = parser.parse_args(argv)
+    args.batch_args = batch_args
+    return args
+
+
+def run_file(args, path, log_dir):
+    """Process one .blend in a background Blender, returns its report."""
+    name = f"{os.path.splitext(os.path.basename(path))[0]}_{hashlib.md5(path.encode()).hexdigest()[:8]}"
+    json_path = os.path.join(log_dir, f"{name}.json")
+    log_path = os.path.join(log_dir, f"{name}.log")
+
+    # split the cores between the instances, each one runs its own worker pool
+    batch_args = list(args.batch_args)
+    if "--workers" not in batch_args:
+        batch_args += ["--workers", str(max(1, (os.cpu_count() or 1) // args.jobs))]
+    command = [args.blender, "-b", path, "--python-exit-code", str(EXIT_ERROR), "-P", BATCH_SCRIPT, "--"]
+    command += batch_args + ["--json", json_path]
+
+    # a report left from an earlier run would pass for this one if Blender crashes
+    try:
+        os.remove(json_path)
+    except FileNotFoundError:
+        pass
+
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        try:
+            code = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, timeout=args.timeout).returncode
+        except subprocess.TimeoutExpired:
+            code = EXIT_ERROR
+            print(f"Timed out on {path}")
+        except OSError as exc:
+            code = EXIT_ERROR
+            print(f"Can't run {args.blender}: {exc}")
+
+    try:
+        with open(json_path, "r") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        # Blender crashed or never got to the script
+        report = {"file": path, "error": f"no report, see {log_path}"}
+    report["exit_code"] = code
+    report["wall_seconds"] = round(time.perf_counter() - start, 3)
+    report["log"] = log_path
+    return report
+
+
+def overall_exit_code(codes):
+    """The worst of the per-file exit codes, anything unknown like a crash counts as an error."""
+    if any(code not in (EXIT_OK, EXIT_USAGE, EXIT_PARTIAL) for code in codes):
+        return EXIT_ERROR
+    for code in (EXIT_USAGE, EXIT_PARTIAL):
+        if code in codes:
+            return code
+    return EXIT_OK
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    log_dir = args.log_dir or os.path.join(os.getcwd(), "tc_batch_logs")
+    os.makedirs(log_dir, exist_ok=True)
+    files = [os.path.abspath(path) for path in args.files]
+
+    start = time.perf_counter()
+    reports = []
+    # the work happens in the Blender processes, threads are enough to wait for them
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {pool.submit(run_file, args, path, log_dir): path for path in files}
+        for future in concurrent.futures.as_completed(futures):
+            report = future.result()
+            reports.append(report)
+            print(f"[{len(reports)}/{len(files)}] exit {report['exit_code']} {futures[future]}")
+
+    reports.sort(key=lambda report: files.index(report["file"]) if report["file"] in files else len(files))
+    code = overall_exit_code([report["exit_code"] for report in reports])
+    summary = {
+        "files": len(reports),
+        "failed": sum(1 for report in reports if report["exit_code"] != EXIT_OK),
+        "seconds": round(time.perf_counter() - start, 3),
+        "memory_before_mb": round(sum(report.get("memory_before_mb", 0) for report in reports), 3),
+        "memory_after_mb": round(sum(report.get("memory_after_mb", 0) for report in reports), 3),
+        "exit_code": code,
+    }
+    print(
+        f"{summary['files']} files, {summary['failed']} not clean, "
+        f"{summary['memory_before_mb']:.0f}MB -> {summary['memory_after_mb']:.0f}MB in {summary['seconds']:.0f}s"
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "reports": reports}, f, indent=1)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
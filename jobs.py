@@ -0,0 +1,333 @@
+import concurrent.futures
+import os
+import time
+
+from . import cache
+from . import core
+from . import export
+from . import library
+from . import packing
+from . import pro
+from . import profiling
+from . import settings
+from . import store
+from . import worker
+
+
+class ScanJob:
+    """Scan the images of a plan into a texture table, in the worker pool where it can.
+
+    The scan operator polls it from a timer so the UI stays responsive, batch
+    mode runs it to the end.
+    """
+
+    def __init__(self, plan, image_list):
+        self.plan = plan
+        self.image_list = image_list
+        self.executor = None
+        self.futures = {}
+        self.pending = []
+        self.progress = 0
+        self.total = 0
+        self.started = None
+
+    @property
+    def done(self):
+        return not self.futures and not self.pending
+
+    @staticmethod
+    def profile_name(group):
+        # the tiles and frames of a set are profiled one file each
+        if group.file_set is not None:
+            return os.path.basename(group.path)
+        return group.images[0].name
+
+    def add_result(self, images, key, record):
+        cache.get_cache().put(key, record)
+        for img in images:
+            self.image_list.append(core.ImageInfo.from_record(img, img.filepath, record))
+
+    def add_member(self, group, record):
+        """Keep the record of one UDIM tile or frame, the images are added once their whole set is in."""
+        file_set = group.file_set
+        combined = file_set.add(group.number, record)
+        if combined is not None:
+            for img in file_set.images:
+                self.image_list.append(core.ImageInfo.from_record(img, img.filepath, combined))
+        elif file_set.complete:
+            # a file couldn't be decoded, still list the set in the report
+            for img in file_set.images:
+                with profiling.texture(img.name):
+                    img_info = core.scan_image(img)
+                if img_info is not None:
+                    self.image_list.append(img_info)
+
+    def submit(self, group, step):
+        # the workers time their own phases and send them back with the record
+        if group.hash_only:
+            return self.executor.submit(profiling.profiled, worker.hash_file, group.path)
+        if group.movie:
+            stride, full = settings.SEQUENCE_STRIDE, settings.SEQUENCE_FULL_SCAN
+            return self.executor.submit(profiling.profiled, worker.scan_movie, group.path, step, stride, full)
+        return self.executor.submit(profiling.profiled, worker.scan_file, group.path, step)
+
+    def start(self):
+        """Queue every file of the plan, cached files are added right away. Returns the number of jobs left."""
+        self.image_list.clear()
+        scan_cache = cache.get_cache()
+        scan_cache.reset_stats()
+        self.started = time.perf_counter()
+        profiling.reset().add_span("eligibility", self.plan.started, self.plan.seconds)
+
+        self.executor = worker.create_pool()
+        self.pending = [([img], None) for img, _reason in self.plan.report_only]
+        step = core.analysis_step()
+
+        # groups are sorted largest first so the pool drains evenly
+        for group in self.plan.groups:
+            # reuse the previous results if the file hasn't changed, without loading the image
+            record = None if group.hash_only else scan_cache.get(group.key)
+            if record is not None and group.file_set is not None:
+                self.add_member(group, record)
+                continue
+            if record is not None:
+                for img in group.images:
+                    self.image_list.append(core.ImageInfo.from_record(img, img.filepath, record))
+                continue
+
+            if self.executor is not None:
+                self.futures[self.submit(group, step)] = group
+            elif group.file_set is not None or group.movie:
+                # Blender only exposes the pixels of the first tile or the current frame
+                if group.file_set is not None:
+                    self.add_member(group, None)
+                else:
+                    self.pending.append((group.images, None))
+            else:
+                self.pending.append((group.images, group.key))
+
+        self.total = len(self.futures) + len(self.pending)
+        return self.total
+
+    def collect_workers(self):
+        """Pick up the records of every finished worker job."""
+        for future in [f for f in self.futures if f.done()]:
+            group = self.futures.pop(future)
+            try:
+                record, timings = future.result()
+                profiling.get_profile().add(self.profile_name(group), timings)
+            except Exception as exc:
+                print(f"Exception during scanning: {exc}")
+                record = None
+
+            if group.file_set is not None:
+                if record is not None and not group.hash_only:
+                    cache.get_cache().put(group.key, record)
+                self.add_member(group, record)
+                self.progress += 1
+                continue
+
+            if record is None:
+                # the worker couldn't decode the file, let Blender load it instead
+                self.pending.append((group.images, group.key))
+                continue
+
+            self.add_result(group.images, group.key, record)
+            self.progress += 1
+
+    def scan_pending(self, budget=0.05):
+        """Scan images that need Blender's own pixel buffer, a few per call to keep the UI responsive."""
+        deadline = time.perf_counter() + budget
+        while self.pending and time.perf_counter() < deadline:
+            images, key = self.pending.pop(0)
+            try:
+                with profiling.texture(images[0].name):
+                    img_info = core.scan_image(images[0])
+                if img_info is not None:
+                    self.add_result(images, key, img_info.to_record())
+            except Exception as exc:
+                print(f"Exception during scanning: {exc}")
+            self.progress += 1
+
+    def poll(self, budget=0.05):
+        """Do what can be done right now, returns True once everything is scanned."""
+        self.collect_workers()
+        self.scan_pending(budget)
+        return self.done
+
+    def finish(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        cache.get_cache().flush()
+        # every combination of settings is worked out now so toggling them later is instant
+        self.image_list.precompute(core.evaluate)
+        profiling.get_profile().wall_seconds["scan"] = time.perf_counter() - self.started
+
+    def cancel(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        cache.get_cache().flush()
+
+    def run(self, interval=0.1):
+        """Scan everything, blocking until it's done."""
+        self.start()
+        while not self.poll(interval):
+            if self.futures and not self.pending:
+                concurrent.futures.wait(self.futures, interval, concurrent.futures.FIRST_COMPLETED)
+        self.finish()
+
+
+class OptimizeJob:
+    """Write the optimized files of a scanned texture table and point the images at them.
+
+    Polled by the optimize operator, run to the end by batch mode. In library
+    mode linked textures are written beside their library and recorded there,
+    so every file linking it picks them up.
+    """
+
+    def __init__(self, image_list, output_format="IMAGE", channel_pack=False, library_mode=False):
+        self.image_list = image_list
+        self.output_format = output_format
+        self.channel_pack = channel_pack
+        self.library_mode = library_mode
+        self.store = None
+        self.executor = None
+        self.futures = {}
+        self.written = []
+        self.failed = []
+        self.packs = {}
+        self.parts_left = {}
+        self.planned = 0
+        self.reused = 0
+        self.progress = 0
+        self.total = 0
+        self.started = None
+
+    @property
+    def done(self):
+        return not self.futures
+
+    def start(self):
+        """Plan every output and submit the ones that don't exist yet. Returns the number of files to write."""
+        # the main thread only works out sources and targets, the workers do the encoding
+        self.started = time.perf_counter()
+        self.store = store.OutputStore(pro.output_folder())
+        exports = core.plan_exports(self.image_list, self.store, self.output_format, self.library_mode)
+
+        # greyscale maps of a material share one packed texture, the maps keep their own files for other users
+        packing.restore_all()
+        packing.packs.clear()
+        if self.channel_pack:
+            for group in packing.plan_packs(self.image_list):
+                job = group.job(self.store)
+                if job is None:
+                    continue
+                if job["target"] not in self.packs:
+                    exports.append((job, []))
+                self.packs.setdefault(job["target"], []).append(group)
+        self.planned = len(exports)
+
+        # the same source with the same transform was already written, by this file or another one
+        todo = []
+        for job, img_infos in exports:
+            if all(os.path.isfile(part["target"]) for part in export.split_job(job)):
+                self.written.append((job, img_infos))
+                self.reused += 1
+            else:
+                todo.append((job, img_infos))
+        if not todo:
+            return 0
+
+        self.executor = worker.create_pool(settings.EXPORT_WORKER_MEMORY_MB)
+        if self.executor is None:
+            self.failed = [img_info for job, img_infos in todo for img_info in img_infos]
+            return 0
+
+        for job, img_infos in todo:
+            parts = export.split_job(job)
+            self.parts_left[job["target"]] = len(parts)
+            for part in parts:
+                self.futures[self.executor.submit(profiling.profiled, export.export_file, part)] = (job, img_infos)
+        self.total = len(self.futures)
+        return self.total
+
+    def collect_workers(self):
+        for future in [f for f in self.futures if f.done()]:
+            job, img_infos = self.futures.pop(future)
+            try:
+                result, timings = future.result()
+                # packs have no texture of their own
+                name = img_infos[0].image.name if img_infos else os.path.basename(job["target"])
+                profiling.get_profile().add(name, timings)
+            except Exception as exc:
+                print(f"Exception during optimizing: {exc}")
+                result = None
+            self.progress += 1
+
+            # a UDIM set or sequence is done once every file is written, and failed if any of them failed
+            left = self.parts_left.get(job["target"])
+            if left is None:
+                continue
+            if result is None:
+                # let Blender write it the old way instead
+                self.parts_left[job["target"]] = None
+                self.failed.extend(img_infos)
+                continue
+            self.parts_left[job["target"]] = left - 1
+            if left == 1:
+                self.written.append((job, img_infos))
+
+    def poll(self):
+        self.collect_workers()
+        return self.done
+
+    def finish(self, context):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+        # repoint every datablock in one go now that all the files exist
+        for job, img_infos in self.written:
+            for img_info in img_infos:
+                img_info.optimized_path = job["target"]
+            for group in self.packs.get(job["target"], ()):
+                group.target = job["target"]
+                packing.packs.append(group)
+        packing.remember_all()
+        # every store keeps its own manifest, library stores included
+        entries = {}
+        for job, _ in self.written:
+            if not job.get("parts"):
+                entries.setdefault(job.get("store", self.store.folder), []).extend(
+                    (part["target"], part["source"], part["source_hash"]) for part in export.split_job(job)
+                )
+        self.store.record(
+            entries.pop(self.store.folder, []),
+            [(job["target"], job["parts"]) for job, _ in self.written if job.get("parts")],
+        )
+        for folder, store_entries in entries.items():
+            store.OutputStore(folder).record(store_entries)
+
+        if self.failed:
+            print(f"Falling back to Blender for {len(self.failed)} textures")
+            core.optimize_images(None, context, self.failed)
+        else:
+            core.use_optimized_textures(context)
+
+        if self.library_mode:
+            recorded = library.record(
+                [img_info for _job, img_infos in self.written for img_info in img_infos],
+                core.scene_settings(context.scene),
+            )
+            print(f"Recorded {recorded} optimized textures for the files linking them")
+        profiling.get_profile().wall_seconds["optimize"] = time.perf_counter() - self.started
+
+    def cancel(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, context, interval=0.1):
+        """Write everything, blocking until it's done."""
+        self.start()
+        while not self.poll():
+            concurrent.futures.wait(self.futures, interval, concurrent.futures.FIRST_COMPLETED)
+        self.finish(context)
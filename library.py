@@ -0,0 +1,161 @@
+import json
+import os
+
+import bpy
+
+from . import store
+
+# beside every .blend whose textures were optimized for the files linking it, keyed by .blend name and image name
+MANIFEST = "tc_library.json"
+# where the optimized textures of a library go, beside the library
+FOLDER = "tc_optimized"
+
+
+def blend_path(library):
+    """Absolute path of a library .blend, or of the open file for None."""
+    if library is None:
+        return bpy.data.filepath
+    return os.path.abspath(bpy.path.abspath(library.filepath))
+
+
+def output_store(library):
+    """The store beside a library, shared by every file that links it."""
+    return store.OutputStore(os.path.join(os.path.dirname(blend_path(library)), FOLDER))
+
+
+def manifest_path(path):
+    return os.path.join(os.path.dirname(path), MANIFEST)
+
+
+def load_manifest(path):
+    """Entries recorded for the images of the .blend at path, by image name."""
+    try:
+        with open(manifest_path(path), "r") as f:
+            return json.load(f).get(os.path.basename(path), {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, entries):
+    # merge with the other .blend files of the folder and whatever other sessions wrote
+    target = manifest_path(path)
+    try:
+        with open(target, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault(os.path.basename(path), {}).update(entries)
+
+    temp_path = f"{target}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, target)
+
+
+def record(img_infos, settings):
+    """Remember the optimized textures of linked images beside their library, and of local ones beside this file.
+
+    Any file that links those images later picks up the optimized files with a
+    lookup when it's loaded, without scanning them.
+    """
+    by_blend = {}
+    for img_info in img_infos:
+        image = img_info.image
+        path = blend_path(image.library)
+        if not img_info.optimized_path or not path:
+            continue
+        colorspace, use_half_precision = image.colorspace_settings.name, image.use_half_precision
+        if img_info.original_settings:
+            colorspace, use_half_precision = img_info.original_settings[:2]
+
+        # relative to the library, so it moves with it
+        try:
+            optimized = os.path.relpath(img_info.optimized_path, os.path.dirname(path)).replace("\\", "/")
+        except ValueError:
+            print(f"Can't record {image.name}, its optimized file is on another drive than {path}")
+            continue
+        by_blend.setdefault(path, {})[image.name] = {
+            "source": img_info.original_path,
+            "source_hash": img_info.content_hash,
+            "optimized": optimized,
+            "colorspace": colorspace,
+            "use_half_precision": use_half_precision,
+            # recorded while the optimized file is in use
+            "optimized_colorspace": image.colorspace_settings.name,
+            "half_precision": image.use_half_precision,
+            "settings": settings,
+        }
+
+    for path, entries in by_blend.items():
+        try:
+            save_manifest(path, entries)
+        except OSError as exc:
+            print(f"Can't record optimized textures beside {path}: {exc}")
+    return sum(len(entries) for entries in by_blend.values())
+
+
+def linked_images():
+    """Yield (image, manifest entry) for every linked image its library has an optimized file for."""
+    manifests = {}
+    for image in bpy.data.images:
+        if image.library is None:
+            continue
+        if image.library not in manifests:
+            manifests[image.library] = load_manifest(blend_path(image.library))
+        entry = manifests[image.library].get(image.name)
+        if entry is not None:
+            yield image, entry
+
+
+def optimized_filepath(entry):
+    # relative paths of linked images resolve against their library
+    return "//" + entry["optimized"]
+
+
+def applied_images():
+    """The linked images that use the optimized file of their library, those are never scanned again."""
+    return {image for image, entry in linked_images() if image.filepath_raw == optimized_filepath(entry)}
+
+
+def apply_all():
+    """Point every linked image at the optimized file its library recorded, if the file is still there."""
+    applied = 0
+    for image, entry in linked_images():
+        if image.filepath_raw != entry["source"]:
+            # the library changed since, or it's already applied
+            continue
+        optimized = optimized_filepath(entry)
+        if not os.path.isfile(bpy.path.abspath(optimized, library=image.library)):
+            continue
+        image.filepath_raw = optimized
+        image.colorspace_settings.name = entry["optimized_colorspace"]
+        image.use_half_precision = entry["half_precision"]
+        image.buffers_free()
+        applied += 1
+    if applied:
+        print(f"Using {applied} optimized library textures")
+    return applied
+
+
+def restore_all():
+    for image, entry in linked_images():
+        if image.filepath_raw == optimized_filepath(entry):
+            image.filepath_raw = entry["source"]
+            image.colorspace_settings.name = entry["colorspace"]
+            image.use_half_precision = entry["use_half_precision"]
+            image.buffers_free()
+
+
+@bpy.app.handlers.persistent
+def load_post(dummy):
+    # linked datablocks are read from their library again on every load
+    scene = bpy.context.scene
+    if scene is not None and getattr(scene, "TC_library_lookup", False):
+        apply_all()
+
+
+def update_lookup(self, context):
+    if context.scene.TC_library_lookup:
+        apply_all()
+    else:
+        restore_all()
@@ -0,0 +1,60 @@
+import numpy as np
+
+# this is imported by the worker processes and the validation harness too, never import bpy here
+
+# how the samples of a file are stored, as found by the scan
+PRECISIONS = ("8", "16", "half", "float")
+BYTE, USHORT, HALF, FLOAT = range(len(PRECISIONS))
+
+# what Cycles makes of the colorspace of an image
+COLORSPACE_RAW = 0  # Non-Color and the scene linear space, loaded as they are
+COLORSPACE_SRGB = 1  # 8 bit stays 8 bit and is decoded while rendering
+COLORSPACE_OTHER = 2  # converted on load, 8 and 16 bit go to half float so the result fits
+
+# the scene linear role of Blender's default config, Cycles sees no conversion
+LINEAR_NAMES = {"Linear Rec.709", "Linear", "Raw", "Non-Color"}
+SRGB_NAMES = {"sRGB"}
+
+
+def colorspace_kind(name, is_data):
+    if is_data or name in LINEAR_NAMES:
+        return COLORSPACE_RAW
+    if name in SRGB_NAMES:
+        return COLORSPACE_SRGB
+    return COLORSPACE_OTHER
+
+
+def channels_of(depth, is_float):
+    """Channel count from Blender's bit depth, for images scanned before the channels were recorded."""
+    return np.clip(depth // np.where(is_float, 32, 8), 1, 4)
+
+
+def slot_bytes(channels, precision, builtin=False, half_precision=False, colorspace=COLORSPACE_SRGB):
+    """Bytes per pixel of the image slot Cycles stores every texture in, the arguments are arrays.
+
+    Files are read by OpenImageIO, packed and generated images and movies come
+    from Blender's own image buffer. Cycles has one and four channel slots of
+    byte, ushort, half and float (ImageDataType), so greyscale with alpha and
+    RGB take the same memory as RGBA. 16 bit files keep their ushort samples,
+    half float files stay half and the rest go to a float slot. Blender's own
+    buffers are always RGBA bytes or floats. Half precision makes a float file
+    use a half slot.
+    """
+    channels = np.asarray(channels)
+    precision = np.asarray(precision)
+    builtin = np.asarray(builtin, bool)
+
+    file_sample = np.select([precision == BYTE, precision == USHORT, precision == HALF], [1, 2, 2], 4)
+    buffer_sample = np.where(precision == BYTE, 1, 4)
+    sample = np.where(builtin, buffer_sample, file_sample)
+    sample = np.where((sample == 4) & (precision == FLOAT) & ~builtin & np.asarray(half_precision, bool), 2, sample)
+    # byte and ushort slots can't hold what the conversion makes of them, ushort goes to half of the same size
+    sample = np.where((sample == 1) & (np.asarray(colorspace) == COLORSPACE_OTHER), 2, sample)
+
+    single = (channels == 1) & ~(builtin & (precision == BYTE))
+    return np.where(single, 1, 4) * sample
+
+
+def image_mb(pixels, channels, precision, builtin=False, half_precision=False, colorspace=COLORSPACE_SRGB):
+    """Memory of every texture in MB, pixels counts every tile of a UDIM set."""
+    return pixels * slot_bytes(channels, precision, builtin, half_precision, colorspace) / 1024 / 1024
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+
+import bpy
+
+from . import memory
+from . import settings
+from . import store
+
+# custom property on the nodes the packing adds, the Separate Color node keeps the links to put back,
+# and on the material, which keeps its packs so they survive saving and reloading the file
+PACK_TAG = "tc_pack"
+CHANNELS = 3
+# most color an RGB map may have and still go into one channel, the greyscale threshold of Safe
+GREY_MAX_COLOR = 0.03
+
+# packs planned by the last optimize, applied whenever the optimized textures are in use
+packs = []
+
+
+class PackGroup:
+    """Greyscale maps of one material that go into the channels of one RGB texture.
+
+    channels holds one (ImageInfo, [ShaderNodeTexImage, ...]) entry per map, a map
+    can be used by several image nodes of the material. The ImageInfo is None for
+    packs read back from a saved file, which keeps the size of the maps instead.
+    """
+
+    def __init__(self, material, channels, factor, size_before_mb=None):
+        self.material = material
+        self.channels = channels
+        self.factor = factor
+        self.target = None
+        if size_before_mb is None:
+            # the slots the maps take as they would be written without packing
+            size_before_mb = sum(info.size_optimized_mb for info, _nodes in channels)
+        self.size_before_mb = size_before_mb
+
+    @property
+    def pixels(self):
+        info, nodes = self.channels[0]
+        width, height = (info.width, info.height) if info else nodes[0].image.size
+        return (width // self.factor) * (height // self.factor)
+
+    @property
+    def size_after_mb(self):
+        # an RGB file takes a four channel slot in Cycles
+        return float(memory.image_mb(self.pixels, CHANNELS, memory.BYTE, colorspace=memory.COLORSPACE_RAW))
+
+    def names(self):
+        return [nodes[0].image.name for _info, nodes in self.channels]
+
+    def to_record(self):
+        return {
+            "target": self.target,
+            "factor": self.factor,
+            "size_before": self.size_before_mb,
+            "nodes": [[node.name for node in nodes] for _info, nodes in self.channels],
+        }
+
+    def job(self, output_store):
+        """Describe the packed file for a worker, or None if a source can't be read."""
+        parts = []
+        for info, _nodes in self.channels:
+            source = os.path.abspath(bpy.path.abspath(info.image.filepath_raw, library=info.image.library))
+            try:
+                parts.append((source, info.content_hash or store.content_hash(source)))
+            except OSError as exc:
+                print(f"Can't read {source}: {exc}")
+                return None
+
+        job = {
+            "source": parts[0][0],
+            "parts": parts,
+            "factor": self.factor,
+            "channels": CHANNELS,
+            "float_output": False,
+            "compression": settings.PNG_COMPRESSION,
+        }
+        # addressed by every source and the order they go into the channels
+        pack_hash = hashlib.blake2b("|".join(h for _s, h in parts).encode(), digest_size=20).hexdigest()
+        job["source_hash"] = pack_hash
+        job["target"] = output_store.path_for(pack_hash, job)
+        return job
+
+
+def is_greyscale_data(info):
+    """Check if a texture holds 8 bit greyscale data, which is what can share a texture.
+
+    Grey maps stored as RGB or RGBA count too, they are what packing saves memory on.
+    """
+    image = info.image
+    if image.packed_file or image.source != "FILE" or not image.colorspace_settings.is_data or info.is_float:
+        return False
+    depth = info.optimized_depth or info.depth
+    if depth == 8:
+        return True
+    grey = info.color_factor < GREY_MAX_COLOR
+    return grey and (depth == 24 or (depth == 32 and info.alpha_factor < 0.5))
+
+
+def plan_packs(image_list):
+    """Group the greyscale data maps of every material by resolution and texture mapping."""
+    candidates = {info.image.name_full: info for info in image_list if is_greyscale_data(info)}
+    groups = []
+
+    for material in bpy.data.materials:
+        # linked materials can't be rewired
+        if not material.use_nodes or material.library or material.node_tree is None:
+            continue
+
+        buckets = {}
+        for node in material.node_tree.nodes:
+            if node.bl_idname != "ShaderNodeTexImage" or node.image is None or PACK_TAG in node:
+                continue
+            info = candidates.get(node.image.name_full)
+            if info is None or node.outputs["Alpha"].is_linked or not node.outputs["Color"].is_linked:
+                continue
+
+            # only maps sampled the same way can share one image node
+            vector = node.inputs["Vector"].links
+            mapping = (vector[0].from_node.name, vector[0].from_socket.identifier) if vector else None
+            key = (
+                info.width,
+                info.height,
+                info.resize_divisor,
+                mapping,
+                node.interpolation,
+                node.projection,
+                node.extension,
+            )
+            buckets.setdefault(key, {}).setdefault(info.image.name_full, (info, []))[1].append(node)
+
+        for key, maps in buckets.items():
+            maps = [maps[name] for name in sorted(maps)]
+            for start in range(0, len(maps), CHANNELS):
+                channels = maps[start : start + CHANNELS]
+                if len(channels) < 2:
+                    continue
+                # maps already written as one channel slots can take less than the packed file
+                group = PackGroup(material, channels, key[2])
+                if group.size_after_mb < group.size_before_mb:
+                    groups.append(group)
+
+    return groups
+
+
+def apply(group):
+    """Replace the image nodes of a group with the packed texture and a Separate Color node."""
+    tree = group.material.node_tree
+    first = group.channels[0][1][0]
+
+    image = bpy.data.images.load(group.target, check_existing=True)
+    image.colorspace_settings.name = "Non-Color"
+
+    texture = tree.nodes.new("ShaderNodeTexImage")
+    texture.image = image
+    texture.interpolation = first.interpolation
+    texture.projection = first.projection
+    texture.extension = first.extension
+    texture.location = (first.location.x, first.location.y + 300)
+    texture[PACK_TAG] = ""
+    vector = first.inputs["Vector"].links
+    if vector:
+        tree.links.new(vector[0].from_socket, texture.inputs["Vector"])
+
+    separate = tree.nodes.new("ShaderNodeSeparateColor")
+    separate.mode = "RGB"
+    separate.location = (first.location.x + 300, first.location.y + 300)
+    tree.links.new(texture.outputs["Color"], separate.inputs["Color"])
+
+    restore = []
+    for channel, (_info, nodes) in enumerate(group.channels):
+        for node in nodes:
+            for link in list(node.outputs["Color"].links):
+                to_socket = link.to_socket
+                restore.append([node.name, to_socket.node.name, to_socket.identifier])
+                tree.links.remove(link)
+                tree.links.new(separate.outputs[channel], to_socket)
+    separate[PACK_TAG] = json.dumps(restore)
+
+
+def restore(material):
+    """Put back the links the packing replaced and remove the nodes it added."""
+    tree = material.node_tree
+    tagged = [node for node in tree.nodes if PACK_TAG in node]
+    for node in tagged:
+        if node.bl_idname != "ShaderNodeSeparateColor":
+            continue
+        for member, to_node, identifier in json.loads(node[PACK_TAG]):
+            if member not in tree.nodes or to_node not in tree.nodes:
+                continue
+            for socket in tree.nodes[to_node].inputs:
+                if socket.identifier == identifier:
+                    tree.links.new(tree.nodes[member].outputs["Color"], socket)
+                    break
+    for node in tagged:
+        tree.nodes.remove(node)
+
+
+def restore_all():
+    for material in bpy.data.materials:
+        if material.use_nodes and material.node_tree is not None and not material.library:
+            restore(material)
+
+
+def remember_all():
+    """Keep the packs on their materials, they are saved with the file."""
+    records = {}
+    for group in packs:
+        if group.target:
+            records.setdefault(group.material.name_full, []).append(group.to_record())
+    for material in bpy.data.materials:
+        if material.library:
+            continue
+        if material.name_full in records:
+            material[PACK_TAG] = json.dumps(records[material.name_full])
+        elif PACK_TAG in material:
+            del material[PACK_TAG]
+
+
+def read_all():
+    """Rebuild the packs kept on the materials of the file that was just opened."""
+    packs.clear()
+    for material in bpy.data.materials:
+        if PACK_TAG not in material or material.node_tree is None:
+            continue
+        nodes = material.node_tree.nodes
+        for record in json.loads(material[PACK_TAG]):
+            channels = [(None, [nodes[name] for name in names if name in nodes]) for names in record["nodes"]]
+            if all(channel[1] for channel in channels):
+                group = PackGroup(material, channels, record["factor"], record["size_before"])
+                group.target = record["target"]
+                packs.append(group)
+
+
+@bpy.app.handlers.persistent
+def load_post(dummy):
+    read_all()
+
+
+def apply_all():
+    """Use every pack that was written, starting from the unpacked node trees."""
+    restore_all()
+    applied = 0
+    for group in packs:
+        if group.target and os.path.isfile(group.target):
+            apply(group)
+            applied += 1
+    if applied:
+        print(f"Using {applied} packed textures")
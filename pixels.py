@@ -0,0 +1,242 @@
+import os
+
+import numpy as np
+
+try:
+    # bundled with Blender since 4.0
+    import OpenImageIO as oiio
+except ImportError:
+    oiio = None
+
+# scanlines decoded per read, only the rows kept for analysis are ever stored
+STRIP_ROWS = 64
+
+
+def available():
+    """Check if images can be decoded from disk without going through Blender."""
+    return oiio is not None
+
+
+def max_value(dtype):
+    """Return the value that represents 1.0 for the given pixel type."""
+    if dtype == np.uint8:
+        return 255
+    if dtype == np.uint16:
+        return 65535
+    return 1.0
+
+
+def to_rgba(data, full):
+    """Expand 1, 2 or 3 channel pixels to RGBA the same way Blender does."""
+    channels = data.shape[2]
+    if channels == 4:
+        return data
+
+    rgba = np.empty(data.shape[:2] + (4,), data.dtype)
+    if channels == 1:
+        rgba[..., :3] = data
+        rgba[..., 3] = full
+    elif channels == 2:
+        rgba[..., :3] = data[..., :1]
+        rgba[..., 3] = data[..., 1]
+    else:
+        rgba[..., :3] = data[..., :3]
+        rgba[..., 3] = full
+    return rgba
+
+
+def blender_depth(channels, is_float):
+    """Bit depth as reported by bpy.types.Image.depth for a file with this layout."""
+    if is_float:
+        # Blender keeps grey+alpha as a full RGBA float buffer
+        return 128 if channels == 2 else 32 * channels
+    return 32 if channels == 2 else 8 * channels
+
+
+def pick_miplevel(inp, width, height, subimage=0):
+    """Return the smallest stored mip level that still covers the analysis resolution."""
+    level = 0
+    while inp.seek_subimage(subimage, level + 1):
+        spec = inp.spec()
+        if spec.width < width or spec.height < height:
+            break
+        level += 1
+    inp.seek_subimage(subimage, level)
+    return level
+
+
+def spec_info(spec):
+    """Describe an image spec the way the rest of the addon describes images."""
+    basetype = spec.format.basetype
+    is_float = basetype not in (oiio.UINT8, oiio.UINT16)
+    return {
+        "width": spec.width,
+        "height": spec.height,
+        "depth": blender_depth(min(spec.nchannels, 4), is_float),
+        "is_float": is_float,
+        # how Cycles stores the file depends on these, see memory.py
+        "channels": min(spec.nchannels, 4),
+        "precision": {oiio.UINT8: "8", oiio.UINT16: "16", oiio.HALF: "half"}.get(basetype, "float"),
+    }
+
+
+def open_input(path):
+    """Open an image file for reading, or return None.
+
+    Straight alpha is kept as it is in the file, OIIO would premultiply it
+    otherwise and the colors of transparent pixels would be lost on export.
+    """
+    config = oiio.ImageSpec()
+    config.attribute("oiio:UnassociatedAlpha", 1)
+    return oiio.ImageInput.open(path, config)
+
+
+def read_info(path):
+    """Read only the header of an image file, or return None if it can't be opened."""
+    if oiio is None:
+        return None
+
+    inp = open_input(path)
+    if not inp:
+        return None
+    try:
+        return spec_info(inp.spec())
+    finally:
+        inp.close()
+
+
+def frame_count(path):
+    """Number of frames in a movie file, 0 if it can't be opened (OIIO needs its FFmpeg plugin)."""
+    if oiio is None:
+        return 0
+
+    inp = open_input(path)
+    if not inp:
+        return 0
+    try:
+        return inp.spec().get_int_attribute("oiio:subimages", 1)
+    finally:
+        inp.close()
+
+
+def native_format(spec):
+    """Pick the OIIO read format and NumPy dtype that holds the file's pixels without loss."""
+    basetype = spec.format.basetype
+    if basetype == oiio.UINT8:
+        return oiio.UINT8, np.uint8
+    if basetype == oiio.UINT16:
+        return oiio.UINT16, np.uint16
+    return oiio.FLOAT, np.float32
+
+
+def iter_strips(inp, level, fmt, rows=STRIP_ROWS, subimage=0):
+    """Yield (ybegin, strip) bands of up to `rows` scanlines, at most 4 channels each."""
+    spec = inp.spec()
+    chend = min(spec.nchannels, 4)
+    for ybegin in range(0, spec.height, rows):
+        yend = min(ybegin + rows, spec.height)
+        strip = inp.read_scanlines(subimage, level, ybegin, yend, 0, 0, chend, fmt)
+        if strip is None:
+            raise IOError(inp.geterror())
+        yield ybegin, strip.reshape(yend - ybegin, spec.width, chend)
+
+
+def read_pixels(path, step=1, max_bytes=None, on_strip=None, subimage=0):
+    """Decode an image file into an RGBA array at 1/step of its resolution.
+
+    The file is read in strips of scanlines and decimated as it goes, so memory
+    grows with the analysis resolution rather than the source resolution. 8 and
+    16 bit files keep their integer type, everything else is read as float32.
+    If max_bytes is given the step is doubled until the buffer fits. When the
+    full resolution is decoded, on_strip(ybegin, rgba_strip) sees every strip
+    before it's decimated. Rows are returned top to bottom. subimage picks the
+    frame of a movie. Returns (pixel_data, info) or None if the file can't be
+    decoded.
+    """
+    if oiio is None:
+        return None
+
+    inp = open_input(path)
+    if not inp:
+        return None
+
+    try:
+        if subimage and not inp.seek_subimage(subimage, 0):
+            return None
+        spec = inp.spec()
+        width, height = spec.width, spec.height
+        info = spec_info(spec)
+        fmt, dtype = native_format(spec)
+
+        out_w = -(-width // step)
+        out_h = -(-height // step)
+        while max_bytes and out_w * out_h * 4 * np.dtype(dtype).itemsize > max_bytes and min(out_w, out_h) > 1:
+            step *= 2
+            out_w = -(-width // step)
+            out_h = -(-height // step)
+
+        # pre-built mip maps (tiled EXR/TIFF) let us skip decoding the full resolution entirely
+        level = pick_miplevel(inp, out_w, out_h, subimage) if step > 1 else 0
+        if level:
+            spec = inp.spec()
+            step = 1
+            out_w, out_h = spec.width, spec.height
+
+        full = max_value(dtype)
+        pixel_data = np.empty((out_h, out_w, 4), dtype)
+
+        strip_rows = STRIP_ROWS - STRIP_ROWS % step if STRIP_ROWS >= step else step
+        try:
+            for ybegin, strip in iter_strips(inp, level, fmt, strip_rows, subimage):
+                if on_strip is not None and level == 0:
+                    strip = to_rgba(strip, full)
+                    on_strip(ybegin, strip)
+                strip = strip[::step, ::step]
+                pixel_data[ybegin // step : ybegin // step + strip.shape[0]] = to_rgba(strip, full)
+        except IOError as exc:
+            print(f"Failed to decode {path}: {exc}")
+            return None
+
+        return pixel_data, info
+    finally:
+        inp.close()
+
+
+def write_image(path, pixel_data, compression=6):
+    """Write a (h, w, channels) array to disk, the format follows the file extension.
+
+    uint8 data is written as is, float data is stored as half float. The file is
+    written next to its destination first so other readers never see it half done.
+    """
+    if oiio is None:
+        return False
+
+    h, w, channels = pixel_data.shape
+    is_float = pixel_data.dtype != np.uint8
+    spec = oiio.ImageSpec(w, h, channels, oiio.HALF if is_float else oiio.UINT8)
+    if path.lower().endswith(".png"):
+        spec.attribute("png:compressionLevel", int(compression))
+    else:
+        spec.attribute("compression", "zip")
+
+    root, ext = os.path.splitext(path)
+    temp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    out = oiio.ImageOutput.create(temp_path)
+    if not out:
+        print(f"Can't write {path}: {oiio.geterror()}")
+        return False
+
+    try:
+        ok = out.open(temp_path, spec) and out.write_image(pixel_data)
+        error = out.geterror()
+    finally:
+        out.close()
+
+    if not ok:
+        print(f"Failed to write {path}: {error}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+
+    os.replace(temp_path, path)
+    return True
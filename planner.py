@@ -0,0 +1,208 @@
+import os
+import time
+
+import bpy
+
+from . import cache
+from . import core
+from . import library
+from . import pixels
+from . import sequence
+from . import settings
+from . import udim
+
+
+class ScanGroup:
+    """One file on disk and every image datablock that points to it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.images = []
+        self.key = None
+        # estimated decode cost, used to schedule the biggest files first
+        self.cost = 0
+        # the UDIM set or sequence this file is a tile or frame of, and its number
+        self.file_set = None
+        self.number = None
+        # frames that aren't sampled are only hashed, movies are sampled by the worker
+        self.hash_only = False
+        self.movie = False
+
+
+class FileSet:
+    """The files of a UDIM image or an image sequence, scanned one file each and decided on as a whole.
+
+    combine(records) merges the records of every file, keyed by tile or frame number.
+    """
+
+    def __init__(self, combine):
+        self.combine = combine
+        self.images = []
+        self.paths = {}  # number: path
+        self.sampled = set()  # numbers of the files that are analyzed, the rest are only hashed
+        self.records = {}
+
+    @property
+    def complete(self):
+        return len(self.records) == len(self.paths)
+
+    def add(self, number, record):
+        """Keep the record of one file, returns the record of the whole set once every file is in."""
+        self.records[number] = record
+        if self.complete:
+            return self.combine(self.records)
+        return None
+
+
+class ScanPlan:
+    def __init__(self):
+        self.groups = []  # files to analyze, largest first
+        self.file_sets = []  # UDIM images and sequences, their files are in groups
+        self.report_only = []  # (image, reason) listed in the report but never analyzed
+        self.skipped = []  # (image name, reason) left out entirely
+        self.started = time.time()
+        self.seconds = 0  # spent planning
+
+    @property
+    def num_images(self):
+        files = sum(len(group.images) for group in self.groups if group.file_set is None)
+        return files + sum(len(file_set.images) for file_set in self.file_sets)
+
+    def summary(self):
+        return (
+            f"{len(self.groups)} files for {self.num_images} images, "
+            f"{len(self.report_only)} not optimizable, {len(self.skipped)} skipped"
+        )
+
+    def log(self):
+        print(f"Scan plan: {self.summary()}")
+        for img, reason in self.report_only:
+            print(f"  Not optimizable {img.name}: {reason}")
+        for name, reason in self.skipped:
+            print(f"  Skipping {name}: {reason}")
+
+
+def plan_scan(images):
+    """Decide what to scan from image metadata alone, before any pixels are fetched."""
+    plan = ScanPlan()
+    images = list(images)
+    # a single user_map call for everything, it walks the whole file each time
+    users = bpy.data.user_map(subset=images)
+    applied = library.applied_images()
+    groups = {}
+    file_sets = {}
+
+    for img in images:
+        # Skip non-pixel types like viewer nodes or render result
+        if img.type != "IMAGE":
+            plan.skipped.append((img.name, f"not an image ({img.type})"))
+            continue
+
+        if not users.get(img):
+            plan.skipped.append((img.name, "orphan, no users"))
+            continue
+
+        if img in applied:
+            plan.skipped.append((img.name, "optimized in its library"))
+            continue
+
+        if img.packed_file:
+            # because we can't optimize packed images
+            plan.report_only.append((img, "packed"))
+            continue
+
+        if img.source not in {"FILE", "TILED", "SEQUENCE", "MOVIE"}:
+            plan.report_only.append((img, f"{img.source.lower()} images are not supported"))
+            continue
+
+        if not img.filepath_raw:
+            plan.skipped.append((img.name, "no file path"))
+            continue
+
+        if img.source in {"TILED", "SEQUENCE"}:
+            plan_set = plan_tiles if img.source == "TILED" else plan_sequence
+            reason = plan_set(img, file_sets)
+            if reason:
+                plan.report_only.append((img, reason))
+            continue
+
+        path = core.image_abspath(img)
+        if not os.path.isfile(path):
+            plan.skipped.append((img.name, f"file not found: {path}"))
+            continue
+
+        if img.source == "MOVIE":
+            if not pixels.frame_count(path):
+                plan.report_only.append((img, "movie can't be decoded"))
+                continue
+            path = ("movie", path)
+
+        if path not in groups:
+            groups[path] = ScanGroup(path[1] if img.source == "MOVIE" else path)
+            groups[path].movie = img.source == "MOVIE"
+        groups[path].images.append(img)
+
+    # every tile and frame is a file of its own for the workers
+    for key, file_set in file_sets.items():
+        plan.file_sets.append(file_set)
+        for number, path in file_set.paths.items():
+            group = ScanGroup(path)
+            group.images = file_set.images
+            group.file_set = file_set
+            group.number = number
+            group.hash_only = number not in file_set.sampled
+            groups[(key, number)] = group
+
+    for group in groups.values():
+        group.key = cache.file_key(group.path)
+        info = None if group.hash_only else pixels.read_info(group.path)
+        if info is not None:
+            group.cost = info["width"] * info["height"] * info["depth"]
+        elif group.key is not None:
+            # no header reader available, the file size is the next best guess
+            group.cost = group.key[1]
+
+    plan.groups = sorted(groups.values(), key=lambda group: group.cost, reverse=True)
+    plan.seconds = time.time() - plan.started
+    return plan
+
+
+def add_to_set(img, file_sets, key, paths, sampled, combine):
+    """Add an image to the file set of its files, images with the same files share one set."""
+    if key not in file_sets:
+        file_sets[key] = FileSet(combine)
+        file_sets[key].paths = paths
+        file_sets[key].sampled = set(sampled)
+    elif file_sets[key].paths != paths:
+        return "files differ from another image with the same path"
+    file_sets[key].images.append(img)
+    return None
+
+
+def plan_tiles(img, file_sets):
+    """Add a UDIM image to the set of its file pattern, returns why it can't be scanned or None."""
+    pattern = core.image_abspath(img)
+    if not udim.is_pattern(pattern):
+        return "tiled image without a <UDIM> file path"
+
+    paths = {tile.number: udim.tile_path(pattern, tile.number) for tile in img.tiles}
+    for number, path in sorted(paths.items()):
+        if not os.path.isfile(path):
+            return f"tile {number} not found"
+    return add_to_set(img, file_sets, pattern, paths, paths, udim.combine)
+
+
+def plan_sequence(img, file_sets):
+    """Add an image sequence to the set of its frames on disk, returns why it can't be scanned or None.
+
+    Only the sampled frames are analyzed, every frame is hashed so the optimized
+    sequence is addressed by all of its content.
+    """
+    frames = sequence.frame_files(core.image_abspath(img))
+    if not frames:
+        return "no frames found"
+
+    paths = dict(frames)
+    sampled = sequence.sample_frames(sorted(paths), settings.SEQUENCE_STRIDE, settings.SEQUENCE_FULL_SCAN)
+    key = sequence.split_frame(frames[0][1])[::2]
+    return add_to_set(img, file_sets, key, paths, sampled, sequence.combine)
@@ -1,112 +1,312 @@
+from . import analysis
+from . import bcn
+from . import cache
+from . import memory
+from . import packing
+from . import profiling
+from . import sequence
 from . import settings
+from . import store
+from . import udim
 import bpy
-import hashlib
 import os
+import threading
+import time
 
+# colorspace float colors written as 8 bit are read in
+SRGB = "sRGB"
 
-def optimize(img_info):
+# the last texture swap as (textures changed, textures checked, seconds)
+last_swap = None
+# set to stop the background prefetch of the previous swap
+_prefetch_stop = None
+
+
+def output_folder():
+    """Folder the optimized textures are stored in, project wide or next to the current .blend."""
+    if settings.STORE_DIR:
+        return os.path.abspath(bpy.path.abspath(settings.STORE_DIR))
+    return os.path.join(os.path.dirname(bpy.data.filepath), "tc_optimized")
+
+
+def srgb_available():
+    """Not every OCIO config has an sRGB colorspace."""
+    items = bpy.types.ColorManagedInputColorspaceSettings.bl_rna.properties["name"].enum_items
+    return SRGB in items.keys()
+
+
+def srgb_output(img_info):
+    """Whether a float color texture can be written as 8 bit sRGB, only Rec.709 linear keeps its primaries."""
+    image = img_info.image
+    colorspace = img_info.original_settings[0] if img_info.original_settings else image.colorspace_settings.name
+    return colorspace in memory.LINEAR_NAMES and srgb_available()
+
+
+def export_job(img_info, output_store, output_format="IMAGE"):
+    """Describe the optimized file to write for an image, or None if it stays as it is.
+
+    Only plain values go in the job so it can be sent to a worker process. The
+    target is addressed by the source content and the transform, so it may
+    already exist from another .blend or an earlier run. With the DDS output
+    format every 8 bit texture is block compressed, resized or not. UDIM sets
+    get one job with every tile in it, written as a set with the same numbers,
+    and so do image sequences with every frame. Movies are written as an image
+    sequence, the datablock switches to it while the optimized files are used.
+    """
     image = img_info.image
+    if image.packed_file or image.source not in {"FILE", "TILED", "SEQUENCE", "MOVIE"}:
+        return None
+    # a tile set or sequence is only written when every file was scanned
+    if image.source == "TILED" and not (img_info.tiles and all(tile[3] for tile in img_info.tiles)):
+        return None
+    if image.source == "SEQUENCE" and not (img_info.frames and all(frame[1] for frame in img_info.frames)):
+        return None
+    if image.source == "MOVIE" and not (img_info.frames and img_info.content_hash):
+        return None
+    # 16 bit sources keep their precision as half float unless they go to 8 bit on purpose
+    float_output = (img_info.is_float or img_info.precision == "16") and not img_info.optimized_depth
+    block_compress = output_format == "DDS" and not float_output
+    to_srgb = img_info.is_float and not float_output and not image.colorspace_settings.is_data
+    if to_srgb and not srgb_output(img_info):
+        print(f"Can't write {image.name} as 8 bit, {image.colorspace_settings.name} has no sRGB equivalent")
+        return None
+    if not img_info.optimized_resolution and not img_info.optimized_depth and not block_compress:
+        return None
+
+    # never go below 2 pixels, same as the resize used to
+    factor = img_info.resize_divisor
+    smallest = min(img_info.width, img_info.height)
+    if img_info.tiles:
+        smallest = min(min(tile[1], tile[2]) for tile in img_info.tiles)
+    while factor > 1 and smallest // factor < 2:
+        factor //= 2
+
+    depth = img_info.optimized_depth or img_info.depth
+    channels = {8: 1, 24: 3, 96: 3}.get(depth, 4)
+    job = {
+        "source": os.path.abspath(bpy.path.abspath(image.filepath_raw, library=image.library)),
+        "factor": factor,
+        "channels": channels,
+        "float_output": float_output,
+        "compression": settings.PNG_COMPRESSION,
+        "block_format": bcn.FORMATS[channels] if block_compress else None,
+        "transfer": "srgb" if to_srgb else None,
+    }
+
+    source_hash = img_info.content_hash
+    if source_hash is None:
+        try:
+            source_hash = store.content_hash(job["source"])
+        except OSError as exc:
+            print(f"Can't read {job['source']}: {exc}")
+            return None
+
+    if img_info.tiles:
+        # number, source, content hash and pyramid level of every tile
+        job["tiles"] = [
+            [number, udim.tile_path(job["source"], number), tile_hash, pyramid_level(tile_hash, factor)]
+            for number, _w, _h, tile_hash in img_info.tiles
+        ]
+    elif image.source == "SEQUENCE":
+        job["frames"] = [
+            [number, sequence.frame_path(job["source"], number), frame_hash, pyramid_level(frame_hash, factor)]
+            for number, frame_hash in img_info.frames
+        ]
+        job["frame_digits"] = len(sequence.split_frame(job["source"])[1])
+    elif image.source == "MOVIE":
+        # every frame is read from the movie itself, Blender numbers them from 1
+        job["frames"] = [[number, job["source"], source_hash, None] for number, _hash in img_info.frames]
+        job["frame_digits"] = sequence.MOVIE_DIGITS
+        job["movie"] = True
 
-    if img_info.optimized_resolution:
-        width = image.size[0]
-        height = image.size[1]
+    job["source_hash"] = source_hash
+    job["target"] = output_store.path_for(source_hash, job)
+    job["store"] = output_store.folder
 
-        new_width = max(2, img_info.optimized_resolution[0])
-        new_height = max(2, img_info.optimized_resolution[1])
+    pyramid = pyramid_level(source_hash, factor)
+    if pyramid:
+        job["pyramid"] = pyramid
+    return job
 
-        image.scale(new_width, new_height)
-        print(f"Resized {image.name} to {new_width}x{new_height}")
 
-    elif img_info.optimized_depth:
-        # Save the original settings
-        colorspace_original = image.colorspace_settings.name
-        image.colorspace_settings.name = "Non-Color"
+def pyramid_level(content_hash, factor):
+    """The downscaled level the scan left behind for a source, writing it skips decoding the source."""
+    if factor in analysis.PYRAMID_FACTORS:
+        pyramid = cache.pyramid_path(content_hash, factor)
+        if os.path.isfile(pyramid):
+            return pyramid
+    return None
 
-        # set up new file path
-        filepath_original = image.filepath_raw
-        ext = filepath_original.split(".")[-1]
 
-        # hash the filepath to avoid conflicts of multiple images with the same name like albedo.png
-        hash_object = hashlib.md5(filepath_original.encode())
-        hashed_filepath = hash_object.hexdigest()
+def optimize(img_info, output_store):
+    """Write the optimized file with Blender itself, for when the export workers can't.
 
-        # Set the folder path for optimized images
-        folder_path = os.path.join(os.path.dirname(bpy.data.filepath), "tc_optimized")
+    The file goes to the same address in the store a worker would write it to and
+    is recorded in the manifest, the swap then points the datablock at it.
+    """
+    image = img_info.image
+    if image.source != "FILE":
+        # Blender can only save the first tile or the current frame this way
+        if img_info.optimized_resolution or img_info.optimized_depth:
+            print(f"Can't optimize every file of {image.name} without the export workers")
+        return
+
+    job = export_job(img_info, output_store)
+    if job is None:
+        return
+    if job["transfer"]:
+        # Blender would write the float values without the sRGB curve
+        print(f"Can't write {image.name} as 8 bit sRGB without the export workers")
+        return
 
-        # Create the folder if it doesn't exist
-        os.makedirs(folder_path, exist_ok=True)
+    if not os.path.isfile(job["target"]):
+        os.makedirs(os.path.dirname(job["target"]), exist_ok=True)
+        save_with_blender(img_info, job)
+        print(f"Wrote {image.name} to {job['target']}")
+    output_store.record([(job["target"], job["source"], job["source_hash"])])
+    img_info.optimized_path = job["target"]
 
-        # new file path
-        filepath_new = os.path.join(folder_path, f"{hashed_filepath}.png")
-       
 
-        scene = bpy.context.scene
-        scene.render.image_settings.file_format = "PNG"
-        scene.render.image_settings.compression = 15
-        scene.render.image_settings.color_depth = "8"
+def save_with_blender(img_info, job):
+    """Save a resized and channel reduced copy of an image, the original datablock is never touched."""
+    # a scene of our own so the render output settings of the user's scene stay as they are
+    scene = bpy.data.scenes.new("TC_save")
+    copy = img_info.image.copy()
+    try:
+        # write the values as they are, without any view transform
+        copy.colorspace_settings.name = "Non-Color"
+        if job["factor"] > 1:
+            copy.scale(max(2, img_info.width // job["factor"]), max(2, img_info.height // job["factor"]))
 
-        if img_info.optimized_depth == 8:
-            scene.render.image_settings.color_mode = "BW"
-        elif img_info.optimized_depth == 24:
-            scene.render.image_settings.color_mode = "RGB"
+        image_settings = scene.render.image_settings
+        if job["float_output"]:
+            image_settings.file_format = "OPEN_EXR"
+            image_settings.color_depth = "16"
+            image_settings.exr_codec = "ZIP"
         else:
-            raise (f"Invalid depth {img_info.optimized_depth} for {image.name}")
+            image_settings.file_format = "PNG"
+            image_settings.color_depth = "8"
+            image_settings.compression = 15
+        image_settings.color_mode = {1: "BW", 3: "RGB", 4: "RGBA"}[job["channels"]]
+        copy.save_render(job["target"], scene=scene)
+    finally:
+        bpy.data.images.remove(copy)
+        bpy.data.scenes.remove(scene)
+
+
+def apply_precision(img_info):
+    """Set up the datablock for the precision the optimized texture uses, remembering the original."""
+    image = img_info.image
+    if img_info.original_settings is None:
+        img_info.original_settings = (image.colorspace_settings.name, image.use_half_precision, image.source)
+        if img_info.table is not None:
+            img_info.table.optimized_changed()
+    # a movie was written as an image sequence
+    if image.source == "MOVIE" and img_info.optimized_path:
+        image.source = "SEQUENCE"
+    if img_info.read_as_half_precision and not image.use_half_precision:
+        image.use_half_precision = True
+    # float colors written as 8 bit carry the sRGB curve
+    if (
+        img_info.optimized_path
+        and img_info.is_float
+        and img_info.optimized_depth
+        and not image.colorspace_settings.is_data
+        and srgb_output(img_info)
+    ):
+        image.colorspace_settings.name = SRGB
+
+
+def restore_precision(img_info):
+    if img_info.original_settings is None:
+        return
+    image = img_info.image
+    colorspace, use_half_precision, source = img_info.original_settings
+    if image.source != source:
+        image.source = source
+    if image.colorspace_settings.name != colorspace:
+        image.colorspace_settings.name = colorspace
+    if image.use_half_precision != use_half_precision:
+        image.use_half_precision = use_half_precision
+    img_info.original_settings = None
+    if img_info.table is not None:
+        img_info.table.optimized_changed()
 
-        image.save_render(bpy.path.abspath(filepath_new), scene=scene)
 
-        # replace image with new file
-        print(f"Using 8bit {image.name}")
-        
-        image.filepath_raw = bpy.path.relpath(filepath_new)
-        
-        image.colorspace_settings.name = colorspace_original
+def swap_to(image_list, attribute):
+    """Point every image at its original or optimized file, touching only the ones that change.
 
-        img_info.optimized_path = filepath_new
+    Nothing is reloaded here. Freeing the pixel buffers makes Blender decode the new
+    file the next time the viewport or a render actually needs the texture.
+    """
+    global last_swap
+    start = time.perf_counter()
+    changed = 0
+    for img in image_list:
+        if attribute == "optimized_path":
+            apply_precision(img)
+        else:
+            restore_precision(img)
 
-        img_info.image.reload()
+        path = getattr(img, attribute)
+        if not path or img.image.filepath_raw == path:
+            continue
+        with profiling.texture(img.image.name), profiling.phase("reload"):
+            img.image.filepath_raw = path
+            img.image.buffers_free()
+        changed += 1
 
+    last_swap = (changed, len(image_list), time.perf_counter() - start)
+    print(f"Swapped {changed} of {len(image_list)} textures in {last_swap[2] * 1000:.0f}ms")
 
-def convert_to_dxt1(image):
-    """Convert the given image to DXT1 format using crunch.exe."""
-    # get file extension of filepath
-    filepath_original = image.filepath_raw
-    ext = filepath_original.split(".")[-1]
-    # deal with library assets
-    filepath_original = bpy.path.abspath(filepath_original, library=image.library)
 
-    cmd = [
-        settings.crunch_path,
-        "-file",
-        filepath_original,
-        "-out",
-        filepath_original + ".dds",
-        "-fileformat",
-        "dds",
-        "-dxt1",
-    ]
+def prefetch(image_list, attribute):
+    """Read the files of the other variant in the background so the OS has them cached for the next swap."""
+    global _prefetch_stop
+    if _prefetch_stop is not None:
+        _prefetch_stop.set()
+    if not settings.SWAP_PREFETCH:
+        return
 
-    result = subprocess.run(cmd)
-    if result.returncode != 0:
-        print(f"Error compressing {image.name}: {result.stderr}")
-        return False
+    # resolve on the main thread, bpy isn't safe to use from the prefetch thread
+    paths = []
+    for img in image_list:
+        if not getattr(img, attribute):
+            continue
+        path = bpy.path.abspath(getattr(img, attribute), library=img.image.library)
+        # a movie is one file, its optimized frames are a sequence
+        is_movie = img.frames and img.frames[0][1] is None
+        if img.tiles:
+            paths.extend(udim.tile_path(path, tile[0]) for tile in img.tiles)
+        elif img.frames and not (is_movie and attribute == "original_path"):
+            paths.extend(sequence.frame_path(path, frame[0]) for frame in img.frames)
+        else:
+            paths.append(path)
+    stop = _prefetch_stop = threading.Event()
 
-    # Replace image with new file
-    image.filepath_raw = filepath_original + ".dds"
+    def read_all():
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    while not stop.is_set() and f.read(1024 * 1024):
+                        pass
+            except OSError:
+                pass
+            if stop.is_set():
+                return
 
-    return True
+    threading.Thread(target=read_all, daemon=True).start()
 
 
 def use_original(image_list):
     print("Using original images")
-    for img in image_list:
-        if img.original_path:
-            img.image.filepath_raw = img.original_path
-            img.image.reload()
+    swap_to(image_list, "original_path")
+    packing.restore_all()
+    prefetch(image_list, "optimized_path")
 
 
 def use_optimized(image_list):
     print("Using optimized images")
-    for img in image_list:
-        if img.optimized_path:
-            img.image.filepath_raw = img.optimized_path
-            img.image.reload()
+    swap_to(image_list, "optimized_path")
+    packing.apply_all()
+    prefetch(image_list, "original_path")
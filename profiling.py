@@ -0,0 +1,194 @@
+import contextlib
+import json
+import os
+import sys
+import time
+
+# this runs in the worker processes too, never import bpy here
+
+# in the order they happen to a texture
+PHASES = ("eligibility", "decode", "sharpness", "color", "hash", "encode", "reload")
+
+# the Timer the phases of this process go to, None while nothing is profiled
+_timer = None
+# phases of the last scan and optimize run, filled in on the main thread
+_profile = None
+
+
+def peak_rss_mb():
+    """Peak memory of this process so far, or None where it can't be read."""
+    try:
+        import resource
+    except ImportError:
+        # not on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+class Timer:
+    """The phases of one texture, as plain values so a worker process can send them back."""
+
+    def __init__(self):
+        self.spans = []  # [phase, start as epoch seconds, seconds]
+        self.bytes_read = 0
+
+    def to_record(self):
+        return {
+            "spans": self.spans,
+            "bytes_read": self.bytes_read,
+            "peak_mb": peak_rss_mb(),
+            "pid": os.getpid(),
+        }
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a phase of the texture being profiled, does nothing if there is none."""
+    timer = _timer
+    if timer is None:
+        yield
+        return
+    start, begin = time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.spans.append([name, start, time.perf_counter() - begin])
+
+
+def add_bytes_read(count):
+    if _timer is not None:
+        _timer.bytes_read += count
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+@contextlib.contextmanager
+def texture(name):
+    """Profile what the main thread does to one texture into the current profile."""
+    global _timer
+    outer, _timer = _timer, Timer()
+    try:
+        yield
+    finally:
+        get_profile().add(name, _timer.to_record())
+        _timer = outer
+
+
+def profiled(func, *args):
+    """Run a worker job with its phases timed, returns (result, timer record)."""
+    global _timer
+    _timer = Timer()
+    try:
+        return func(*args), _timer.to_record()
+    finally:
+        _timer = None
+
+
+class Profile:
+    """Per-texture and total timings of a scan and the optimize run after it.
+
+    Worker phases are summed over every process, so the totals can add up to
+    more than the wall clock time. The time the main thread spent neither
+    working nor in a phase, waiting on the modal timer or the workers, is the
+    wall time minus everything timed there.
+    """
+
+    def __init__(self):
+        self.textures = {}  # name: {"seconds": {phase: seconds}, "bytes_read": bytes, "peak_mb": MB}
+        self.spans = []  # [texture, phase, start, seconds, pid] for the trace
+        self.overall = {}  # phase: seconds, of the phases that aren't per texture
+        self.wall_seconds = {}  # scan or optimize: seconds from start to finish
+
+    def add(self, name, record):
+        entry = self.textures.setdefault(name, {"seconds": {}, "bytes_read": 0, "peak_mb": None})
+        for phase_name, start, seconds in record["spans"]:
+            entry["seconds"][phase_name] = entry["seconds"].get(phase_name, 0) + seconds
+            self.spans.append([name, phase_name, start, seconds, record["pid"]])
+        entry["bytes_read"] += record["bytes_read"]
+        if record["peak_mb"] is not None:
+            entry["peak_mb"] = max(entry["peak_mb"] or 0, record["peak_mb"])
+
+    def add_span(self, phase_name, start, seconds):
+        """Record a phase done for every texture at once, like planning the scan."""
+        self.overall[phase_name] = self.overall.get(phase_name, 0) + seconds
+        self.spans.append(["", phase_name, start, seconds, os.getpid()])
+
+    def texture_seconds(self, name):
+        return sum(self.textures[name]["seconds"].values())
+
+    def totals(self):
+        totals = dict.fromkeys(PHASES, 0.0)
+        totals.update(self.overall)
+        for entry in self.textures.values():
+            for phase_name, seconds in entry["seconds"].items():
+                totals[phase_name] = totals.get(phase_name, 0.0) + seconds
+        return totals
+
+    def slowest(self, count=10):
+        """The names of the textures that took the longest, slowest first."""
+        return sorted(self.textures, key=self.texture_seconds, reverse=True)[:count]
+
+    def summary(self):
+        """One line for the panel, the biggest phases first."""
+        totals = sorted(((s, p) for p, s in self.totals().items() if s > 0), reverse=True)
+        phases = ", ".join(f"{p} {s:.1f}s" for s, p in totals[:3])
+        wall = " + ".join(f"{k} {s:.1f}s" for k, s in self.wall_seconds.items())
+        return f"{wall}: {phases}" if wall else phases
+
+    def to_json(self):
+        peaks = [entry["peak_mb"] for entry in self.textures.values() if entry["peak_mb"] is not None]
+        return {
+            "wall_seconds": self.wall_seconds,
+            "phase_seconds": self.totals(),
+            "bytes_read": sum(entry["bytes_read"] for entry in self.textures.values()),
+            "peak_mb": max(peaks) if peaks else None,
+            "textures": self.textures,
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=1)
+
+    def save_trace(self, path):
+        """Write the phases as a Chrome trace, for chrome://tracing or Perfetto. Every process is a row."""
+        events = [
+            {
+                "name": phase_name,
+                "cat": phase_name,
+                "ph": "X",
+                "ts": int(start * 1e6),
+                "dur": int(seconds * 1e6),
+                "pid": pid,
+                "tid": pid,
+                "args": {"texture": name},
+            }
+            for name, phase_name, start, seconds, pid in self.spans
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def get_profile():
+    global _profile
+    if _profile is None:
+        _profile = Profile()
+    return _profile
+
+
+def reset():
+    """Start a new profile, every scan does."""
+    global _profile
+    _profile = Profile()
+    return _profile
+
+
+def last_profile():
+    """The profile of the last scan, or None if nothing was scanned yet."""
+    return _profile
@@ -0,0 +1,78 @@
+import os
+import re
+
+from . import analysis
+from . import udim
+
+# this is imported by the worker processes too, never import bpy here
+
+# the frame number is the last run of digits in the file name, the same as Blender reads it
+FRAME_DIGITS = re.compile(r"(\d+)(\D*)$")
+# padding of the frame numbers when a movie is written as an image sequence
+MOVIE_DIGITS = 4
+
+
+def split_frame(path):
+    """Split a frame path into (head, digits, tail), or None if the name has no frame number."""
+    folder, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    match = FRAME_DIGITS.search(stem)
+    if match is None:
+        return None
+    return os.path.join(folder, stem[: match.start(1)]), match.group(1), match.group(2) + ext
+
+
+def frame_path(path, number):
+    """Path of another frame of the sequence path belongs to, padded like path."""
+    head, digits, tail = split_frame(path)
+    return f"{head}{number:0{len(digits)}d}{tail}"
+
+
+def frame_files(path):
+    """Every frame of the sequence path belongs to that's on disk, as sorted (number, path) pairs."""
+    parts = split_frame(path)
+    if parts is None:
+        return []
+    head, _digits, tail = parts
+    folder, prefix = os.path.split(head)
+    try:
+        names = os.listdir(folder or ".")
+    except OSError:
+        return []
+
+    frames = []
+    for name in names:
+        if name.startswith(prefix) and name.endswith(tail) and len(name) > len(prefix) + len(tail):
+            digits = name[len(prefix) : len(name) - len(tail)]
+            if digits.isdigit():
+                frames.append((int(digits), os.path.join(folder, name)))
+    return sorted(frames)
+
+
+def sample_frames(numbers, stride, full=False):
+    """Pick the frames to analyze: the first, the last and every stride-th in between, or all of them."""
+    if full or stride <= 1:
+        return list(numbers)
+    sampled = list(numbers[::stride])
+    if numbers and numbers[-1] not in sampled:
+        sampled.append(numbers[-1])
+    return sampled
+
+
+def combine(records):
+    """Merge the records of a sequence into one record, records maps frame number to record.
+
+    Sampled frames have the full analysis, the others only their content hash.
+    Returns None if a frame couldn't be read.
+    """
+    if not records or any(record is None for record in records.values()):
+        return None
+    numbers = sorted(records)
+    sampled = [records[number] for number in numbers if "sharpness_factor" in records[number]]
+    if not sampled:
+        return None
+
+    record = analysis.merge_records(sampled)
+    record["content_hash"] = udim.set_hash([(number, records[number]["content_hash"]) for number in numbers])
+    record["frames"] = [[number, records[number]["content_hash"]] for number in numbers]
+    return record
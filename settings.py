@@ -1,4 +1,25 @@
-crunch_path = r"D:\Work\crunch\bin\crunch_x64.exe"
 HYPERSPEED = True
 AUTO_SHOW_REPORT = False
 IGNORE_TINY = False
+CACHE_DIR = None  # defaults to the per-user cache folder
+CACHE_MAX_MB = 64
+SCAN_WORKERS = 0  # number of scan processes, 0 uses every core
+SCAN_WORKER_MEMORY_MB = 2048  # per scan process, large textures are analyzed at a lower resolution to fit
+EXPORT_WORKER_MEMORY_MB = 4096  # per export process, optimized files are written at full resolution
+WORKER_MALLOC_ARENAS = 2  # glibc malloc arenas per worker process, more only grow the address space
+PNG_COMPRESSION = 1  # zlib level 0-9 for optimized PNGs, higher is smaller but slower
+STORE_DIR = None  # project wide folder for optimized textures, defaults to tc_optimized next to the .blend
+RESIZE_PSNR_SAFE = 40.0  # quality in dB a resized texture has to keep with Smart Resize on Safe
+RESIZE_PSNR_AGGRESSIVE = 34.0
+RESIZE_PERCENTILE = 95  # percent of the texture that has to meet the quality, the rest may be worse
+FLOAT_HALF_MAX_ERROR = 0.001  # relative RMS error a float texture may pick up from half precision
+FLOAT_8BIT_MAX_ERROR = 0.004  # same for storing it as 8 bit with Float Textures on Aggressive
+PALETTE_MAX_COLORS = 16  # float textures with this few colors are masks or ID maps and go to 8 bit
+DUPLICATE_MAX_BITS = 6  # perceptual hashes this many bits apart count as the same texture
+DUPLICATE_MAX_COLOR = 0.02  # largest difference of the mean color between near duplicates
+PYRAMID_CACHE_MB = 2048  # downscaled levels kept from scanning so optimizing doesn't decode the source again
+THUMBNAIL_SIZE = 128  # longest side of the previews in the report, kept with the pyramid levels
+SWAP_PREFETCH = True  # read the other set of textures in the background so switching back is quick
+SEQUENCE_STRIDE = 10  # analyze the first, the last and every this many frames of an image sequence or movie
+SEQUENCE_FULL_SCAN = False  # analyze every frame instead, slower but nothing is missed
+PROFILE_TRACE = False  # also write a Chrome trace of the scan and optimize phases next to the report
@@ -0,0 +1,182 @@
+import contextlib
+import hashlib
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+from . import udim
+
+# this is imported by the worker processes too, never import bpy here
+
+MANIFEST = "manifest.json"
+
+
+def content_hash(path):
+    """Hash the full contents of a file, identical files share one hash wherever they live."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def transform_name(job):
+    """Describe the transform a job applies, part of the output's address."""
+    if job.get("parts"):
+        return f"r{job['factor']}_pack{len(job['parts'])}.png"
+    if job.get("block_format"):
+        name, ext = f"r{job['factor']}_{job['block_format'].lower()}", "dds"
+    else:
+        ext = "exr" if job["float_output"] else "png"
+        precision = "half" if job["float_output"] else "8bit"
+        name = f"r{job['factor']}_c{job['channels']}_{precision}"
+    # the same float source written as color and as data gets a different curve
+    if job.get("transfer"):
+        name += f"_{job['transfer']}"
+    # a tile set keeps the UDIM token and a sequence the frame number, so Blender finds every file
+    if job.get("tiles"):
+        name += f".{udim.TOKEN}"
+    elif job.get("frames"):
+        name += f"_{job['frames'][0][0]:0{job['frame_digits']}d}"
+    return f"{name}.{ext}"
+
+
+class OutputStore:
+    """Optimized textures addressed by source content and transform.
+
+    The same source with the same settings always maps to the same file, no
+    matter which .blend or which folder it came from, so a second request is
+    just a lookup. The manifest remembers where every output came from so stale
+    outputs can be found and removed.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifest_path = os.path.join(folder, MANIFEST)
+
+    def path_for(self, source_hash, job):
+        # fan out into subfolders so no single folder gets huge on a big show
+        return os.path.join(self.folder, source_hash[:2], f"{source_hash}_{transform_name(job)}")
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the manifest lock, so runs writing to the same store in parallel don't lose each other's entries."""
+        os.makedirs(self.folder, exist_ok=True)
+        with open(f"{self.manifest_path}.lock", "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        # gives up after 10 seconds, keep waiting for the other run
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.manifest_path)
+
+    def record(self, entries, packs=()):
+        """Add (output path, source path, source hash) entries to the manifest.
+
+        packs are (output path, [(source path, source hash), ...]) for outputs
+        made from several sources, which stay valid only while all of them do.
+        """
+        if not entries and not packs:
+            return
+        with self.locked():
+            # merge with whatever other sessions wrote in the meantime
+            manifest = self.load_manifest()
+            now = time.time()
+            for output, source, source_hash in entries:
+                name = os.path.relpath(output, self.folder)
+                entry = manifest.setdefault(name, {"source_hash": source_hash, "sources": [], "created": now})
+                if source not in entry["sources"]:
+                    entry["sources"].append(source)
+                entry["last_used"] = now
+            for output, parts in packs:
+                name = os.path.relpath(output, self.folder)
+                entry = manifest.setdefault(name, {"parts": [list(part) for part in parts], "created": now})
+                entry["last_used"] = now
+            self.save_manifest(manifest)
+
+    def collect_garbage(self):
+        """Delete outputs whose sources changed or disappeared. Returns (files removed, bytes freed).
+
+        Age is no reason to remove an output, a .blend saved long ago may still use
+        it. The sources are hashed without holding the lock, an entry another run
+        recorded again in the meantime is kept.
+        """
+        snapshot = self.load_manifest()
+        stale = {}
+        for name, entry in snapshot.items():
+            output = os.path.join(self.folder, name)
+            if not os.path.isfile(output):
+                stale[name] = None
+            elif "parts" in entry:
+                # a packed output needs every one of its sources unchanged
+                try:
+                    if any(content_hash(source) != source_hash for source, source_hash in entry["parts"]):
+                        stale[name] = None
+                except OSError:
+                    stale[name] = None
+            else:
+                # keep the output only if at least one source still has the content it was made from
+                live = []
+                for source in entry["sources"]:
+                    try:
+                        if content_hash(source) == entry["source_hash"]:
+                            live.append(source)
+                    except OSError:
+                        pass
+                if not live:
+                    stale[name] = None
+                elif live != entry["sources"]:
+                    stale[name] = live
+
+        removed = 0
+        freed = 0
+        with self.locked():
+            manifest = self.load_manifest()
+            for name, live in stale.items():
+                if manifest.get(name) != snapshot[name]:
+                    continue
+                if live is not None:
+                    manifest[name]["sources"] = live
+                    continue
+                output = os.path.join(self.folder, name)
+                if os.path.isfile(output):
+                    freed += os.path.getsize(output)
+                    os.remove(output)
+                    removed += 1
+                del manifest[name]
+            self.save_manifest(manifest)
+        return removed, freed
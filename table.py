@@ -0,0 +1,203 @@
+import collections
+import itertools
+
+import numpy as np
+
+from . import memory
+
+# every value the Off/Safe/Aggressive settings can take
+SETTING_VALUES = ("0", "1", "2")
+SETTING_NAMES = ("convert_greyscale", "smart_resize", "optimize_float")
+# image sources an optimized file can be written for, see pro.export_job
+EXPORTABLE_SOURCES = {"FILE", "TILED", "SEQUENCE", "MOVIE"}
+# budget decisions kept, dragging the budget slider asks for one per value it passes
+BUDGET_DECISIONS = 4
+
+
+def settings_key(settings):
+    key = tuple(settings[name] for name in SETTING_NAMES)
+    # fitting a budget replaces the three settings
+    if settings.get("budget_mb") is not None:
+        key += (settings["budget_mb"],)
+    return key
+
+
+class Decision:
+    """What one combination of settings does to every texture in a table, plus the totals."""
+
+    __slots__ = (
+        "size_original_mb",
+        "size_optimized_mb",
+        "resize",
+        "optimized_depth",
+        "read_as_half_precision",
+        "reasons",
+        "fits",
+        "totals",
+    )
+
+    def __init__(
+        self,
+        size_original_mb,
+        size_optimized_mb,
+        resize,
+        optimized_depth,
+        read_as_half_precision,
+        reasons=None,
+        fits=None,
+    ):
+        self.size_original_mb = size_original_mb
+        self.size_optimized_mb = size_optimized_mb
+        self.resize = resize  # divisor of the resolution, 1 means unchanged
+        self.optimized_depth = optimized_depth  # 0 means unchanged
+        self.read_as_half_precision = read_as_half_precision
+        # only when fitting a budget: why every texture changed, and whether the budget was met
+        self.reasons = reasons
+        self.fits = fits
+
+        total_original = float(size_original_mb.sum())
+        total_optimized = float(size_optimized_mb.sum())
+        self.totals = (
+            total_original,
+            total_optimized,
+            total_original - total_optimized,
+            int(np.count_nonzero(size_original_mb > size_optimized_mb)),
+        )
+
+
+class TextureTable(list):
+    """The list of scanned textures, with a struct-of-arrays view for vectorized decisions.
+
+    Decisions for each combination of settings are computed once and memoized, so
+    switching settings or redrawing the panel is a dictionary lookup. Only the last
+    few budgets are kept. Everything is invalidated whenever a texture is added or
+    removed.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.changed()
+
+    def changed(self):
+        self._columns = None
+        self._decisions = {}
+        self._budget_decisions = collections.OrderedDict()
+        self._optimized = None
+        self._duplicates = None
+        self.active = None
+
+    def append(self, img_info):
+        super().append(img_info)
+        self.changed()
+
+    def extend(self, img_infos):
+        super().extend(img_infos)
+        self.changed()
+
+    def clear(self):
+        super().clear()
+        self.changed()
+
+    def columns(self):
+        """Return the scan results as a dict of NumPy arrays, one entry per texture."""
+        if self._columns is None:
+            for index, img_info in enumerate(self):
+                img_info.table = self
+                img_info.index = index
+
+            self._columns = {
+                "width": np.array([i.width for i in self], np.int64),
+                "height": np.array([i.height for i in self], np.int64),
+                # every tile of a UDIM set counts towards its memory, Cycles only holds the current frame of a sequence
+                "pixels": np.array(
+                    [sum(t[1] * t[2] for t in i.tiles) if i.tiles else i.width * i.height for i in self], np.int64
+                ),
+                "depth": np.array([i.depth for i in self], np.int64),
+                "is_float": np.array([i.is_float for i in self], bool),
+                # what decides the image slot Cycles uses, see memory.slot_bytes
+                "channels": np.array([i.channels or 0 for i in self], np.int64),
+                "precision": np.array(
+                    [memory.PRECISIONS.index(i.precision or ("float" if i.is_float else "8")) for i in self], np.int64
+                ),
+                "builtin": np.array(
+                    [bool(i.image.packed_file) or i.image.source in {"GENERATED", "MOVIE"} for i in self], bool
+                ),
+                "colorspace": np.array(
+                    [
+                        memory.colorspace_kind(i.image.colorspace_settings.name, i.image.colorspace_settings.is_data)
+                        for i in self
+                    ],
+                    np.int64,
+                ),
+                "use_half_precision": np.array([i.image.use_half_precision for i in self], bool),
+                "packed": np.array([bool(i.image.packed_file) for i in self], bool),
+                "exportable": np.array(
+                    [not i.image.packed_file and i.image.source in EXPORTABLE_SOURCES for i in self], bool
+                ),
+                "sharpness_factor": np.array([i.sharpness_factor for i in self], np.float64),
+                "color_factor": np.array([i.color_factor for i in self], np.float64),
+                "alpha_factor": np.array([i.alpha_factor for i in self], np.float64),
+                "range_factor": np.array([i.range_factor for i in self], np.int64),
+                "is_data": np.array([i.image.colorspace_settings.is_data for i in self], bool),
+                # float precision errors, NaN for textures that aren't float
+                "half_error": np.array([i.half_error for i in self], np.float64),
+                "linear8_error": np.array([i.linear8_error for i in self], np.float64),
+                "srgb8_error": np.array([i.srgb8_error for i in self], np.float64),
+                "float_peak": np.array([i.float_peak for i in self], np.float64),
+                # NaN for the textures the scan couldn't build a pyramid for
+                "level_psnr": np.array(
+                    [i.level_psnr or (np.nan,) * 3 for i in self], np.float64
+                ).reshape(-1, 3),
+            }
+            columns = self._columns
+            unknown = columns["channels"] == 0
+            columns["channels"][unknown] = memory.channels_of(columns["depth"], columns["is_float"])[unknown]
+        return self._columns
+
+    def decide(self, settings, evaluate):
+        """Return the memoized Decision for these settings, computing it with evaluate(columns, settings)."""
+        key = settings_key(settings)
+        if settings.get("budget_mb") is None:
+            if key not in self._decisions:
+                self._decisions[key] = evaluate(self.columns(), settings)
+            return self._decisions[key]
+
+        if key in self._budget_decisions:
+            self._budget_decisions.move_to_end(key)
+        else:
+            self._budget_decisions[key] = evaluate(self.columns(), settings)
+            if len(self._budget_decisions) > BUDGET_DECISIONS:
+                self._budget_decisions.popitem(last=False)
+        return self._budget_decisions[key]
+
+    def precompute(self, evaluate):
+        """Work out every combination of settings up front."""
+        for values in itertools.product(SETTING_VALUES, repeat=len(SETTING_NAMES)):
+            self.decide(dict(zip(SETTING_NAMES, values)), evaluate)
+
+    def select(self, settings, evaluate):
+        self.active = self.decide(settings, evaluate)
+        return self.active
+
+    def duplicates(self, find):
+        """Return the memoized duplicate clusters, found with find(table)."""
+        if self._duplicates is None:
+            self._duplicates = find(self)
+        return self._duplicates
+
+    def tally(self):
+        if self.active is None:
+            return 0, 0, 0, 0
+        return self.active.totals
+
+    def tally_packed(self):
+        return int(self.columns()["packed"].sum())
+
+    def is_optimized(self):
+        if self._optimized is None:
+            # a texture that only switched to half precision counts as well
+            self._optimized = any(i.optimized_path is not None or i.original_settings is not None for i in self)
+        return self._optimized
+
+    def optimized_changed(self):
+        self._optimized = None
@@ -0,0 +1,45 @@
+import hashlib
+
+from . import analysis
+
+# this is imported by the worker processes too, never import bpy here
+
+# token in the file path of a tiled image, replaced by the tile number
+TOKEN = "<UDIM>"
+UVTILE = "<UVTILE>"
+
+
+def is_pattern(path):
+    return TOKEN in path or UVTILE in path
+
+
+def tile_path(pattern, number):
+    """Path of one tile of a UDIM set, for both the 1001 and the u1_v1 naming."""
+    u, v = (number - 1001) % 10 + 1, (number - 1001) // 10 + 1
+    return pattern.replace(TOKEN, str(number)).replace(UVTILE, f"u{u}_v{v}")
+
+
+def set_hash(tiles):
+    """Address a tile set by the content of every tile and its number, tiles are (number, content hash)."""
+    key = "|".join(f"{number}:{tile_hash}" for number, tile_hash in sorted(tiles))
+    return hashlib.blake2b(key.encode(), digest_size=20).hexdigest()
+
+
+def combine(records):
+    """Merge the scan records of every tile into one record for the whole set.
+
+    records maps tile number to record. Returns None if a tile couldn't be scanned.
+    """
+    if not records or any(record is None for record in records.values()):
+        return None
+    numbers = sorted(records)
+    tiles = [records[number] for number in numbers]
+
+    record = analysis.merge_records(tiles)
+    # the size of the first tile, the others are listed with their own
+    record["width"], record["height"] = tiles[0]["width"], tiles[0]["height"]
+    record["content_hash"] = set_hash([(number, records[number]["content_hash"]) for number in numbers])
+    record["tiles"] = [
+        [number, tile["width"], tile["height"], tile["content_hash"]] for number, tile in zip(numbers, tiles)
+    ]
+    return record
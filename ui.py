@@ -1,10 +1,14 @@
-import time
-import concurrent.futures
-
 import bpy
 
+from . import cache
 from . import core
+from . import dedup
+from . import jobs
+from . import planner
+from . import pro
+from . import profiling
 from . import settings
+from . import store
 
 
 class TEXCOMPACTOR_PT_main_panel(bpy.types.Panel):
@@ -14,6 +18,8 @@ class TEXCOMPACTOR_PT_main_panel(bpy.types.Panel):
     bl_region_type = "WINDOW"
     bl_context = "render"
 
+    max_budget_lines = 8
+
     def draw(self, context):
         layout = self.layout
         layout.use_property_split = True
@@ -28,6 +34,8 @@ class TEXCOMPACTOR_PT_main_panel(bpy.types.Panel):
 
         col = layout.column()
         col.operator("texture_compactor.scan_textures", icon="FILE_REFRESH")
+        if bpy.data.libraries:
+            col.prop(scene, "TC_library_lookup")
 
         # bail early if scanning isn't done
         if not context.scene.TC_texture_metadata:
@@ -48,14 +56,29 @@ class TEXCOMPACTOR_PT_main_panel(bpy.types.Panel):
 
             row = layout.row()
             row.prop(scene, "TC_texture_swap", expand=True)
+            if pro.last_swap:
+                changed, total, seconds = pro.last_swap
+                layout.label(text=f"Swapped {changed} of {total} textures in {seconds * 1000:.0f}ms", icon="TIME")
             row = layout.row()
         else:
             row = layout.row()
-            row.prop(scene, "TC_convert_greyscale", expand=True)
+            row.prop(scene, "TC_fit_budget")
+            if scene.TC_fit_budget:
+                row = layout.row()
+                row.prop(scene, "TC_budget_mb")
+            else:
+                row = layout.row()
+                row.prop(scene, "TC_convert_greyscale", expand=True)
+                row = layout.row()
+                row.prop(scene, "TC_smart_resize", expand=True)
+                row = layout.row()
+                row.prop(scene, "TC_optimize_float", expand=True)
             row = layout.row()
-            row.prop(scene, "TC_smart_resize", expand=True)
+            row.prop(scene, "TC_output_format", expand=True)
             row = layout.row()
-            row.prop(scene, "TC_optimize_float", expand=True)
+            row.prop(scene, "TC_channel_pack")
+            row = layout.row()
+            row.prop(scene, "TC_library_mode")
             row = layout.row()
 
             col = row.split(factor=0.9)
@@ -66,6 +89,33 @@ class TEXCOMPACTOR_PT_main_panel(bpy.types.Panel):
 
             col.operator("texture_compactor.show_report", text="", icon="FILE")
 
+            decision = context.scene.TC_texture_metadata.active
+            if scene.TC_fit_budget and decision is not None and decision.reasons is not None:
+                self.draw_budget(layout, context.scene.TC_texture_metadata, decision)
+
+            # identical and near identical textures are merged separately, near ones only after a review
+            clusters = core.find_duplicates(context.scene.TC_texture_metadata)
+            for exact, text, icon in ((True, "duplicate", "DUPLICATE"), (False, "near identical", "QUESTION")):
+                group = [cluster for cluster in clusters if cluster.exact == exact]
+                if group:
+                    count = sum(len(cluster.duplicates) for cluster in group)
+                    reclaimable = sum(cluster.reclaimable_mb for cluster in group)
+                    row = layout.row()
+                    row.label(text=f"{count} {text} textures, {int(reclaimable)}MB reclaimable", icon=icon)
+                    merge = row.operator("texture_compactor.merge_duplicates", text="Merge" if exact else "Review")
+                    merge.near = not exact
+
+            scan_cache = cache.get_cache()
+            if scan_cache.hits or scan_cache.misses:
+                row = layout.row()
+                row.label(text=f"Scan cache: {scan_cache.hits} hits, {scan_cache.misses} misses", icon="FILE_CACHE")
+
+            profile = profiling.last_profile()
+            if profile is not None and profile.textures:
+                layout.label(text=profile.summary(), icon="TIME")
+                slowest = profile.slowest(1)[0]
+                layout.label(text=f"Slowest: {slowest} {profile.texture_seconds(slowest):.1f}s", icon="SORTTIME")
+
             row = layout.row()
             if num_of_changes == 0:
                 text = "No textures to optimize"
@@ -76,6 +126,19 @@ class TEXCOMPACTOR_PT_main_panel(bpy.types.Panel):
             else:
                 text = f"Optimize {num_of_changes} Textures"
             row.operator("texture_compactor.optimize_textures", text=text, icon="PLAY")
+            layout.operator("texture_compactor.clean_store", icon="TRASH")
+
+    def draw_budget(self, layout, image_list, decision):
+        """The textures fitting the budget changed the most, with what was done to them."""
+        if not decision.fits:
+            layout.label(text=f"Can't fit the budget, {int(decision.totals[1])}MB at the least", icon="ERROR")
+        changed = [info for info in image_list if info.budget_reason]
+        changed.sort(key=lambda info: info.size_original_mb - info.size_optimized_mb, reverse=True)
+        col = layout.column(align=True)
+        for info in changed[: self.max_budget_lines]:
+            col.label(text=f"{info.image.name}: {info.budget_reason}", icon="IMAGE_DATA")
+        if len(changed) > self.max_budget_lines:
+            col.label(text=f"...and {len(changed) - self.max_budget_lines} more, see the report")
 
 
 class TEXCOMPACTOR_OT_scan_textures(bpy.types.Operator):
@@ -85,83 +148,65 @@ class TEXCOMPACTOR_OT_scan_textures(bpy.types.Operator):
     bl_options = {"REGISTER", "UNDO", "INTERNAL"}
 
     _timer = None
-    _executor = None
-    _futures = None
-    _progress = 0
-    _total_images = 0
-
-    def scan_image(self, img):
-        # Skip non-pixel types like viewer nodes or render result
-        if img.type != "IMAGE":
-            print(f"Skipping {img} ({img.type})")
-            return None
+    _job = None
+    _plan = None
+    max_plan_lines = 20
 
-        # Ensure image is loaded by accessing its size first
-        w, h = img.size
+    def finish(self, context):
+        wm = context.window_manager
+        self._job.finish()
+        if self._timer:
+            wm.event_timer_remove(self._timer)
+        self.report({"INFO"}, "Scanning completed.")
 
-        if w == 0 or h == 0:
-            print(f"Image {img} is not loaded")
-            return None
+        core.update_memory_usage(self, context)
+        wm.progress_end()
 
-        if not img.has_data:
-            print(f"Image {img.name} has no pixel data")
-            return None
+        if settings.AUTO_SHOW_REPORT:
+            core.show_report(context.scene.TC_texture_metadata)
 
-        users = bpy.data.user_map(subset=[img])
-        if not users[img]:
-            print(f"Skipping orphan {img}")
-            return None
+        packed = core.tally_packed(context.scene.TC_texture_metadata)
+        if packed:
+            # pop up a confirmation modal
+            self.report(
+                {"ERROR"},
+                f"{packed} packed textures cannot be optimized. Please unpack them before optimizing.",
+            )
 
-        # Do the actual scan and return the metadata
-        return core.scan_image(img)
+        return {"FINISHED"}
 
     def modal(self, context, event):
         wm = context.window_manager
         if event.type == "TIMER":
-            if self._futures:
-                done, not_done = concurrent.futures.wait(
-                    self._futures, timeout=0, return_when=concurrent.futures.FIRST_COMPLETED
-                )
-                for future in done:
-                    try:
-                        img_info = future.result()
-                        if img_info is not None:
-                            context.scene.TC_texture_metadata.append(img_info)
-                    except Exception as exc:
-                        print(f"Exception during scanning: {exc}")
-                    self._futures.remove(future)
-                    self._progress += 1
-
-                # Update the progress bar
-                progress_percentage = (self._progress / self._total_images) * 100
-                wm.progress_update(self._progress)
-                self.report(
-                    {"INFO"}, f"Scanning progress: {self._progress}/{self._total_images} ({int(progress_percentage)}%)"
-                )
-
-                if not self._futures:  # Only shut down if all futures are done
-                    self._executor.shutdown(wait=False)
-                    context.window_manager.event_timer_remove(self._timer)
-                    self.report({"INFO"}, "Scanning completed.")
-
-                    core.update_memory_usage(self, context)
-                    wm.progress_end()
-
-                    if settings.AUTO_SHOW_REPORT:
-                        core.show_report(context.scene.TC_texture_metadata)
-
-                    packed = core.tally_packed(context.scene.TC_texture_metadata)
-                    if packed:
-                        # pop up a confirmation modal
-                        self.report(
-                            {"ERROR"},
-                            f"{packed} packed textures cannot be optimized. Please unpack them before optimizing.",
-                        )
-
-                    return {"FINISHED"}
+            done = self._job.poll()
+
+            # Update the progress bar
+            progress, total = self._job.progress, self._job.total
+            wm.progress_update(progress)
+            self.report({"INFO"}, f"Scanning progress: {progress}/{total} ({int(progress / total * 100)}%)")
+
+            if done:
+                return self.finish(context)
 
         return {"PASS_THROUGH"}
 
+    def invoke(self, context, event):
+        # show what will be scanned and what will be skipped before any pixels are touched
+        self._plan = planner.plan_scan(bpy.data.images)
+        return context.window_manager.invoke_props_dialog(self, width=450)
+
+    def draw(self, context):
+        layout = self.layout
+        plan = self._plan
+        col = layout.column(align=True)
+        col.label(text=plan.summary(), icon="INFO")
+
+        lines = [(img.name, reason) for img, reason in plan.report_only] + plan.skipped
+        for name, reason in lines[: self.max_plan_lines]:
+            col.label(text=f"{name}: {reason}", icon="CANCEL")
+        if len(lines) > self.max_plan_lines:
+            col.label(text=f"...and {len(lines) - self.max_plan_lines} more, see the system console")
+
     def execute(self, context):
         # warn if the user is scanning when using optimzied textures
         if context.scene.TC_texture_swap == "1":
@@ -171,22 +216,24 @@ class TEXCOMPACTOR_OT_scan_textures(bpy.types.Operator):
             )
             return {"CANCELLED"}
 
-        start = time.time()
-        context.scene.TC_texture_metadata.clear()
+        # all bpy access happens here on the main thread, workers only ever see file paths
+        plan = self._plan or planner.plan_scan(bpy.data.images)
+        self._plan = None
+        plan.log()
 
-        self._executor = concurrent.futures.ThreadPoolExecutor()
-        self._futures = [self._executor.submit(self.scan_image, img) for img in bpy.data.images]
-        self._total_images = len(self._futures)
+        self._timer = None
+        self._job = jobs.ScanJob(plan, context.scene.TC_texture_metadata)
+        if not self._job.start():
+            return self.finish(context)
 
         wm = context.window_manager
-        wm.progress_begin(0, self._total_images)
+        wm.progress_begin(0, self._job.total)
         self._timer = wm.event_timer_add(0.1, window=context.window)
         wm.modal_handler_add(self)
         return {"RUNNING_MODAL"}
 
     def cancel(self, context):
-        if self._executor:
-            self._executor.shutdown(wait=False)
+        self._job.cancel()
         if self._timer:
             context.window_manager.event_timer_remove(self._timer)
         context.window_manager.progress_end()
@@ -199,10 +246,137 @@ class TEXCOMPACTOR_OT_optimize_textures(bpy.types.Operator):
     bl_idname = "texture_compactor.optimize_textures"
     bl_description = "Optimize all textures used in the scene using the settings above"
 
+    _timer = None
+    _job = None
+
+    def finish(self, context):
+        wm = context.window_manager
+        if self._timer:
+            wm.event_timer_remove(self._timer)
+            wm.progress_end()
+
+        self._job.finish(context)
+        written, reused = len(self._job.written), self._job.reused
+        self.report({"INFO"}, f"Optimized {written} files, {reused} reused from earlier runs.")
+        return {"FINISHED"}
+
+    def modal(self, context, event):
+        if event.type == "ESC":
+            self.cancel(context)
+            return {"CANCELLED"}
+
+        if event.type == "TIMER":
+            done = self._job.poll()
+            wm = context.window_manager
+            wm.progress_update(self._job.progress)
+            self.report({"INFO"}, f"Optimizing: {self._job.progress}/{self._job.total} files")
+
+            if done:
+                return self.finish(context)
+
+        return {"PASS_THROUGH"}
+
+    def execute(self, context):
+        if not bpy.data.filepath and not settings.STORE_DIR:
+            self.report({"ERROR"}, "Please save the file first, optimized textures are written next to it.")
+            return {"CANCELLED"}
+
+        scene = context.scene
+        self._timer = None
+        self._job = jobs.OptimizeJob(
+            scene.TC_texture_metadata, scene.TC_output_format, scene.TC_channel_pack, scene.TC_library_mode
+        )
+        running = self._job.start()
+
+        if not self._job.planned:
+            # half precision is a setting on the datablock, it needs no new file
+            decision = scene.TC_texture_metadata.active
+            if decision is not None and decision.read_as_half_precision.any():
+                core.use_optimized_textures(context)
+                self.report({"INFO"}, "Float textures are now read at half precision.")
+                return {"FINISHED"}
+            self.report({"INFO"}, "No textures to optimize.")
+            return {"CANCELLED"}
+
+        if not running:
+            return self.finish(context)
+
+        wm = context.window_manager
+        wm.progress_begin(0, self._job.total)
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def cancel(self, context):
+        self._job.cancel()
+        if self._timer:
+            context.window_manager.event_timer_remove(self._timer)
+        context.window_manager.progress_end()
+        self.report({"INFO"}, "Optimizing canceled.")
+        return {"CANCELLED"}
+
+
+class TEXCOMPACTOR_OT_merge_duplicates(bpy.types.Operator):
+    bl_label = "Merge Duplicate Textures"
+    bl_idname = "texture_compactor.merge_duplicates"
+    bl_description = (
+        "Point every user of a duplicate texture at one copy, the copies are removed when the file is saved"
+    )
+    bl_options = {"REGISTER", "UNDO"}
+
+    max_near_lines = 12
+
+    near: bpy.props.BoolProperty(
+        name="Near Identical",
+        description="Merge the near identical textures instead of the identical ones",
+        default=False,
+        options={"SKIP_SAVE"},
+    )
+
+    def clusters(self, context):
+        return [c for c in core.find_duplicates(context.scene.TC_texture_metadata) if c.exact != self.near]
+
+    def invoke(self, context, event):
+        # near identical textures differ a little, list every pair so the user sees what gets merged
+        if self.near:
+            return context.window_manager.invoke_props_dialog(self, width=450)
+        return context.window_manager.invoke_confirm(self, event)
+
+    def draw(self, context):
+        col = self.layout.column(align=True)
+        col.label(text="These textures look alike but are not identical, merge them?", icon="QUESTION")
+        lines = [(c.keeper, info) for c in self.clusters(context) for info in c.duplicates]
+        for keeper, info in lines[: self.max_near_lines]:
+            col.label(text=f"{info.image.name} -> {keeper.image.name}")
+        if len(lines) > self.max_near_lines:
+            col.label(text=f"...and {len(lines) - self.max_near_lines} more, see the report")
+
+    def execute(self, context):
+        image_list = context.scene.TC_texture_metadata
+        clusters = self.clusters(context)
+        reclaimed = sum(cluster.reclaimable_mb for cluster in clusters)
+        merged = set(id(info) for info in dedup.merge(clusters, near=self.near))
+
+        # the merged copies have no users left, drop them from the results
+        kept = [info for info in image_list if id(info) not in merged]
+        image_list.clear()
+        image_list.extend(kept)
+        image_list.precompute(core.evaluate)
+        core.update_memory_usage(self, context)
+
+        self.report({"INFO"}, f"Merged {len(merged)} duplicate textures, {reclaimed:.1f}MB reclaimed")
+        return {"FINISHED"}
+
+
+class TEXCOMPACTOR_OT_clean_store(bpy.types.Operator):
+    bl_label = "Clean Up Optimized Textures"
+    bl_idname = "texture_compactor.clean_store"
+    bl_description = "Delete optimized textures whose source changed or disappeared"
+
     def execute(self, context):
-        # core.update_memory_usage(self, context)
-        core.optimize_images(self, context)
-        # core.update_memory_usage(self, context)
+        output_store = store.OutputStore(pro.output_folder())
+        removed, freed = output_store.collect_garbage()
+        self.report({"INFO"}, f"Removed {removed} stale optimized textures, freed {freed / 1024 / 1024:.1f}MB")
         return {"FINISHED"}
 
 
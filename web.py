@@ -46,10 +46,10 @@ html_template = """
             width: 10%;
         }}
         th:nth-child(4) {{
-            width: 15%;
+            width: 10%;
         }}
         th:nth-child(5) {{
-            width: 15%;
+            width: 10%;
         }}
         th:nth-child(6) {{
             width: 10%;
@@ -57,9 +57,31 @@ html_template = """
         th:nth-child(7) {{
             width: 10%;
         }}
+        th:nth-child(8) {{
+            width: 10%;
+        }}
+        th[onclick] {{
+            cursor: pointer;
+        }}
         .optimized {{
             background-color: #ddeedd;
         }}
+        .size-bar {{
+            width: 100%;
+            height: 18px;
+            display: flex;
+            justify-content: space-between;
+        }}
+        .size-fill {{
+            background-color: #eee;
+            height: 100%;
+        }}
+        .pager {{
+            text-align: center;
+        }}
+        #search {{
+            margin-left: 20px;
+        }}
         .copy-icon {{
             cursor: pointer;
             margin-left: 5px;
@@ -93,6 +115,15 @@ html_template = """
         }}
     </style>
     <script>
+        // only one page of textures is in the page at a time, so the report stays quick with thousands of them
+        var PAGE_SIZE = 100;
+        var textures = [];
+        var shown = [];
+        var page = 0;
+        var totalMemory = 1;
+        var sortKey = 'size_original';
+        var sortDescending = true;
+
         function copyToClipboard(text) {{
             navigator.clipboard.writeText(text).then(function() {{
                 console.log('Copied to clipboard successfully!');
@@ -101,47 +132,161 @@ html_template = """
             }});
         }}
 
+        function loadTextures() {{
+            var data = JSON.parse(document.getElementById('report-data').textContent);
+            textures = data.rows.map(function(row) {{
+                var texture = {{}};
+                data.columns.forEach(function(name, i) {{ texture[name] = row[i]; }});
+                return texture;
+            }});
+            totalMemory = textures.reduce(function(sum, t) {{ return sum + t.size_original; }}, 0) || 1;
+            toggleImages();
+        }}
+
         function toggleImages() {{
-            var showOptimized = document.getElementById('toggleButton').checked;
-            var rows = document.getElementsByClassName('image-row');
-            for (var i = 0; i < rows.length; i++) {{
-                if (!showOptimized) {{
-                    rows[i].style.display = 'table-row';
-                }} else {{
-                    if (rows[i].classList.contains('optimized')) {{
-                        rows[i].style.display = 'table-row';
-                    }} else {{
-                        rows[i].style.display = 'none';
-                    }}
-                }}
+            var onlyOptimized = document.getElementById('toggleButton').checked;
+            var search = document.getElementById('search').value.toLowerCase();
+            shown = textures.filter(function(t) {{
+                if (onlyOptimized && !t.optimized) return false;
+                return !search || t.name.toLowerCase().indexOf(search) >= 0 || t.path.toLowerCase().indexOf(search) >= 0;
+            }});
+            sortTextures();
+        }}
+
+        function sortBy(key) {{
+            if (key === sortKey) {{
+                sortDescending = !sortDescending;
+            }} else {{
+                sortKey = key;
+                sortDescending = key !== 'name';
             }}
+            sortTextures();
+        }}
+
+        function sortTextures() {{
+            var direction = sortDescending ? -1 : 1;
+            shown.sort(function(a, b) {{
+                var x = a[sortKey], y = b[sortKey];
+                if (x === y) return 0;
+                // textures without a value go last either way
+                if (x === null) return 1;
+                if (y === null) return -1;
+                return (x < y ? -1 : 1) * direction;
+            }});
+            showPage(0);
+        }}
+
+        function showPage(number) {{
+            var pages = Math.max(1, Math.ceil(shown.length / PAGE_SIZE));
+            page = Math.min(Math.max(number, 0), pages - 1);
+            var fragment = document.createDocumentFragment();
+            shown.slice(page * PAGE_SIZE, (page + 1) * PAGE_SIZE).forEach(function(t) {{
+                fragment.appendChild(textureRow(t));
+            }});
+            var body = document.getElementById('texture-rows');
+            body.textContent = '';
+            body.appendChild(fragment);
+            document.getElementById('page-info').textContent = 'Page ' + (page + 1) + ' of ' + pages + ', ' + shown.length + ' textures';
+            document.getElementById('previous-page').disabled = page === 0;
+            document.getElementById('next-page').disabled = page === pages - 1;
+        }}
+
+        function depthLabel(depth, half) {{
+            return depth + 'bit' + (half ? '(½)' : '');
+        }}
+
+        function addCell(row, text, title) {{
+            var cell = row.insertCell();
+            cell.textContent = text;
+            if (title) cell.title = title;
+            return cell;
+        }}
+
+        function textureRow(t) {{
+            var row = document.createElement('tr');
+            if (t.optimized) row.className = 'optimized';
+
+            var name = row.insertCell();
+            name.title = t.path;
+            name.style.textAlign = 'left';
+            var label = document.createElement('div');
+            label.className = 'thumbnail';
+            label.textContent = (t.packed ? '🔒' : '') + t.name;
+            if (t.packed) label.title = 'Cannot optimize packed images';
+            if (t.thumbnail) {{
+                var image = document.createElement('img');
+                image.className = 'thumbnail-image';
+                image.loading = 'lazy';
+                image.src = t.thumbnail.split('/').map(encodeURIComponent).join('/');
+                image.onerror = function() {{ this.style.display = 'none'; }};
+                label.appendChild(image);
+            }}
+            var copy = document.createElement('span');
+            copy.className = 'copy-icon';
+            copy.textContent = '⧉';
+            copy.onclick = function() {{ copyToClipboard(t.path); }};
+            name.appendChild(label);
+            name.appendChild(copy);
+
+            addCell(row, depthLabel(t.depth, t.half));
+            addCell(row, depthLabel(t.new_depth, t.new_half));
+            addCell(row, t.resolution);
+            addCell(row, t.new_resolution);
+            addCell(row, t.resize_psnr === null ? '-' : t.resize_psnr.toFixed(1) + ' dB', t.level_psnr);
+
+            var size = row.insertCell();
+            size.style.width = '150px';
+            var bar = document.createElement('div');
+            bar.className = 'size-bar';
+            var fill = document.createElement('div');
+            fill.className = 'size-fill';
+            fill.style.width = (t.size_original / totalMemory * 100).toFixed(2) + '%';
+            var value = document.createElement('span');
+            value.textContent = t.size_original.toFixed(2);
+            bar.appendChild(fill);
+            bar.appendChild(value);
+            size.appendChild(bar);
+
+            addCell(row, t.size_optimized.toFixed(2));
+            return row;
         }}
     </script>
 </head>
-<body onload="toggleImages()">
+<body onload="loadTextures()">
     <h1>Texture Compactor Scanning Report</h1>
     <div class="total-savings">
         {total_savings}
     </div>
     <div class="toggle-button">
         <label><input type="checkbox" id="toggleButton" onchange="toggleImages()" {checked}>Only Show Images Available for Optimization</label>
+        <input type="search" id="search" placeholder="Filter by name or path" oninput="toggleImages()">
     </div>
     <table>
         <thead>
             <tr>
-                <th>Image Name</th>
-                <th>Original Depth</th>
-                <th>Optimized Depth</th>
-                <th>Original Resolution</th>
-                <th>Optimized Resolution</th>
-                <th>Texture Memory (MB)</th>
-                <th>Optimized Memory (MB)</th>
+                <th onclick="sortBy('name')">Image Name</th>
+                <th onclick="sortBy('depth')">Original Depth</th>
+                <th onclick="sortBy('new_depth')">Optimized Depth</th>
+                <th onclick="sortBy('pixels')">Original Resolution</th>
+                <th onclick="sortBy('new_pixels')">Optimized Resolution</th>
+                <th onclick="sortBy('resize_psnr')" title="PSNR of the resized texture against the original, higher is closer">Resize Quality</th>
+                <th onclick="sortBy('size_original')">Texture Memory (MB)</th>
+                <th onclick="sortBy('size_optimized')">Optimized Memory (MB)</th>
             </tr>
         </thead>
-        <tbody>
-            {rows}
+        <tbody id="texture-rows">
         </tbody>
     </table>
+    <div class="pager">
+        <button id="previous-page" onclick="showPage(page - 1)">Previous</button>
+        <span id="page-info"></span>
+        <button id="next-page" onclick="showPage(page + 1)">Next</button>
+    </div>
+    <script id="report-data" type="application/json">{data}</script>
+    {packs}
+    {budget}
+    {duplicates}
+    {profile}
     <div class="total-savings">
         {notes}
     </div>
@@ -149,25 +294,127 @@ html_template = """
 </html>
 """
 
-row_template = """
-<tr class="image-row {highlight}">
-    <td title="{filepath}" style="text-align: left;">
-        <div class="thumbnail">
-            {name}
-            <img src="file://{filepath}" class="thumbnail-image" onerror="this.style.display='none'">
-        </div>
-        <span class="copy-icon" style="text-align: right;" onclick="copyToClipboard('{filepath}')">⧉</span>
-    </td>
-    <td>{original_bit_depth}</td>
-    <td>{new_bit_depth}</td>
-    <td>{original_resolution}</td>
-    <td>{new_resolution}</td>
-    <td style="width: 150px;">
-        <div style="width: 100%; height: 18px; display: flex; justify-content: space-between;">
-            <div style="background-color: #eee; height:100%; width:{size_percentage:.2f}%"></div>
-            <span>{size_original:.2f}</span>
-        </div>
-    </td>
-    <td>{size_optimized:.2f}</td>
+pack_table_template = """
+<h2 class="total-savings">Packed Greyscale Maps</h2>
+<table>
+    <thead>
+        <tr>
+            <th>Material</th>
+            <th>Red / Green / Blue</th>
+            <th>Textures</th>
+            <th>Memory Before (MB)</th>
+            <th>Memory After (MB)</th>
+        </tr>
+    </thead>
+    <tbody>
+        {rows}
+    </tbody>
+</table>
+"""
+
+pack_row_template = """
+<tr>
+    <td style="text-align: left;">{material}</td>
+    <td style="text-align: left;">{maps}</td>
+    <td>{textures} &rarr; 1</td>
+    <td>{size_before:.2f}</td>
+    <td>{size_after:.2f}</td>
+</tr>
+"""
+
+duplicate_table_template = """
+<h2 class="total-savings">Duplicate Textures</h2>
+<table>
+    <thead>
+        <tr>
+            <th>Kept</th>
+            <th>Duplicates</th>
+            <th>Match</th>
+            <th>Reclaimable Memory (MB)</th>
+        </tr>
+    </thead>
+    <tbody>
+        {rows}
+    </tbody>
+</table>
+"""
+
+duplicate_row_template = """
+<tr>
+    <td style="text-align: left;">{keeper}</td>
+    <td style="text-align: left;">{duplicates}</td>
+    <td>{kind}</td>
+    <td>{reclaimable:.2f}</td>
+</tr>
+"""
+budget_table_template = """
+<h2 class="total-savings">Fit to Budget: {summary}</h2>
+<table>
+    <thead>
+        <tr>
+            <th>Image Name</th>
+            <th>Change</th>
+            <th>Memory Saved (MB)</th>
+        </tr>
+    </thead>
+    <tbody>
+        {rows}
+    </tbody>
+</table>
+"""
+budget_row_template = """
+<tr>
+    <td style="text-align: left;">{name}</td>
+    <td style="text-align: left;">{reason}</td>
+    <td>{saved:.2f}</td>
+</tr>
+"""
+
+profile_table_template = """
+<h2 class="total-savings">Where the Time Went</h2>
+<div class="total-savings">{summary}</div>
+<table>
+    <thead>
+        <tr>
+            <th>Phase</th>
+            <th>Seconds</th>
+            <th>Share</th>
+        </tr>
+    </thead>
+    <tbody>
+        {phase_rows}
+    </tbody>
+</table>
+<table>
+    <thead>
+        <tr>
+            <th>Slowest Textures</th>
+            <th>Seconds</th>
+            <th>Phases</th>
+            <th>Read (MB)</th>
+            <th>Peak Memory (MB)</th>
+        </tr>
+    </thead>
+    <tbody>
+        {texture_rows}
+    </tbody>
+</table>
+"""
+
+phase_row_template = """
+<tr>
+    <td style="text-align: left;">{phase}</td>
+    <td>{seconds:.2f}</td>
+    <td>{share:.0f}%</td>
+</tr>
+"""
+
+profile_row_template = """
+<tr>
+    <td style="text-align: left;">{name}</td>
+    <td>{seconds:.2f}</td>
+    <td style="text-align: left;">{phases}</td>
+    <td>{read_mb:.1f}</td>
+    <td>{peak_mb}</td>
 </tr>
 """
@@ -0,0 +1,191 @@
+import concurrent.futures
+import multiprocessing
+import os
+
+import numpy as np
+
+from . import analysis
+from . import cache
+from . import pixels
+from . import profiling
+from . import sequence
+from . import settings
+from . import store
+
+# this runs in plain Python processes spawned from Blender's interpreter, never import bpy here
+
+# one set of analysis buffers per worker process, reused across textures
+_scratch = None
+
+
+def init_worker(memory_limit_mb):
+    """Cap the address space of the worker so a huge texture can't take the machine down.
+
+    Every core already has its own process, so OIIO decodes on a single thread.
+    """
+    pixels.oiio.attribute("threads", 1)
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows, the pixel buffer limit in scan_file still applies
+        return
+
+    limit = memory_limit_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as exc:
+        print(f"Could not limit scan worker memory: {exc}")
+
+
+def worker_count():
+    return settings.SCAN_WORKERS or os.cpu_count() or 1
+
+
+def create_pool(memory_limit_mb=None):
+    """Start a worker process pool, or return None if files can't be decoded outside Blender."""
+    if not pixels.available():
+        return None
+
+    # glibc reads this when a process starts, the spawned workers inherit it
+    os.environ.setdefault("MALLOC_ARENA_MAX", str(settings.WORKER_MALLOC_ARENAS))
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=worker_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(memory_limit_mb or settings.SCAN_WORKER_MEMORY_MB,),
+    )
+
+
+def save_pyramid(pyramid, content_hash):
+    """Keep the pyramid levels so the optimizer can write them without decoding the source again."""
+    for factor, level in pyramid.levels.items():
+        target = cache.pyramid_path(content_hash, factor)
+        if os.path.isfile(target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{os.getpid()}.tmp.npy"
+        try:
+            np.save(temp_path, level)
+            os.replace(temp_path, target)
+        except OSError as exc:
+            print(f"Could not store pyramid level {factor} of {content_hash}: {exc}")
+
+
+def save_thumbnail(target, pixel_data, pyramid):
+    """Keep a small 8 bit preview for the report, taken from the smallest pyramid level when there is one."""
+    if os.path.isfile(target):
+        return
+    if pyramid is not None:
+        source = pyramid.levels[analysis.PYRAMID_FACTORS[-1]]
+    else:
+        source = pixel_data
+    step = max(1, -(-max(source.shape[:2]) // settings.THUMBNAIL_SIZE))
+    if pyramid is not None:
+        thumbnail = pyramid.load(source[::step, ::step])
+    else:
+        thumbnail = source[::step, ::step].astype(np.float32) / pixels.max_value(source.dtype)
+    if pixel_data.dtype.kind == "f":
+        # float files are linear, the browser expects sRGB
+        thumbnail[..., :3] = analysis.srgb_encode(np.clip(thumbnail[..., :3], 0, 1))
+    thumbnail = np.clip(thumbnail * 255 + 0.5, 0, 255).astype(np.uint8)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        pixels.write_image(target, thumbnail)
+    except OSError as exc:
+        print(f"Could not store the thumbnail {target}: {exc}")
+
+
+def analyze_file(path, step, subimage=0, thumbnail=None):
+    """Decode and analyze one image, or one frame of a movie. Returns (record, pyramid) or None.
+
+    pyramid is None if a stored mip level was read instead of the full resolution.
+    thumbnail is where to keep a preview of the image for the report.
+    """
+    global _scratch
+
+    # leave half of the worker budget for the analysis itself
+    max_bytes = settings.SCAN_WORKER_MEMORY_MB * 1024 * 1024 // 2
+
+    # the pyramid is built from the full resolution strips while they stream past,
+    # its half resolution level (w * h * 2 bytes at float16) gets a quarter of the budget
+    header = pixels.read_info(path)
+    pyramid = None
+    if header and header["width"] * header["height"] * 2 <= max_bytes // 2:
+        pyramid = analysis.Pyramid(header["width"], header["height"])
+    with profiling.phase("decode"):
+        result = pixels.read_pixels(path, step, max_bytes, pyramid.add_strip if pyramid else None, subimage)
+    if result is None:
+        return None
+    profiling.add_bytes_read(profiling.file_size(path))
+    pixel_data, info = result
+
+    width = pixel_data.shape[1]
+    if _scratch is None or not _scratch.fits(width, 4):
+        _scratch = analysis.BlockScratch(width)
+
+    record = dict(info)
+    record.update(analysis.analyze(pixel_data, _scratch, info["is_float"]))
+
+    if pyramid is not None and not pyramid.complete:
+        pyramid = None
+    if pyramid is not None:
+        # the pyramid measures the resize error, that's part of deciding the sharpness
+        with profiling.phase("sharpness"):
+            scores = pyramid.finish(settings.RESIZE_PERCENTILE)
+        record["level_psnr"] = [scores[factor] for factor in analysis.PYRAMID_FACTORS]
+    if thumbnail is not None:
+        with profiling.phase("encode"):
+            save_thumbnail(thumbnail, pixel_data, pyramid)
+    return record, pyramid
+
+
+def scan_file(path, step):
+    """Decode and analyze one image file, returning a compact result record or None."""
+    # used to address the optimized outputs and the thumbnail
+    content_hash = hash_content(path)
+    result = analyze_file(path, step, thumbnail=cache.thumbnail_path(content_hash))
+    if result is None:
+        return None
+    record, pyramid = result
+    record["content_hash"] = content_hash
+    if pyramid is not None:
+        with profiling.phase("encode"):
+            save_pyramid(pyramid, content_hash)
+    return record
+
+
+def hash_content(path):
+    with profiling.phase("hash"):
+        profiling.add_bytes_read(profiling.file_size(path))
+        return store.content_hash(path)
+
+
+def hash_file(path):
+    """Only hash a frame of a sequence that isn't sampled, the optimized sequence still needs its address."""
+    return {"content_hash": hash_content(path)}
+
+
+def scan_movie(path, step, stride, full=False):
+    """Analyze the sampled frames of a movie one at a time and merge them, or return None.
+
+    Only one frame is ever decoded at once, so memory stays the same as for a
+    single image however long the movie is.
+    """
+    numbers = list(range(pixels.frame_count(path)))
+    content_hash = hash_content(path)
+    records = []
+    for number in sequence.sample_frames(numbers, stride, full):
+        # the first sampled frame stands for the movie in the report
+        thumbnail = None if records else cache.thumbnail_path(content_hash)
+        result = analyze_file(path, step, number, thumbnail)
+        if result is None:
+            return None
+        records.append(result[0])
+    if not records:
+        return None
+
+    record = analysis.merge_records(records)
+    record["content_hash"] = content_hash
+    # movie frames can't be written on their own, they have no address
+    record["frames"] = [[number + 1, None] for number in numbers]
+    return record